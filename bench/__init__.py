@@ -0,0 +1,7 @@
+# bench — офлайн-бенчмарки; запуск из корня репозитория: python -m bench.<name>
+import os
+import sys
+
+# bot.py валидирует токен при импорте — для бенчей достаточно фиктивного
+os.environ.setdefault("BOT_TOKEN", "123456:BENCH-TOKEN")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,71 @@
+# Экран «Последние сделки» при 1M сделок в истории: прежняя склейка живых
+# сделок со всей историей и сортировка против страниц DealTimeline.
+import os
+import random
+import time
+
+from deals import Deal, DealRegistry, DealSummary, DealTimeline
+
+HISTORY = int(os.getenv("BENCH_HISTORY", "1000000"))
+LIVE = int(os.getenv("BENCH_LIVE", "10000"))
+USERS = HISTORY // 10
+PAGE = 20
+
+
+def legacy_recent(deals: DealRegistry, history: dict) -> list:
+    # admin_recent до ленты
+    items = list(deals.values()) + [d for hs in history.values() for d in hs]
+    return sorted(items, key=lambda x: x.created_at or 0, reverse=True)[:PAGE]
+
+
+def timed(fn, runs: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - t0) / runs * 1000
+
+
+def main():
+    rng = random.Random(4)
+    history: dict = {}
+    deals = DealRegistry()
+    recs = []
+    t0 = time.perf_counter()
+    for i in range(HISTORY):
+        uid = rng.randrange(USERS)
+        h = DealSummary(f"h{i}", uid, uid + 1, f"Gift {i}", "10.0 TON", "done", 1_700_000_000 + i)
+        history.setdefault(uid, []).insert(0, h)
+        recs.append(h)
+    for i in range(LIVE):
+        d = Deal(f"d{i}", i, f"Live {i}", "", "TON", "@s", created_at=1_700_000_000 + HISTORY + i, expires_at=0)
+        deals.put(d)
+        recs.append(d)
+    build = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    timeline = DealTimeline()
+    recs.sort(key=lambda r: r.created_at or 0)  # как Memory.load
+    for rec in recs:
+        timeline.add(rec)
+    load = time.perf_counter() - t0
+
+    assert [r.id for r in legacy_recent(deals, history)] == [r.id for r in timeline.page(PAGE)[0]]
+
+    old_ms = timed(lambda: legacy_recent(deals, history), 3)
+    first_ms = timed(lambda: timeline.page(PAGE), 2000)
+
+    def walk(pages: int):
+        older = None
+        for _ in range(pages):
+            _, older, _ = timeline.page(PAGE, before=older)
+    deep_ms = timed(lambda: walk(100), 20) / 100
+
+    print(f"{HISTORY} deals in history + {LIVE} live ({USERS} users), generated in {build:.1f} s")
+    print(f"legacy concat+sort : {old_ms:10.1f} ms per screen")
+    print(f"timeline, page 1   : {first_ms * 1000:10.1f} µs per screen")
+    print(f"timeline, pages 1-100: {deep_ms * 1000:8.1f} µs per screen")
+    print(f"timeline build at startup (sort + add): {load * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
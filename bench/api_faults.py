@@ -0,0 +1,104 @@
+# Сбои Bot API: голый AiohttpSession (как было — except Exception: pass) против
+# session.ResilientSession. Два замера:
+#   1) flaky: доля BENCH_FAIL_RATE ответов — 500, ещё BENCH_429_RATE — RetryAfter 1 с;
+#      уведомления (sendMessage) и уборка (deleteMessage) вперемешку: сколько
+#      уведомлений дошло и во что это обошлось запросами;
+#   2) outage: API BENCH_OUTAGE_S секунд отвечает 500 на всё — предохранитель
+#      размыкается, уборка не доходит до сети, уведомления переживают сбой повторами.
+#      Время предохранителя сжато под длину сбоя: окно OUTAGE_S, cooldown 1 с.
+#
+#   BENCH_CALLS=400 BENCH_FAIL_RATE=0.2 python -m bench.api_faults
+import asyncio
+import os
+import statistics
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from bench.fake_api import FakeBotAPI
+from session import CircuitBreaker, CircuitOpen, ResilientSession
+
+CALLS = int(os.getenv("BENCH_CALLS", "400"))
+FAIL_RATE = float(os.getenv("BENCH_FAIL_RATE", "0.2"))
+RATE_429 = float(os.getenv("BENCH_429_RATE", "0.05"))
+OUTAGE_S = float(os.getenv("BENCH_OUTAGE_S", "3"))
+CONCURRENCY = 32
+
+
+async def traffic(bot: Bot, api: FakeBotAPI, spread: float = 0.0) -> dict:
+    slots = asyncio.Semaphore(CONCURRENCY)
+    sent, latencies, deleted, shed = [], [], [], 0
+
+    async def one(i: int):
+        nonlocal shed
+        await asyncio.sleep(spread * i / CALLS)
+        async with slots:
+            t0 = time.perf_counter()
+            try:
+                if i % 2:
+                    await bot.delete_message(1000 + i % 50, i)
+                    deleted.append(i)
+                else:
+                    await bot.send_message(1000 + i % 50, f"notice {i}")
+                    sent.append(i)
+                    latencies.append(time.perf_counter() - t0)
+            except CircuitOpen:
+                shed += 1
+            except Exception:
+                pass
+
+    api.reset()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(CALLS)))
+    latencies.sort()
+    return {"sent": len(sent), "deleted": len(deleted), "shed": shed, "requests": api.api_calls(),
+            "seconds": time.perf_counter() - started,
+            "p50": statistics.median(latencies) * 1000 if latencies else 0.0,
+            "p99": latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000 if latencies else 0.0}
+
+
+def line(label: str, r: dict) -> str:
+    half = CALLS // 2
+    return (f"{label:10s} notices {r['sent']:4d}/{half}  deletes {r['deleted']:4d}/{half} (shed {r['shed']:3d})  "
+            f"API requests {r['requests']:5d}  notice p50 {r['p50']:6.0f} ms p99 {r['p99']:6.0f} ms  {r['seconds']:.1f}s")
+
+
+async def outage(api: FakeBotAPI) -> None:
+    api.down = True
+    await asyncio.sleep(OUTAGE_S)
+    api.down = False
+
+
+async def main():
+    api = FakeBotAPI(latency_ms=10, jitter_ms=10, error_rate=RATE_429, server_error_rate=FAIL_RATE)
+    url = await api.start()
+    server = TelegramAPIServer.from_base(url)
+    print(f"{CALLS} calls (half sendMessage, half deleteMessage), {FAIL_RATE:.0%} 500 + {RATE_429:.0%} 429 on sends, "
+          f"outage {OUTAGE_S:.0f}s")
+    try:
+        sessions = (("plain", lambda: AiohttpSession(api=server)),
+                    ("resilient", lambda: ResilientSession(api=server, breaker=CircuitBreaker(window=OUTAGE_S, cooldown=1.0))))
+        for label, make in sessions:
+            session = make()
+            bot = Bot("123456:BENCH", session=session)
+            api.server_error_rate = FAIL_RATE
+            print(line(label, await traffic(bot, api)), flush=True)
+            # сбой посреди потока: вызовы растянуты на OUTAGE_S * 2, первая половина — в отказ
+            api.server_error_rate = 0.0
+            r, _ = await asyncio.gather(traffic(bot, api, spread=OUTAGE_S * 2), outage(api))
+            print(line("  outage", r), flush=True)
+            if isinstance(session, ResilientSession):
+                retries = {}
+                for (_, reason), n in session.retries.items():
+                    retries[reason] = retries.get(reason, 0) + n
+                print(f"{'':10s} retries by reason {retries}, circuit opened {session.breaker.opened} times, "
+                      f"now {session.breaker.state}")
+            await session.close()
+    finally:
+        await api.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
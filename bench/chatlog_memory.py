@@ -0,0 +1,82 @@
+# Память журнала чата: старый dict[uid] -> list[(datetime, who, text)] против
+# ChatLog (кольцо + сжатые сегменты) при росте числа записей на пользователя,
+# и время выборки последних 50 записей.
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from chatlog import ChatLog
+
+USERS = int(os.getenv("BENCH_USERS", "500"))
+SIZES = [int(x) for x in os.getenv("BENCH_SIZES", "50,200,800").split(",")]
+TAIL = 50
+
+
+def panel_text(rng: random.Random, i: int) -> str:
+    # похоже на то, что show_panel кладёт в журнал: HTML панели с данными сделки
+    return (f"🧾 <b>Ордер #{i}</b>\n\n<b>Название:</b> Gift {rng.randrange(10**6)}\n"
+            f"<b>Описание:</b> Plush Pepe, mint {rng.randrange(10**4)}\n"
+            f"<b>Цена:</b> {rng.randrange(1, 500)} TON\n<b>Покупатель:</b> @user{rng.randrange(10**5)}\n"
+            "⏳ Ссылка активна 30 минут. Отправьте её продавцу кнопкой ниже.")
+
+
+def fill_legacy(per_user: int) -> dict:
+    rng = random.Random(1)
+    log = {}
+    for uid in range(USERS):
+        for i in range(per_user):
+            who = "bot" if i % 3 else "user"
+            log.setdefault(uid, []).append((datetime.now(timezone.utc), who, panel_text(rng, i)))
+    return log
+
+
+def fill_chatlog(per_user: int, path: str) -> ChatLog:
+    rng = random.Random(1)
+    log = ChatLog(path)
+    for uid in range(USERS):
+        for i in range(per_user):
+            log.append(uid, "bot" if i % 3 else "user", panel_text(rng, i))
+    log.sync()
+    return log
+
+
+def measure(fill):
+    tracemalloc.start()
+    obj = fill()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, used
+
+
+def tail_us(fn, rounds: int = 2000) -> float:
+    rng = random.Random(2)
+    uids = [rng.randrange(USERS) for _ in range(rounds)]
+    t0 = time.perf_counter()
+    for uid in uids:
+        fn(uid)
+    return (time.perf_counter() - t0) / rounds * 1e6
+
+
+def main():
+    print(f"{USERS} users, tail({TAIL})")
+    print(f"{'per user':>9} | {'legacy KiB/user':>15} {'tail µs':>8} | {'ChatLog KiB/user':>16} {'tail µs':>8} "
+          f"{'tail(400) µs':>12} {'on disk KiB/user':>16}")
+    for per_user in SIZES:
+        legacy, legacy_bytes = measure(lambda: fill_legacy(per_user))
+        legacy_tail = tail_us(lambda uid: legacy.get(uid, [])[-TAIL:])
+        del legacy
+        with tempfile.TemporaryDirectory() as tmp:
+            log, log_bytes = measure(lambda: fill_chatlog(per_user, tmp))
+            log_tail = tail_us(lambda uid: log.tail(uid, TAIL))
+            deep_tail = tail_us(lambda uid: log.tail(uid, 400), rounds=200)
+            disk = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp))
+            log.close()
+        print(f"{per_user:9d} | {legacy_bytes / USERS / 1024:15.1f} {legacy_tail:8.2f} | "
+              f"{log_bytes / USERS / 1024:16.1f} {log_tail:8.2f} {deep_tail:12.1f} {disk / USERS / 1024:16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# has_active_deal: линейный проход по memory.deals против индекса DealRegistry.
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from deals import ACTIVE_STATUSES, Deal, DealRegistry
+
+SIZES = [int(x) for x in os.getenv("BENCH_SIZES", "10000,100000,1000000").split(",")]
+LOOKUPS = 2000
+STATUSES = ("new", "await_payment", "await_seller_final")
+
+
+def now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def scan(deals: dict, uid: int) -> bool:
+    # прежняя реализация has_active_deal
+    for d in deals.values():
+        if d.get("creator_id") == uid and d.get("status") in ACTIVE_STATUSES and now() < d.get("expires_at", now()):
+            return True
+    return False
+
+
+def bench(n: int) -> None:
+    users = max(n // 5, 1)
+    expires = now() + timedelta(minutes=30)
+    reg = DealRegistry()
+    plain = {}
+    for i in range(n):
+        reg.put(Deal(f"d{i}", i % users, "t", "", "TON", "@u", created_at=0, expires_at=expires, status=STATUSES[i % 3]))
+        plain[f"d{i}"] = {"id": f"d{i}", "creator_id": i % users, "seller_id": None,
+                          "status": STATUSES[i % 3], "expires_at": expires}
+    missing = users + 1  # худший случай: у пользователя нет сделок
+
+    scan_runs = max(1, min(LOOKUPS, 2_000_000 // n))
+    t0 = time.perf_counter()
+    for _ in range(scan_runs):
+        scan(plain, missing)
+    scan_us = (time.perf_counter() - t0) / scan_runs * 1e6
+
+    t0 = time.perf_counter()
+    for i in range(LOOKUPS):
+        reg.has_active_for_creator(i % users, time.time())
+    idx_us = (time.perf_counter() - t0) / LOOKUPS * 1e6
+
+    t0 = time.perf_counter()
+    for i in range(LOOKUPS):
+        d = reg[f"d{i % n}"]   # BENCH_SIZES меньше LOOKUPS — по кругу
+        reg.set_status(d, "await_payment" if d.status == "new" else "new")
+    tr_us = (time.perf_counter() - t0) / LOOKUPS * 1e6
+
+    print(f"{n:>9} deals: scan {scan_us:12.1f} us/lookup | index {idx_us:6.2f} us/lookup | transition {tr_us:5.2f} us")
+
+
+if __name__ == "__main__":
+    for size in SIZES:
+        bench(size)
@@ -0,0 +1,90 @@
+# Память на 100k сделок: прежние dict-снапшоты (20 ключей, два datetime) и
+# копии в истории против Deal со __slots__ и DealSummary в истории.
+import os
+import pickle
+import random
+import secrets
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from deals import Deal
+
+N = int(os.getenv("BENCH_DEALS", "100000"))
+METHODS = ("RUB", "USD", "KZT", "STARS", "TON", "EXCHANGE")
+
+
+def fields(rng: random.Random, i: int) -> dict:
+    method = METHODS[i % len(METHODS)]
+    return {
+        "id": secrets.token_urlsafe(8),
+        "creator_id": 10_000 + i,
+        "creator_username": f"@buyer{i}",
+        "title": f"Gift #{rng.randrange(10**6)}",
+        "desc": f"Plush Pepe, mint {rng.randrange(10**4)}",
+        "price_value": None if method == "EXCHANGE" else float(rng.randrange(1, 500)),
+        "exchange_desc": f"swap for {rng.randrange(100)} stars" if method == "EXCHANGE" else None,
+        "method": method,
+        "target_user": f"@seller{i}",
+    }
+
+
+def legacy(rng: random.Random, i: int) -> dict:
+    # как create_input собирал snapshot раньше
+    f = fields(rng, i)
+    f.update({
+        "lang": "ru",
+        "status": "new",
+        "created_at": datetime.now(timezone.utc),
+        "expires_at": datetime.now(timezone.utc) + timedelta(minutes=30),
+        "seller_id": None,
+        "seller_deadline": None,
+        "deep_link": f"https://t.me/bot?start=deal_{f['id']}",
+        "seller_payto": None,
+        "memo": None,
+    })
+    return f
+
+
+def compact(rng: random.Random, i: int) -> Deal:
+    f = fields(rng, i)
+    now = int(datetime.now(timezone.utc).timestamp())
+    return Deal(**f, lang="ru", created_at=now, expires_at=now + 30 * 60,
+                deep_link=f"https://t.me/bot?start=deal_{f['id']}")
+
+
+def measure(build):
+    tracemalloc.start()
+    obj = build()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, used
+
+
+def main():
+    def live(make):
+        rng = random.Random(5)
+        out = [make(rng, i) for i in range(N)]
+        for d in out:
+            if isinstance(d, Deal):
+                d.price_label  # кэш метки цены тоже считаем
+        return out
+
+    old_live, old_live_b = measure(lambda: live(legacy))
+    new_live, new_live_b = measure(lambda: live(compact))
+    # история: прежде d.copy() целиком, теперь DealSummary
+    _, old_hist_b = measure(lambda: [d.copy() for d in old_live])
+    _, new_hist_b = measure(lambda: [d.summary() for d in new_live])
+    old_pickle = sum(len(pickle.dumps(d, pickle.HIGHEST_PROTOCOL)) for d in old_live[:10000]) / min(N, 10000)
+    new_pickle = sum(len(pickle.dumps(d, pickle.HIGHEST_PROTOCOL)) for d in new_live[:10000]) / min(N, 10000)
+
+    scale = 100_000 / N
+    print(f"{N} deals, numbers per 100k")
+    print(f"{'':14s} {'live MiB':>9s} {'history MiB':>12s} {'store B/deal':>13s}")
+    print(f"{'dict snapshot':14s} {old_live_b * scale / 2**20:9.1f} {old_hist_b * scale / 2**20:12.1f} {old_pickle:13.0f}")
+    print(f"{'Deal/Summary':14s} {new_live_b * scale / 2**20:9.1f} {new_hist_b * scale / 2**20:12.1f} {new_pickle:13.0f}")
+    print(f"saved: live {1 - new_live_b / old_live_b:.0%}, history {1 - new_hist_b / old_hist_b:.0%}, "
+          f"store {1 - new_pickle / old_pickle:.0%}")
+
+
+if __name__ == "__main__":
+    main()
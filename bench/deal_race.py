@@ -0,0 +1,139 @@
+# Стресс: на каждую сделку одновременно летят конфликтующие нажатия и
+# дедлайны (stop против confirm, двойной paid, двойной finish, истечение
+# посреди «обработки» confirm). Проверяем инварианты машины состояний:
+# применённые события — допустимый путь по TRANSITIONS, не больше одного
+# финального перехода, архив не больше одного раза, снятая сделка не
+# возвращается в реестр/индексы/дедлайны.
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict
+
+os.environ.setdefault("OUT_GLOBAL_RATE", "100000")
+os.environ.setdefault("OUT_CHAT_RATE", "100000")
+
+import bot as botmod  # noqa: E402
+from bench import harness  # noqa: E402
+from bench.fake_api import FakeBotAPI  # noqa: E402
+from deals import FINAL_STATUSES, TRANSITIONS, Deal, Status  # noqa: E402
+
+DEALS = int(os.getenv("BENCH_DEALS", "400"))
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "3"))
+
+# стартовый статус -> что прилетает одновременно: ("cb", кто, data) или ("deadline", kind)
+SCENARIOS = [
+    (Status.NEW, [("cb", "seller", "deal:{id}:stop"), ("cb", "seller", "deal:{id}:confirm"),
+                  ("cb", "seller", "deal:{id}:confirm"), ("deadline", "expires_at")]),
+    (Status.NEW, [("cb", "seller", "deal:{id}:decline"), ("cb", "seller", "deal:{id}:confirm"),
+                  ("cb", "seller", "deal:{id}:stop")]),
+    (Status.AWAIT_PAYMENT, [("cb", "buyer", "paid:{id}"), ("cb", "buyer", "paid:{id}"),
+                            ("cb", "seller", "deal:{id}:stop"), ("deadline", "seller_deadline")]),
+    (Status.AWAIT_SELLER_FINAL, [("cb", "seller", "finish:{id}"), ("cb", "seller", "finish:{id}"),
+                                 ("cb", "buyer", "paid:{id}"), ("deadline", "expires_at")]),
+]
+
+
+def make_deal(i: int, status: Status, now: int) -> Deal:
+    return Deal(f"race{i:05d}", 10_000 + i, f"Gift {i}", "desc", "STARS", f"@u{50_000 + i}",
+                created_at=now, expires_at=now + 1800, price_value=5.0, status=status,
+                seller_id=50_000 + i, seller_username=f"@u{50_000 + i}", seller_payto="@payto",
+                seller_deadline=now + 900 if status == Status.AWAIT_PAYMENT else None)
+
+
+async def fire(rng: random.Random, d: Deal, actions: list) -> None:
+    async def one(action):
+        await asyncio.sleep(rng.uniform(0, 0.02))
+        if action[0] == "deadline":
+            await botmod.on_deadline(d.id, action[1])
+            return
+        uid = d.creator_id if action[1] == "buyer" else d.seller_id
+        await harness.feed(harness.callback(uid, action[2].format(id=d.id)))
+    await asyncio.gather(*(one(a) for a in actions))
+
+
+def check(deals: list, applied: dict) -> list:
+    memory = botmod.memory
+    archived = defaultdict(int)
+    for hs in memory.history.values():
+        for h in hs:
+            archived[h.id] += 1
+    errors = []
+    for start, d in deals:
+        path = applied[d.id]
+        status = start
+        for event, to in path:
+            if TRANSITIONS.get((status, event)) != to:
+                errors.append(f"{d.id}: {event} from {status}")
+            status = to
+        finals = sum(1 for _, to in path if to in FINAL_STATUSES)
+        if finals > 1:
+            errors.append(f"{d.id}: {finals} final transitions {path}")
+        if archived[d.id] > 1:
+            errors.append(f"{d.id}: archived {archived[d.id]} times")
+        live = memory.deals.get(d.id)
+        if status in FINAL_STATUSES:
+            if live is not None or d.id in memory.deals._by_status.get(status, ()) or \
+                    (d.id, "expires_at") in memory.deadlines or (d.id, "seller_deadline") in memory.deadlines:
+                errors.append(f"{d.id}: final ({status}) but still live/indexed/scheduled")
+        elif live is not d:
+            errors.append(f"{d.id}: active ({status}) but not in registry")
+    return errors
+
+
+async def main():
+    api = FakeBotAPI(latency_ms=3, jitter_ms=5)
+    url = await api.start()
+    bot = harness.attach(url)
+    botmod.CONFIRM_DELAY = (0.005, 0.03)   # короче реальных 4-7 с, но так же посреди остальных нажатий
+    rng = random.Random(11)
+    total_events = total_applied = total_rejected = 0
+    errors = []
+    t0 = time.perf_counter()
+    try:
+        for _ in range(ROUNDS):
+            botmod.memory = botmod.Memory()
+            memory = botmod.memory
+            applied = defaultdict(list)
+            original = memory.transition
+
+            async def logged(d, event, original=original, applied=applied):
+                to = await original(d, event)
+                applied[d.id].append((event, to))
+                return to
+            memory.transition = logged
+            worker = asyncio.create_task(botmod.outbox_worker())
+
+            now = int(time.time())
+            deals = []
+            for i in range(DEALS):
+                start, actions = SCENARIOS[i % len(SCENARIOS)]
+                d = make_deal(i, start, now)
+                memory.put_deal(d)
+                deals.append((start, d, actions))
+            await asyncio.gather(*(fire(rng, d, actions) for _, d, actions in deals))
+            await memory.outbox.drain()
+            await botmod.outbound.drain()
+            worker.cancel()
+            errors += check([(s, d) for s, d, _ in deals], applied)
+            events = sum(len(a) for _, _, a in deals)
+            done = sum(len(p) for p in applied.values())
+            total_events += events
+            total_applied += done
+            total_rejected += events - done
+    finally:
+        await bot.session.close()
+        await api.stop()
+    print(f"{ROUNDS} rounds x {DEALS} deals, {total_events} conflicting events in {time.perf_counter() - t0:.1f} s")
+    print(f"applied transitions: {total_applied}, rejected/no-op: {total_rejected}, live locks left: "
+          f"{len(botmod.memory.deal_locks)}")
+    if errors:
+        print(f"INVARIANT VIOLATIONS: {len(errors)}")
+        for e in errors[:20]:
+            print("  " + e)
+        raise SystemExit(1)
+    print("invariants: OK")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
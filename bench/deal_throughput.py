@@ -0,0 +1,70 @@
+# Пропускная способность полного цикла сделки (load_test) при трёх схемах
+# синхронизации: без замков (как было), замок на сделку, один общий замок.
+# Замок на сделку должен стоить почти ноль, общий — съедать параллельность.
+import asyncio
+import contextlib
+import os
+import random
+import time
+
+os.environ.setdefault("BENCH_THINK_MS", "0")
+os.environ.setdefault("BENCH_PAIRS", "200")
+os.environ.setdefault("BENCH_DEALS", "2")
+os.environ.setdefault("OUT_GLOBAL_RATE", "100000")
+os.environ.setdefault("OUT_CHAT_RATE", "100000")
+
+import bot as botmod  # noqa: E402
+from bench import harness, load_test  # noqa: E402
+from bench.fake_api import FakeBotAPI  # noqa: E402
+from deals import DealLocks  # noqa: E402
+
+
+class NoLocks:
+    # nullcontext с 3.10 годится и для async with
+    def __call__(self, deal_id):
+        return contextlib.nullcontext()
+
+
+class GlobalLock:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+
+    def __call__(self, deal_id):
+        return self.lock
+
+
+async def run(name: str, locks) -> None:
+    api = FakeBotAPI(latency_ms=load_test.API_LATENCY_MS, jitter_ms=load_test.API_JITTER_MS)
+    url = await api.start()
+    bot = harness.attach(url)
+    botmod.memory = botmod.Memory()
+    botmod.memory.deal_locks = locks
+    botmod.CONFIRM_DELAY = (0, 0)
+    worker = asyncio.create_task(botmod.outbox_worker())
+    load = load_test.Load(random.Random(3))
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(load.pair(i) for i in range(load_test.PAIRS)))
+        await botmod.memory.outbox.drain()
+        await botmod.outbound.drain()
+    finally:
+        elapsed = time.perf_counter() - started
+        worker.cancel()
+        await bot.session.close()
+        await api.stop()
+    every = [x for v in load.latency.values() for x in v]
+    print(f"{name:16s} {load.deals_done / elapsed:8.1f} deals/s {load.updates / elapsed:8.0f} upd/s   "
+          f"handler p50 {load_test.pct(every, 0.5):6.1f} ms  p99 {load_test.pct(every, 0.99):7.1f} ms  "
+          f"({load.deals_done} done, {load.deals_failed} failed)")
+
+
+async def main():
+    print(f"{load_test.PAIRS} pairs x {load_test.DEALS} deals, API latency {load_test.API_LATENCY_MS:.0f}"
+          f"±{load_test.API_JITTER_MS:.0f} ms, no think time")
+    await run("no locks", NoLocks())
+    await run("lock per deal", DealLocks())
+    await run("one global lock", GlobalLock())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
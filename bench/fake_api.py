@@ -0,0 +1,178 @@
+# Локальная замена api.telegram.org для бенчей: пишет вызовы, добавляет задержку
+# и отдаёт 429, если бот превышает лимиты (глобальный и на чат), и 500 — на сбоях.
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import defaultdict, deque
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+
+class FakeBotAPI:
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 global_limit: Optional[int] = None, chat_limit: Optional[int] = None,
+                 error_rate: float = 0.0, retry_after: int = 1, server_error_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.global_limit = global_limit    # сообщений в секунду на бота
+        self.chat_limit = chat_limit        # сообщений в секунду в один чат
+        self.error_rate = error_rate        # доля случайных 429
+        self.retry_after = retry_after
+        self.server_error_rate = server_error_rate  # доля случайных 500 на любом методе
+        self.down = False                   # True — всё, кроме getUpdates, отвечает 500
+        self.failed = 0
+        self.calls: List[tuple] = []        # (monotonic, method, params)
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.rejected = 0
+        self.not_modified = 0
+        self.updates: deque = deque()       # для getUpdates (dict'ы апдейтов)
+        self._has_updates = asyncio.Event()
+        self._waiters: Dict[str, List[asyncio.Future]] = defaultdict(list)  # chat_id -> ждущие ответа
+        self._shown: Dict[tuple, tuple] = {}  # (chat_id, message_id) -> (text, reply_markup)
+        self._window: deque = deque()
+        self._chat_windows: Dict[str, deque] = defaultdict(deque)
+        self._ids = itertools.count(100000)
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    # --- жизненный цикл ---
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    def reset(self) -> None:
+        self.calls.clear()
+        self.counts.clear()
+        self.rejected = 0
+        self.not_modified = 0
+        self.failed = 0
+
+    def push_update(self, update: dict) -> None:
+        self.updates.append(update)
+        self._has_updates.set()
+
+    def next_reply(self, chat_id) -> asyncio.Future:
+        """Future, который завершится на следующем sendMessage/editMessageText в чат."""
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters[str(chat_id)].append(fut)
+        return fut
+
+    def _replied(self, chat_id: str) -> None:
+        for fut in self._waiters.pop(chat_id, ()):
+            if not fut.done():
+                fut.set_result(time.perf_counter())
+
+    def api_calls(self, *methods: str) -> int:
+        return sum(self.counts[m] for m in methods) if methods else sum(self.counts.values())
+
+    # --- лимиты ---
+    @staticmethod
+    def _hit(window: deque, limit: Optional[int], at: float) -> bool:
+        while window and at - window[0] >= 1.0:
+            window.popleft()
+        if limit is not None and len(window) >= limit:
+            return True
+        window.append(at)
+        return False
+
+    def _limited(self, method: str, params: dict, at: float) -> bool:
+        if method not in ("sendMessage", "editMessageText"):
+            return False
+        if self.error_rate and random.random() < self.error_rate:
+            return True
+        chat = str(params.get("chat_id"))
+        if self._hit(self._chat_windows[chat], self.chat_limit, at):
+            return True
+        return self._hit(self._window, self.global_limit, at)
+
+    # --- ответы ---
+    def _message(self, params: dict, message_id: Optional[int] = None) -> dict:
+        chat_id = int(params.get("chat_id") or 0)
+        msg = {
+            "message_id": message_id or next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }
+        if params.get("reply_markup"):
+            msg["reply_markup"] = json.loads(params["reply_markup"])
+        return msg
+
+    def result_for(self, method: str, params: dict):
+        if method in ("sendMessage",):
+            return self._message(params)
+        if method == "editMessageText":
+            return self._message(params, int(params.get("message_id") or 0) or None)
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        return True
+
+    async def get_updates(self, params: dict) -> list:
+        # long polling как у Telegram: ждём до timeout секунд, пока что-то не придёт
+        if not self.updates:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        out = list(self.updates)
+        self.updates.clear()
+        return out
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        at = time.monotonic()
+        self.calls.append((at, method, params))
+        self.counts[method] += 1
+        delay = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if method == "getUpdates":
+            # сетевой круг делим пополам: запрос до сервера и ответ обратно;
+            # апдейты, пришедшие между ответом и следующим запросом, ждут
+            await asyncio.sleep(delay / 2000)
+            result = await self.get_updates(params)
+            await asyncio.sleep(delay / 2000)
+            return web.json_response({"ok": True, "result": result})
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        if self.down or (self.server_error_rate and random.random() < self.server_error_rate):
+            self.failed += 1
+            return web.json_response({"ok": False, "error_code": 500, "description": "Internal Server Error"},
+                                     status=500)
+        if self._limited(method, params, at):
+            self.rejected += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+        if method in ("sendMessage", "editMessageText"):
+            content = (params.get("text", ""), params.get("reply_markup"))
+            if method == "editMessageText":
+                key = (str(params.get("chat_id")), str(params.get("message_id")))
+                if self._shown.get(key) == content:
+                    self.not_modified += 1
+                    return web.json_response({
+                        "ok": False, "error_code": 400,
+                        "description": "Bad Request: message is not modified: specified new message content "
+                                       "and reply markup are exactly the same as a current content and reply markup of the message",
+                    })
+            result = self.result_for(method, params)
+            self._shown[(str(params.get("chat_id")), str(result["message_id"]))] = content
+            self._replied(str(params.get("chat_id")))
+            return web.json_response({"ok": True, "result": result})
+        return web.json_response({"ok": True, "result": self.result_for(method, params)})
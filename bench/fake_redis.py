@@ -0,0 +1,234 @@
+# Локальная замена Redis для бенчей общего store (redisstore.py): RESP2 поверх
+# asyncio, только нужные боту команды — строки с PX, множества, WATCH/MULTI/EXEC,
+# PUBLISH/SUBSCRIBE. Один loop — каждая команда атомарна сама по себе.
+#
+#   python -m bench.fake_redis 6379     # отдельным процессом для ручных прогонов
+import asyncio
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set
+
+OK = object()
+QUEUED = object()
+NIL_ARRAY = object()
+
+
+def encode(value) -> bytes:
+    if value is OK:
+        return b"+OK\r\n"
+    if value is QUEUED:
+        return b"+QUEUED\r\n"
+    if value is None:
+        return b"$-1\r\n"
+    if value is NIL_ARRAY:
+        return b"*-1\r\n"
+    if isinstance(value, Exception):
+        return b"-ERR %s\r\n" % str(value).encode()
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    return b"*%d\r\n" % len(value) + b"".join(encode(v) for v in value)
+
+
+class Client:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.watched: Dict[bytes, int] = {}    # ключ -> его версия на момент WATCH
+        self.queue: Optional[List[list]] = None  # внутри MULTI
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data: Dict[bytes, object] = {}          # bytes или set
+        self.expires: Dict[bytes, float] = {}
+        self.versions: Dict[bytes, int] = defaultdict(int)   # для WATCH: сколько раз ключ меняли
+        self.channels: Dict[bytes, Set[asyncio.StreamWriter]] = defaultdict(set)
+        self.commands: Counter = Counter()
+        self.aborted = 0      # EXEC, отменённые из-за WATCH
+        self.round_trips = 0  # пачек команд (пайплайн — одна)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.url = ""
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._server = await asyncio.start_server(self._serve, host, port)
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = f"redis://{host}:{port}/0"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+
+    def reset(self) -> None:
+        self.commands.clear()
+        self.aborted = 0
+        self.round_trips = 0
+
+    # --- хранилище ---
+    def _get(self, key: bytes):
+        at = self.expires.get(key)
+        if at is not None and at <= time.time():
+            self._delete(key)
+        return self.data.get(key)
+
+    def _touch(self, key: bytes) -> None:
+        self.versions[key] += 1
+
+    def _delete(self, key: bytes) -> int:
+        self.expires.pop(key, None)
+        if self.data.pop(key, None) is None:
+            return 0
+        self._touch(key)
+        return 1
+
+    def _set(self, key: bytes) -> set:
+        value = self._get(key)
+        if value is None:
+            value = self.data[key] = set()
+        return value
+
+    # --- команды ---
+    def execute(self, client: Client, args: List[bytes]):
+        name = args[0].upper().decode()
+        if client.queue is not None and name not in ("EXEC", "DISCARD", "MULTI", "WATCH"):
+            client.queue.append(args)
+            return QUEUED
+        self.commands[name] += 1
+        handler = getattr(self, "cmd_" + name.lower(), None)
+        if handler is None:
+            return Exception(f"unknown command '{name}'")
+        return handler(client, *args[1:])
+
+    def cmd_ping(self, client, *_):
+        return b"PONG"
+
+    def cmd_select(self, client, db):
+        return OK
+
+    def cmd_auth(self, client, *_):
+        return OK
+
+    def cmd_get(self, client, key):
+        return self._get(key)
+
+    def cmd_mget(self, client, *keys):
+        return [self._get(k) for k in keys]
+
+    def cmd_set(self, client, key, value, *opts):
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if len(opts) >= 2 and opts[0].upper() == b"PX":
+            self.expires[key] = time.time() + int(opts[1]) / 1000
+        self._touch(key)
+        return OK
+
+    def cmd_del(self, client, *keys):
+        return sum(self._delete(k) for k in keys)
+
+    def cmd_sadd(self, client, key, *members):
+        s = self._set(key)
+        n = len(s)
+        s.update(members)
+        self._touch(key)
+        return len(s) - n
+
+    def cmd_srem(self, client, key, *members):
+        s = self._get(key)
+        if not s:
+            return 0
+        n = len(s)
+        s.difference_update(members)
+        if not s:
+            self._delete(key)
+        self._touch(key)
+        return n - len(s)
+
+    def cmd_smembers(self, client, key):
+        return list(self._get(key) or ())
+
+    def cmd_dbsize(self, client):
+        return len(self.data)
+
+    def cmd_flushall(self, client):
+        for key in list(self.data):
+            self._delete(key)
+        return OK
+
+    def cmd_watch(self, client, *keys):
+        for k in keys:
+            client.watched.setdefault(k, self.versions[k])
+        return OK
+
+    def cmd_unwatch(self, client):
+        client.watched.clear()
+        return OK
+
+    def cmd_multi(self, client):
+        client.queue = []
+        return OK
+
+    def cmd_discard(self, client):
+        client.queue = None
+        client.watched.clear()
+        return OK
+
+    def cmd_exec(self, client):
+        queue, client.queue = client.queue, None
+        stale = any(self.versions[k] != v for k, v in client.watched.items())
+        client.watched.clear()
+        if queue is None:
+            return Exception("EXEC without MULTI")
+        if stale:
+            self.aborted += 1
+            return NIL_ARRAY
+        return [self.execute(client, args) for args in queue]
+
+    def cmd_publish(self, client, channel, message):
+        frame = encode([b"message", channel, message])
+        subscribers = self.channels.get(channel, ())
+        for w in subscribers:
+            w.write(frame)
+        return len(subscribers)
+
+    def cmd_subscribe(self, client, *channels):
+        for i, ch in enumerate(channels, 1):
+            self.channels[ch].add(client.writer)
+            client.writer.write(encode([b"subscribe", ch, i]))
+        return None   # ответ уже записан
+
+    # --- сеть ---
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        client = Client(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                args = []
+                for _ in range(int(line[1:-2])):
+                    size = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(size + 2))[:-2])
+                reply = self.execute(client, args)
+                if not (reply is None and args[0].upper() == b"SUBSCRIBE"):
+                    writer.write(encode(reply))
+                if not reader._buffer:   # пачка разобрана — отвечаем разом
+                    self.round_trips += 1
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for subscribers in self.channels.values():
+                subscribers.discard(writer)
+            writer.close()
+
+
+async def _main(port: int) -> None:
+    server = FakeRedis()
+    print(await server.start(port=port), flush=True)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(int(sys.argv[1]) if len(sys.argv) > 1 else 6379))
@@ -0,0 +1,78 @@
+# FSM: get_state/get_data на каждом апдейте — из кэша против SELECT по ключу;
+# брошенные сценарии: MemoryStorage держит их вечно, TTLStorage снимает по TTL.
+#
+#   BENCH_USERS=100000 python -m bench.fsm_storage
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from fsmstore import TTLStorage
+from storage import open_store
+
+USERS = int(os.getenv("BENCH_USERS", "50000"))
+TTL = float(os.getenv("BENCH_TTL_S", "5"))
+BOT_ID = 42
+
+
+def key(uid: int) -> StorageKey:
+    return StorageKey(BOT_ID, uid, uid)
+
+
+async def abandon(storage) -> None:
+    # человек начал SellerOnboarding и ушёл
+    for uid in range(USERS):
+        k = key(uid)
+        await storage.set_state(k, "SellerOnboarding:waiting_requisite")
+        await storage.set_data(k, {"deal_id": f"d{uid:08d}"})
+
+
+async def lookups(storage, n: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(n):
+        k = key(i % USERS)
+        await storage.get_state(k)
+        await storage.get_data(k)
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+async def main():
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    mem = MemoryStorage()
+    await abandon(mem)
+    held = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    print(f"MemoryStorage: {USERS} abandoned flows hold {held / 2**20:.1f} MiB forever, "
+          f"lookup {await lookups(mem, USERS):.2f} us")
+    del mem
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = open_store(os.path.join(tmp, "fsm.db"))
+        fsm = TTLStorage(store, TTL, cache_size=USERS // 10)
+        t0 = time.perf_counter()
+        await abandon(fsm)
+        rows = await fsm.flush()
+        print(f"TTLStorage   : {USERS} flows written in {time.perf_counter() - t0:.2f} s ({rows} rows, one flush)")
+        await lookups(fsm, USERS // 10)   # прогрев: после записи в кэше последние ключи, а не первые
+        hot = await lookups(fsm, USERS // 10)
+        fsm.cache.clear()
+        cold = await lookups(fsm, USERS // 10)
+        print(f"  lookup: cache hit {hot:.2f} us, store miss {cold:.2f} us; {fsm.stats()}")
+
+        worker = asyncio.create_task(fsm.run())
+        await asyncio.sleep(TTL + 0.5)
+        await fsm.flush()
+        left = sum(1 for _ in store.load("fsm"))
+        worker.cancel()
+        print(f"  after TTL {TTL:.0f} s: {fsm.stats()['expired']} expired, {left} left in store, "
+              f"{sum(1 for r in fsm.cache.values() if r)} live in cache")
+        store.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,89 @@
+# Общие куски для бенчей: бот против фейкового Bot API и сборка апдейтов.
+import itertools
+import json
+from datetime import datetime, timezone
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+from aiogram.types import CallbackQuery, Chat, InlineQuery, Message, Update, User
+
+import bot as botmod
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1_000_000)
+
+
+def attach(url: str) -> Bot:
+    """Подменяет глобальный bot в bot.py на клиента фейкового API."""
+    b = Bot(botmod.BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(url)),
+            default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    botmod.bot = b
+    return b
+
+
+class SerializeOnlySession(BaseSession):
+    """Сессия без сети: только сериализует запрос, как это делает AiohttpSession."""
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def make_request(self, bot, method, timeout=None):
+        for value in method.model_dump(warnings=False).values():
+            self.prepare_value(value, bot=bot, files={})
+        return True
+
+
+class LoopbackSession(SerializeOnlySession):
+    """Тоже без сокета, но с настоящими ответами: запрос сериализуется, ответ
+    FakeBotAPI.result_for проходит тот же разбор, что и ответ по HTTP."""
+
+    def __init__(self, api):
+        super().__init__()
+        self.api = api
+
+    async def make_request(self, bot, method, timeout=None):
+        params = {}
+        for key, value in method.model_dump(warnings=False).items():
+            value = self.prepare_value(value, bot=bot, files={})
+            if value is not None:
+                params[key] = value
+        body = json.dumps({"ok": True, "result": self.api.result_for(method.__api_method__, params)})
+        return self.check_response(bot=bot, method=method, status_code=200, content=body).result
+
+
+def user(uid: int) -> User:
+    return User(id=uid, is_bot=False, first_name=f"u{uid}", username=f"u{uid}")
+
+
+def message(uid: int, text: str) -> Update:
+    return Update(update_id=next(_update_ids), message=Message(
+        message_id=next(_message_ids), date=datetime.now(timezone.utc),
+        chat=Chat(id=uid, type="private"), from_user=user(uid), text=text,
+    ))
+
+
+def callback(uid: int, data: str) -> Update:
+    panel = Message(
+        message_id=botmod.memory.panel_id.get(uid, 1), date=datetime.now(timezone.utc),
+        chat=Chat(id=uid, type="private"), text="panel",
+    )
+    return Update(update_id=next(_update_ids), callback_query=CallbackQuery(
+        id=str(next(_update_ids)), from_user=user(uid), chat_instance=str(uid), message=panel, data=data,
+    ))
+
+
+def inline(uid: int, query: str) -> Update:
+    return Update(update_id=next(_update_ids), inline_query=InlineQuery(
+        id=str(next(_update_ids)), from_user=user(uid), query=query, offset="",
+    ))
+
+
+async def feed(update: Update) -> None:
+    await botmod.dp.feed_update(botmod.bot, update)
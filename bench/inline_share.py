@@ -0,0 +1,93 @@
+# inline_share: сборка InlineQueryResultArticle на каждое нажатие против
+# готового результата из memory.inline_results. Сеть не участвует: сессия
+# только сериализует запрос, как это делает AiohttpSession.
+import asyncio
+import os
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from aiogram.enums import ParseMode
+from aiogram.types import InlineQuery, InlineQueryResultArticle, InputTextMessageContent
+
+import bot as botmod
+from bench import harness
+from deals import Deal
+
+QUERIES = int(os.getenv("BENCH_QUERIES", "20000"))
+DEALS = 1000
+
+
+async def legacy_inline_share(iq: InlineQuery):
+    # inline_share до кэша
+    q = (iq.query or "").strip()
+    results = []
+    if q.startswith("deal_"):
+        deal_id = q.split("_", 1)[1]
+        d = botmod.memory.deals.get(deal_id)
+        if d:
+            url = d.deep_link
+            text = f"{url}\n\nMoonGarant - ваш выбор в проведении сделок!"
+            results.append(
+                InlineQueryResultArticle(
+                    id=deal_id,
+                    title="MoonGarant • Ссылка на сделку",
+                    description=(d.exchange_desc or f"{d.price_value} {d.method}") + f" • {d.target_user}",
+                    input_message_content=InputTextMessageContent(message_text=text, parse_mode=ParseMode.HTML),
+                )
+            )
+    await iq.answer(results=results, cache_time=0, is_personal=True)
+
+
+def queries(bot) -> list:
+    ids = list(botmod.memory.deals)
+    out = []
+    for i in range(QUERIES):
+        upd = harness.inline(10_000 + i % DEALS, f"deal_{ids[i % len(ids)]}")
+        out.append(upd.inline_query.as_(bot))
+    return out
+
+
+async def run(handler, iqs) -> float:
+    t0 = time.perf_counter()
+    for iq in iqs:
+        await handler(iq)
+    return (time.perf_counter() - t0) / len(iqs) * 1e6
+
+
+async def peak(handler, iqs) -> float:
+    # пик памяти на один ответ: сколько временных объектов создаёт хендлер
+    tracemalloc.start()
+    total = 0
+    for iq in iqs:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        await handler(iq)
+        total += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return total / len(iqs)
+
+
+async def main():
+    bot = botmod.bot
+    bot.session = harness.SerializeOnlySession()
+    now = int(datetime.now(timezone.utc).timestamp())
+    for i in range(DEALS):
+        d = Deal(f"deal{i:05d}", 10_000 + i, f"Gift {i}", "desc", "TON", f"@seller{i}", created_at=now,
+                 expires_at=now + 1800, price_value=float(i), deep_link=f"https://t.me/bot?start=deal_deal{i:05d}")
+        botmod.memory.put_deal(d)
+    iqs = queries(bot)
+
+    old_us = await run(legacy_inline_share, iqs)
+    botmod.memory.inline_results.clear()
+    new_us = await run(botmod.inline_share, iqs)
+    old_peak = await peak(legacy_inline_share, iqs[:2000])
+    new_peak = await peak(botmod.inline_share, iqs[:2000])
+    print(f"{QUERIES} inline queries over {DEALS} deals (serialization included, no network)")
+    print(f"legacy rebuild : {old_us:6.1f} µs/query, peak {old_peak / 1024:5.1f} KiB/query, cache_time=0")
+    print(f"cached result  : {new_us:6.1f} µs/query, peak {new_peak / 1024:5.1f} KiB/query, "
+          f"cache_time={botmod.INLINE_CACHE_TIME}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+# Время и аллокации на один рендер клавиатуры: сборка с нуля против кэша keyboards.py.
+import timeit
+import tracemalloc
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import keyboards
+
+N = 20_000
+
+
+def fresh_seller_controls(lang: str, deal_id: str) -> InlineKeyboardMarkup:
+    # как строилось раньше: новое pydantic-дерево на каждый вызов
+    texts = ("⛔️ Остановить ордер", "✅ Я перевёл(а) подарки") if lang == "ru" else ("⛔️ Stop order", "✅ I sent the gifts")
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=texts[0], callback_data=f"deal:{deal_id}:stop")],
+        [InlineKeyboardButton(text=texts[1], callback_data=f"deal:{deal_id}:confirm")],
+    ])
+
+
+def peak_bytes(fn, runs: int = 500) -> float:
+    # сколько памяти выделяет один рендер на пике (включая временные объекты pydantic)
+    fn()
+    tracemalloc.start()
+    total = 0
+    for _ in range(runs):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        fn()
+        total += max(0, tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    return total / runs
+
+
+def main():
+    ids = [f"deal{i}" for i in range(100)]
+    state = {"i": 0}
+
+    def next_id():
+        state["i"] = (state["i"] + 1) % len(ids)
+        return ids[state["i"]]
+
+    cases = [
+        ("main_menu        fresh", lambda: keyboards.main_menu.__wrapped__("ru", True, True, False)),
+        ("main_menu        cached", lambda: keyboards.main_menu("ru", True, True, False)),
+        ("settings_kb      fresh", lambda: keyboards.settings_kb.__wrapped__("ru")),
+        ("settings_kb      cached", lambda: keyboards.settings_kb("ru")),
+        ("seller_controls  fresh", lambda: fresh_seller_controls("ru", next_id())),
+        ("seller_controls  template", lambda: keyboards.seller_controls.__wrapped__("ru", next_id())),
+        ("seller_controls  cached", lambda: keyboards.seller_controls("ru", next_id())),
+    ]
+    for name, fn in cases:
+        per_call = min(timeit.repeat(fn, number=N, repeat=3)) / N * 1e6
+        print(f"{name:<27} {per_call:7.2f} us/render  {peak_bytes(fn):8.0f} B allocated/render")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# Нагрузочный прогон: пары покупатель/продавец проходят полный цикл сделки
+# через bot.dp против фейкового Bot API. Хендлеры не трогаем.
+#
+#   python -m bench.load_test
+#   BENCH_PAIRS=200 BENCH_DEALS=5 BENCH_API_LATENCY_MS=50 BENCH_API_ERROR_RATE=0.01 python -m bench.load_test
+import asyncio
+import gc
+import os
+import random
+import resource
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+os.environ.setdefault("OUT_GLOBAL_RATE", "100000")
+os.environ.setdefault("OUT_CHAT_RATE", "100000")
+
+import bot as botmod  # noqa: E402
+from bench import harness  # noqa: E402
+from bench.fake_api import FakeBotAPI  # noqa: E402
+
+PAIRS = int(os.getenv("BENCH_PAIRS", "50"))               # одновременно идущих пар
+DEALS = int(os.getenv("BENCH_DEALS", "3"))                # сделок подряд на пару
+THINK_MS = float(os.getenv("BENCH_THINK_MS", "50"))       # пауза пользователя между шагами
+CONFIRM_DELAY = float(os.getenv("BENCH_CONFIRM_DELAY", "0"))  # вместо bot.CONFIRM_DELAY (4-7 с)
+API_LATENCY_MS = float(os.getenv("BENCH_API_LATENCY_MS", "20"))
+API_JITTER_MS = float(os.getenv("BENCH_API_JITTER_MS", "10"))
+API_ERROR_RATE = float(os.getenv("BENCH_API_ERROR_RATE", "0"))
+API_GLOBAL_LIMIT = int(os.getenv("BENCH_API_GLOBAL_LIMIT", "0")) or None
+API_CHAT_LIMIT = int(os.getenv("BENCH_API_CHAT_LIMIT", "0")) or None
+
+TON_ADDRESS = "EQ" + "A" * 46
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+
+class Load:
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.latency: Dict[str, List[float]] = defaultdict(list)   # шаг -> секунды в feed_update
+        self.updates = 0
+        self.deals_done = 0
+        self.deals_failed = 0
+
+    async def step(self, name: str, build: Callable) -> None:
+        await asyncio.sleep(self.rng.expovariate(1000 / THINK_MS) if THINK_MS else 0)
+        update = build()
+        t0 = time.perf_counter()
+        await harness.feed(update)
+        self.latency[name].append(time.perf_counter() - t0)
+        self.updates += 1
+
+    async def deal(self, buyer: int, seller: int, n: int) -> None:
+        m, cb = harness.message, harness.callback
+        await self.step("/start", lambda: m(buyer, "/start"))
+        await self.step("create", lambda: cb(buyer, "create"))
+        for i, text in enumerate((f"Gift #{n}", "Plush Pepe, mint", "12.5", f"@u{seller}")):
+            await self.step(f"create_input {i + 1}", lambda text=text: m(buyer, text))
+        fresh = [d for d in botmod.memory.deals.by_creator(buyer) if d.status == "new"]
+        if not fresh:
+            self.deals_failed += 1
+            return
+        d = fresh[-1]
+        deal_id = d.id
+        await self.step("deep link", lambda: m(seller, f"/start deal_{deal_id}"))
+        await self.step("accept_invite", lambda: cb(seller, f"deal:{deal_id}:accept_invite"))
+        await self.step("seller_requisite", lambda: m(seller, TON_ADDRESS))
+        await self.step("confirm", lambda: cb(seller, f"deal:{deal_id}:confirm"))
+        await self.step("paid", lambda: cb(buyer, f"paid:{deal_id}"))
+        await self.step("finish", lambda: cb(seller, f"finish:{deal_id}"))
+        if d.status == "done" and deal_id not in botmod.memory.deals:
+            self.deals_done += 1
+        else:
+            self.deals_failed += 1
+
+    async def pair(self, i: int) -> None:
+        buyer, seller = 100_000 + 2 * i, 100_001 + 2 * i
+        for n in range(DEALS):
+            await self.deal(buyer, seller, n)
+
+
+async def main():
+    api = FakeBotAPI(latency_ms=API_LATENCY_MS, jitter_ms=API_JITTER_MS, error_rate=API_ERROR_RATE,
+                     global_limit=API_GLOBAL_LIMIT, chat_limit=API_CHAT_LIMIT)
+    url = await api.start()
+    bot = harness.attach(url)
+    botmod.memory = botmod.Memory()
+    botmod.CONFIRM_DELAY = (CONFIRM_DELAY, CONFIRM_DELAY)
+    worker = asyncio.create_task(botmod.outbox_worker())
+    load = Load(random.Random(3))
+
+    gc.collect()
+    rss0 = rss_bytes()
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(load.pair(i) for i in range(PAIRS)))
+        await botmod.memory.outbox.drain()
+        await botmod.outbound.drain()
+    finally:
+        elapsed = time.perf_counter() - started
+        worker.cancel()
+        await bot.session.close()
+        await api.stop()
+    gc.collect()
+    rss1 = rss_bytes()
+
+    deals = max(load.deals_done, 1)
+    every = [x for v in load.latency.values() for x in v]
+    print(f"{PAIRS} pairs x {DEALS} deals, think {THINK_MS:.0f} ms, API latency {API_LATENCY_MS:.0f}"
+          f"±{API_JITTER_MS:.0f} ms, 429 rate {API_ERROR_RATE:.1%}")
+    print(f"deals      : {load.deals_done} done, {load.deals_failed} failed in {elapsed:.1f} s "
+          f"({load.deals_done / elapsed:.1f} deals/s)")
+    print(f"updates    : {load.updates} ({load.updates / elapsed:.0f} upd/s), "
+          f"handler p50 {pct(every, 0.5):.1f} ms, p99 {pct(every, 0.99):.1f} ms")
+    print(f"API calls  : {api.api_calls()} total, {api.api_calls() / deals:.1f} per deal, "
+          f"{api.rejected} answered 429, {botmod.outbound.retried} retried")
+    for method, n in sorted(api.counts.items(), key=lambda kv: -kv[1]):
+        print(f"  {method:22s} {n:7d}  {n / deals:5.1f}/deal")
+    print(f"RSS        : {rss0 / 2**20:.1f} -> {rss1 / 2**20:.1f} MiB "
+          f"(+{(rss1 - rss0) / 2**10 / deals:.1f} KiB per deal)")
+    print("handler latency by step (ms):")
+    for name, values in load.latency.items():
+        print(f"  {name:18s} p50 {pct(values, 0.5):7.1f}  p99 {pct(values, 0.99):7.1f}  n={len(values)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
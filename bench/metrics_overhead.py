@@ -0,0 +1,115 @@
+# Сколько стоят /metrics-счётчики: поток кликов через dp.feed_update с
+# HandlerMetrics + ApiMetrics и без них. Сеть заменена LoopbackSession —
+# хендлер без RTT, то есть худший случай для доли накладных расходов.
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("OUT_GLOBAL_RATE", "1000000")
+os.environ.setdefault("OUT_CHAT_RATE", "1000000")
+os.environ.setdefault("PANEL_COALESCE_MS", "0")
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+from aiogram.enums import ParseMode  # noqa: E402
+from aiogram.methods import SendMessage  # noqa: E402
+
+import bot as botmod  # noqa: E402
+from bench import harness  # noqa: E402
+from bench.fake_api import FakeBotAPI  # noqa: E402
+from metrics import ApiMetrics, HandlerMetrics, Metrics  # noqa: E402
+
+USERS = int(os.getenv("BENCH_USERS", "100"))
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "9"))
+STREAM = ["menu", "settings", "pay:TON", "pay:USD", "lang_en", "lang_ru", "menu", "history",
+          "current", "settings", "menu", "create", "create_cancel", "menu"]
+
+
+async def one_round(instrumented: bool, handler_mw, api_mw) -> float:
+    bot = botmod.bot
+    if instrumented:
+        botmod.dp.update.outer_middleware.register(handler_mw)
+        bot.session.middleware.register(api_mw)
+    botmod.memory = botmod.Memory()
+    updates = []
+    for i in range(USERS):
+        updates.append(harness.message(10_000 + i, "/start"))
+    for data in STREAM:
+        updates.extend(harness.callback(10_000 + i, data) for i in range(USERS))
+    try:
+        t0 = time.perf_counter()
+        for upd in updates:
+            await harness.feed(upd)
+        await botmod.outbound.drain()
+        return (time.perf_counter() - t0) / len(updates) * 1e6
+    finally:
+        if instrumented:
+            botmod.dp.update.outer_middleware.unregister(handler_mw)
+            bot.session.middleware.unregister(api_mw)
+
+
+async def direct_cost(metrics: Metrics) -> tuple:
+    # чистая стоимость обёрток вокруг пустого хендлера/запроса, µs
+    mw, api_mw = HandlerMetrics(metrics), ApiMetrics(metrics)
+    upd = harness.callback(1, "deal:abc:accept")
+    method = SendMessage(chat_id=1, text="x")
+    data = {"raw_state": "CreateDeal:step"}
+
+    async def noop_handler(event, data):
+        return None
+
+    async def noop_request(bot, m):
+        return None
+
+    n = 200_000
+    t0 = time.perf_counter()
+    for _ in range(n):
+        await noop_handler(upd, data)
+    bare = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(n):
+        await mw(noop_handler, upd, data)
+    handler_us = (time.perf_counter() - t0 - bare) / n * 1e6
+    t0 = time.perf_counter()
+    for _ in range(n):
+        await api_mw(noop_request, None, method)
+    api_us = (time.perf_counter() - t0 - bare) / n * 1e6
+    return handler_us, api_us
+
+
+async def main():
+    api = FakeBotAPI()
+    botmod.bot = Bot(botmod.BOT_TOKEN, session=harness.LoopbackSession(api),
+                     default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    # бот при импорте уже повесил HandlerMetrics — снимаем, дальше включаем по раундам
+    for m in list(botmod.dp.update.outer_middleware):
+        if isinstance(m, HandlerMetrics):
+            botmod.dp.update.outer_middleware.unregister(m)
+    metrics = Metrics()
+    handler_mw, api_mw = HandlerMetrics(metrics), ApiMetrics(metrics)
+
+    await one_round(False, handler_mw, api_mw)  # прогрев: кэши клавиатур, текстов, pydantic
+    off, on = [], []
+    for r in range(ROUNDS):
+        # чередуем, чтобы дрейф частоты/GC не лёг на одну сторону
+        for instrumented in ((False, True) if r % 2 == 0 else (True, False)):
+            (on if instrumented else off).append(await one_round(instrumented, handler_mw, api_mw))
+    base, inst = statistics.median(off), statistics.median(on)
+    updates = sum(h.total for h in metrics.handlers.values())
+    calls = sum(h.total for h in metrics.api.values())
+    handler_us, api_us = await direct_cost(Metrics())
+    per_update = handler_us + api_us * calls / updates
+    text = metrics.render()
+
+    print(f"{USERS * (len(STREAM) + 1)} updates x {ROUNDS} rounds, {calls / updates:.2f} API calls per update")
+    print(f"without metrics : {base:7.1f} µs/update (median)")
+    print(f"with metrics    : {inst:7.1f} µs/update (median), measured delta {(inst - base) / base:+.2%}")
+    print(f"direct cost     : handler {handler_us:.2f} µs + api {api_us:.2f} µs x {calls / updates:.2f} "
+          f"= {per_update:.2f} µs/update ({per_update / base:.2%} of handler time)")
+    print(f"render          : {len(text.splitlines())} lines, {len(metrics.handlers)} handler series, "
+          f"{len(metrics.api)} api series")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
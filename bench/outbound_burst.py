@@ -0,0 +1,77 @@
+# Всплеск уведомлений против фейкового Bot API с лимитами Telegram:
+# прямые вызовы bot.send_message (как раньше) против очереди outbound.Outbound.
+import asyncio
+import os
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from bench.fake_api import FakeBotAPI
+from outbound import NOTIFY, REPLY, Outbound
+
+CHATS = int(os.getenv("BENCH_CHATS", "60"))
+PER_CHAT = int(os.getenv("BENCH_PER_CHAT", "4"))
+GLOBAL_LIMIT = 30
+CHAT_LIMIT = 1
+
+
+def make_bot(url: str) -> Bot:
+    return Bot("123456:BENCH", session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+
+
+async def direct(bot: Bot) -> dict:
+    async def one(chat_id, i):
+        try:
+            await bot.send_message(chat_id, f"notify {i}")
+            return True
+        except Exception:
+            return False  # прежнее поведение: except Exception: pass
+    started = time.perf_counter()
+    ok = await asyncio.gather(*(one(c, i) for i in range(PER_CHAT) for c in range(1, CHATS + 1)))
+    return {"delivered": sum(ok), "lost": len(ok) - sum(ok), "seconds": time.perf_counter() - started}
+
+
+async def queued(bot: Bot, out: Outbound) -> dict:
+    async def one(chat_id, i, lane):
+        try:
+            await out.call(chat_id, lambda: bot.send_message(chat_id, f"msg {i}"), lane)
+            return True
+        except Exception:
+            return False
+    started = time.perf_counter()
+    jobs = [one(c, i, NOTIFY) for i in range(PER_CHAT) for c in range(1, CHATS + 1)]
+    # пользовательские ответы приходят посреди всплеска уведомлений
+    jobs += [one(c, -1, REPLY) for c in range(1, CHATS + 1, 10)]
+    ok = await asyncio.gather(*jobs)
+    out.stop()
+    return {"delivered": sum(ok), "lost": len(ok) - sum(ok), "seconds": time.perf_counter() - started}
+
+
+async def main():
+    api = FakeBotAPI(latency_ms=20, jitter_ms=20, global_limit=GLOBAL_LIMIT, chat_limit=CHAT_LIMIT)
+    url = await api.start()
+    bot = make_bot(url)
+    try:
+        res = await direct(bot)
+        print(f"direct : delivered {res['delivered']:4d}, lost {res['lost']:4d}, 429 from API {api.rejected:4d}, {res['seconds']:.1f}s")
+
+        await asyncio.sleep(1.1)  # окно лимитов фейкового API очистилось
+        api.reset()
+        api.error_rate = 0.02  # случайные RetryAfter сверх лимитов
+        out = Outbound(global_rate=GLOBAL_LIMIT, chat_rate=CHAT_LIMIT, chat_burst=1)
+        res = await queued(bot, out)
+        st = out.stats()
+        print(f"queued : delivered {res['delivered']:4d}, lost {res['lost']:4d}, 429 from API {api.rejected:4d}, "
+              f"retried {st['retried']}, max depth {st['max_depth']}, {res['seconds']:.1f}s")
+        for lane, s in st["lanes"].items():
+            print(f"  {lane:<6} sent {s['sent']:4d}  wait p50 <= {s['wait_p50_ms']:.0f}ms p99 <= {s['wait_p99_ms']:.0f}ms  "
+                  f"total p50 <= {s['total_p50_ms']:.0f}ms p99 <= {s['total_p99_ms']:.0f}ms")
+    finally:
+        await bot.session.close()
+        await api.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
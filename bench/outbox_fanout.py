@@ -0,0 +1,118 @@
+# Уведомления второй стороне через outbox:
+#  1) buyer_paid сразу у многих пар — время хендлера против времени, когда
+#     продавец увидел уведомление (хендлер больше не ждёт сеть второй стороны);
+#  2) «падение» после записи уведомлений в SQLite, но до доставки: после
+#     рестарта всё доставляется, часть попыток проваливается и повторяется.
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+os.environ.setdefault("OUT_GLOBAL_RATE", "100000")
+os.environ.setdefault("OUT_CHAT_RATE", "100000")
+os.environ.setdefault("PANEL_COALESCE_MS", "0")
+
+import bot as botmod  # noqa: E402
+from bench import harness  # noqa: E402
+from bench.fake_api import FakeBotAPI  # noqa: E402
+from deals import Deal, Status  # noqa: E402
+from storage import open_store  # noqa: E402
+
+PAIRS = int(os.getenv("BENCH_PAIRS", "50"))
+NOTICES = int(os.getenv("BENCH_NOTICES", "2000"))
+FAIL_RATE = float(os.getenv("BENCH_FAIL_RATE", "0.2"))
+API_LATENCY_MS = float(os.getenv("BENCH_API_LATENCY_MS", "50"))
+
+
+def ms(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+
+async def fanout(api: FakeBotAPI) -> None:
+    botmod.memory = botmod.Memory()
+    memory = botmod.memory
+    worker = asyncio.create_task(botmod.outbox_worker())
+    now = int(time.time())
+    handler, notified = [], []
+
+    async def pair(i: int) -> None:
+        buyer, seller = 300_000 + 2 * i, 300_001 + 2 * i
+        d = Deal(f"fan{i:05d}", buyer, f"Gift {i}", "desc", "TON", f"@u{seller}", created_at=now,
+                 expires_at=now + 1800, price_value=5.0, status=Status.AWAIT_PAYMENT, seller_id=seller,
+                 seller_payto="EQ" + "A" * 46, seller_deadline=now + 900)
+        memory.put_deal(d)
+        seen = api.next_reply(seller)
+        t0 = time.perf_counter()
+        await harness.feed(harness.callback(buyer, f"paid:{d.id}"))
+        handler.append(time.perf_counter() - t0)
+        notified.append(await asyncio.wait_for(seen, 30) - t0)
+
+    try:
+        await asyncio.gather(*(pair(i) for i in range(PAIRS)))
+        await memory.outbox.drain()
+    finally:
+        worker.cancel()
+    print(f"paid x {PAIRS}, API latency {API_LATENCY_MS:.0f} ms, outbox concurrency {memory.outbox.concurrency}")
+    print(f"  buyer_paid handler   p50 {ms(handler, 0.5):7.1f} ms  p99 {ms(handler, 0.99):7.1f} ms")
+    print(f"  seller sees notice   p50 {ms(notified, 0.5):7.1f} ms  p99 {ms(notified, 0.99):7.1f} ms")
+
+
+async def restart(api: FakeBotAPI, path: str) -> None:
+    # до «падения»: уведомления записаны flush'ем, доставить не успели
+    memory = botmod.Memory(open_store(path))
+    for i in range(NOTICES):
+        memory.notify(400_000 + i, f"notice {i}")
+    await memory.flush()
+    memory.store.close()
+
+    botmod.memory = memory = botmod.Memory(open_store(path))
+    memory.load()
+    recovered = len(memory.outbox)
+    memory.outbox.backoff = 0.01
+    rng = random.Random(5)
+    deliver = botmod.deliver_notice
+
+    async def flaky(n):
+        if rng.random() < FAIL_RATE:
+            raise ConnectionResetError("bench: injected failure")
+        await deliver(n)
+
+    botmod.deliver_notice = flaky
+    api.reset()
+    t0 = time.perf_counter()
+    worker = asyncio.create_task(botmod.outbox_worker())
+    try:
+        await memory.outbox.drain()
+        await botmod.outbound.drain()
+        elapsed = time.perf_counter() - t0
+    finally:
+        worker.cancel()
+        botmod.deliver_notice = deliver
+    await memory.flush()
+    left = sum(1 for _ in memory.store.load("outbox"))
+    memory.store.close()
+    stats = memory.outbox.stats()
+    print(f"restart: {recovered}/{NOTICES} notices recovered from store, delivered {stats['delivered']} "
+          f"in {elapsed:.2f} s ({stats['delivered'] / elapsed:.0f}/s), {stats['retried']} retried, "
+          f"{stats['dropped']} dropped, sendMessage {api.counts['sendMessage']}, left in store {left}")
+    if recovered != NOTICES or stats["delivered"] != NOTICES or left:
+        raise SystemExit("outbox lost or kept notices")
+
+
+async def main():
+    api = FakeBotAPI(latency_ms=API_LATENCY_MS, jitter_ms=API_LATENCY_MS / 10)
+    url = await api.start()
+    bot = harness.attach(url)
+    try:
+        await fanout(api)
+        with tempfile.TemporaryDirectory() as tmp:
+            await restart(api, os.path.join(tmp, "outbox.db"))
+    finally:
+        await bot.session.close()
+        await api.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+# Повтор потока кликов: сколько вызовов Bot API уходит на перерисовки панели
+# с прежним show_panel и с дайджестом + склейкой.
+import asyncio
+import os
+import random
+
+os.environ.setdefault("OUT_GLOBAL_RATE", "100000")
+os.environ.setdefault("OUT_CHAT_RATE", "100000")
+
+from aiogram.enums import ParseMode  # noqa: E402
+
+import bot as botmod  # noqa: E402
+from bench import harness  # noqa: E402
+from bench.fake_api import FakeBotAPI  # noqa: E402
+
+USERS = int(os.getenv("BENCH_USERS", "50"))
+# типичные «нервные» клики: двойные нажатия, переключение туда-обратно
+STREAM = ["menu", "menu", "settings", "settings", "pay:TON", "pay:TON", "pay:USD", "pay:TON",
+          "lang_ru", "lang_ru", "menu", "history", "menu", "menu", "settings", "menu"]
+
+
+async def legacy_show_panel(chat_id, text, reply_markup=None, lane=None):
+    # show_panel до склейки: всегда edit, при любой ошибке — новое сообщение
+    bot, memory = botmod.bot, botmod.memory
+    memory.log(chat_id, "bot", text)
+    mid = memory.panel_id.get(chat_id)
+    try:
+        if mid:
+            msg = await bot.edit_message_text(chat_id=chat_id, message_id=mid, text=text,
+                                              reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+            memory.panel_id[chat_id] = msg.message_id
+            memory.all_msgs.setdefault(chat_id, []).append((chat_id, msg.message_id))
+            return
+    except Exception:
+        pass
+    msg = await bot.send_message(chat_id, text, reply_markup=reply_markup)
+    memory.panel_id[chat_id] = msg.message_id
+    memory.all_msgs.setdefault(chat_id, []).append((chat_id, msg.message_id))
+
+
+async def user_session(uid: int, rng: random.Random) -> None:
+    await harness.feed(harness.message(uid, "/start"))
+    await asyncio.sleep(0.3)
+
+    async def click(data, delay):
+        await asyncio.sleep(delay)
+        await harness.feed(harness.callback(uid, data))
+
+    # клики прилетают быстрее, чем бот успевает ответить
+    delays = [i * rng.uniform(0.03, 0.12) for i in range(len(STREAM))]
+    await asyncio.gather(*(click(d, delay) for d, delay in zip(STREAM, delays)))
+
+
+async def run(api: FakeBotAPI, legacy: bool) -> dict:
+    botmod.memory = botmod.Memory()
+    original = botmod.show_panel
+    if legacy:
+        botmod.show_panel = legacy_show_panel
+    api.reset()
+    coalescer = botmod.panels
+    before = dict(coalescer.stats())
+    try:
+        rng = random.Random(7)
+        await asyncio.gather(*(user_session(10_000 + i, rng) for i in range(USERS)))
+        await asyncio.sleep(botmod.PANEL_COALESCE_MS / 1000 + 0.1)
+    finally:
+        botmod.show_panel = original
+    after = coalescer.stats()
+    return {
+        "panel_calls": api.api_calls("editMessageText", "sendMessage"),
+        "sends": api.counts["sendMessage"],
+        "not_modified": api.not_modified,
+        "all_msgs": sum(len(v) for v in botmod.memory.all_msgs.values()),
+        "coalesced": after["coalesced"] - before["coalesced"],
+        "skipped": after["skipped"] - before["skipped"],
+    }
+
+
+async def main():
+    api = FakeBotAPI(latency_ms=40, jitter_ms=40)
+    url = await api.start()
+    bot = harness.attach(url)
+    try:
+        old = await run(api, legacy=True)
+        new = await run(api, legacy=False)
+    finally:
+        await bot.session.close()
+        await api.stop()
+    clicks = USERS * (len(STREAM) + 1)
+    print(f"{clicks} updates from {USERS} users")
+    print(f"legacy show_panel : {old['panel_calls']:5d} API calls ({old['sends']} sends, "
+          f"{old['not_modified']} 'not modified'), all_msgs {old['all_msgs']}")
+    print(f"coalesced         : {new['panel_calls']:5d} API calls ({new['sends']} sends, "
+          f"{new['not_modified']} 'not modified'), all_msgs {new['all_msgs']}, "
+          f"merged {new['coalesced']}, no-op skipped {new['skipped']}")
+    saved = old["panel_calls"] - new["panel_calls"]
+    print(f"saved             : {saved} calls ({saved / max(old['panel_calls'], 1):.0%})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,131 @@
+# Пул шардов: пропускная способность при 1, 2, 4, 8 процессах bot.py за ShardPool.
+# Каждому воркеру — свой фейковый Bot API в отдельном процессе, чтобы упираться
+# в бота, а не в стенд. Поток — клики меню/настроек; доля BENCH_CROSS — кнопки
+# чужих сделок (memo:<id>): они идут на шард сделки, где пользователь гость,
+# и тянут его профиль с домашнего шарда.
+#
+#   BENCH_WORKERS=1,2,4,8 BENCH_USERS=2000 BENCH_ROUNDS=10 python -m bench.shard_scaling
+#
+# Рост упирается в число ядер: os.cpu_count() печатается рядом с результатом.
+import asyncio
+import multiprocessing
+import os
+import random
+import secrets
+import sys
+import tempfile
+import time
+
+from bench.fake_api import FakeBotAPI
+from shard import ShardPool
+
+WORKERS = [int(n) for n in os.getenv("BENCH_WORKERS", "1,2,4,8").split(",")]
+USERS = int(os.getenv("BENCH_USERS", "2000"))
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "10"))
+CROSS = float(os.getenv("BENCH_CROSS", "0.1"))
+API_LATENCY_MS = float(os.getenv("BENCH_API_LATENCY_MS", "5"))
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fake_api(out, latency_ms: float) -> None:
+    async def serve():
+        api = FakeBotAPI(latency_ms=latency_ms)
+        out.put(await api.start())
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"u{uid}", "username": f"u{uid}"}
+
+
+def message(n: int, uid: int, text: str) -> dict:
+    return {"update_id": n, "message": {"message_id": n, "date": int(time.time()), "text": text,
+                                        "chat": {"id": uid, "type": "private"}, "from": user(uid)}}
+
+
+def callback(n: int, uid: int, data: str) -> dict:
+    return {"update_id": n, "callback_query": {
+        "id": str(n), "from": user(uid), "chat_instance": str(uid), "data": data,
+        "message": {"message_id": 1, "date": int(time.time()), "chat": {"id": uid, "type": "private"}, "text": "panel"},
+    }}
+
+
+def traffic(rng: random.Random) -> tuple:
+    starts = [message(i + 1, 50_000 + i, "/start") for i in range(USERS)]
+    clicks = []
+    for rnd in range(ROUNDS):
+        for i in range(USERS):
+            if rng.random() < CROSS:
+                data = f"memo:{secrets.token_urlsafe(8)}"
+            else:
+                data = "settings" if rnd % 2 == 0 else "menu"
+            clicks.append(callback(len(starts) + len(clicks) + 1, 50_000 + i, data))
+    return starts, clicks
+
+
+async def processed(pool: ShardPool) -> int:
+    stats = await asyncio.gather(*(pool.call(i, "stats") for i in range(pool.n)))
+    return sum(s["processed"] for s in stats)
+
+
+async def push(pool: ShardPool, updates: list) -> float:
+    base = await processed(pool)
+    t0 = time.perf_counter()
+    for update in updates:
+        await pool.route(update)
+    while await processed(pool) - base < len(updates):
+        await asyncio.sleep(0.02)
+    return time.perf_counter() - t0
+
+
+async def run(n: int, starts: list, clicks: list) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    apis = [ctx.Process(target=fake_api, args=(out, API_LATENCY_MS), daemon=True) for _ in range(n)]
+    for p in apis:
+        p.start()
+    urls = [out.get() for _ in apis]
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = ShardPool(n, os.path.join(tmp, "shards.sock"), queue_size=len(starts) + len(clicks))
+        await pool.start()
+        env = {**os.environ, "BOT_TOKEN": "123456:bench", "SHARD_COUNT": str(n), "SHARD_SOCKET": pool.path,
+               "OUT_GLOBAL_RATE": "1e9", "OUT_CHAT_RATE": "1e9", "PANEL_COALESCE_MS": "0",
+               "STORE_PATH": "", "SNAPSHOT_PATH": "", "METRICS_SOCKET": "", "SLOW_CALLBACK_MS": "60000"}
+        procs = [await asyncio.create_subprocess_exec(
+            sys.executable, "bot.py", cwd=ROOT, stdout=asyncio.subprocess.DEVNULL,
+            env={**env, "SHARD_INDEX": str(i), "TELEGRAM_API_URL": urls[i]}) for i in range(n)]
+        try:
+            while not all(pool.links):
+                await asyncio.sleep(0.05)
+            await push(pool, starts)   # /start: панели созданы, профили и FSM в кэше
+            routed = list(pool.routed)
+            routes = dict(pool.routes)
+            elapsed = await push(pool, clicks)
+            routed = [b - a for a, b in zip(routed, pool.routed)]
+            routes = {k: pool.routes[k] - routes[k] for k in routes}
+        finally:
+            for p in procs:
+                p.terminate()
+            await asyncio.gather(*(p.wait() for p in procs))
+            await pool.stop()
+            for p in apis:
+                p.terminate()
+    return {"rate": len(clicks) / elapsed, "routed": routed, "routes": routes}
+
+
+async def main():
+    starts, clicks = traffic(random.Random(3))
+    print(f"{USERS} users, {len(clicks)} clicks ({CROSS:.0%} on foreign deals), "
+          f"fake API latency {API_LATENCY_MS:.0f} ms, cpu_count {os.cpu_count()}")
+    base = None
+    for n in WORKERS:
+        r = await run(n, starts, clicks)
+        base = base or r["rate"]
+        print(f"workers {n}: {r['rate']:7.0f} upd/s  x{r['rate'] / base:4.2f}  "
+              f"per shard {min(r['routed'])}..{max(r['routed'])}  by {r['routes']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,191 @@
+# Общий store (STORE_PATH=redis://): инстансы serve.py в режиме вебхука за одним
+# фейковым Bot API и одним fake_redis. Апдейты раскладываются по инстансам
+# случайно — балансировщик без липкости, следующий клик того же пользователя
+# легко попадает на другой инстанс. Два замера:
+#   1) клики меню/настроек с паузой BENCH_THINK_MS между кликами одного
+#      пользователя (инвалидация доходит за миллисекунды, человек кликает
+#      медленнее): upd/s, задержка до ответа и сколько команд store на апдейт —
+#      get_lang, FSM и панель должны читаться из near-cache;
+#   2) гонка: «Я оплатил» по каждой сделке приходит сразу в оба инстанса —
+#      переход применяется один раз (CAS), продавец получает одно уведомление.
+#
+#   BENCH_USERS=100 BENCH_ROUNDS=10 BENCH_DEALS=200 python -m bench.shared_state
+import asyncio
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from bench.fake_api import FakeBotAPI
+from bench.fake_redis import FakeRedis
+from bench.shard_scaling import callback, message
+from deals import Deal, Status
+from redisstore import RedisStore
+from webhook import SECRET_HEADER
+
+USERS = int(os.getenv("BENCH_USERS", "100"))
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "10"))
+DEALS = int(os.getenv("BENCH_DEALS", "200"))
+API_LATENCY_MS = float(os.getenv("BENCH_API_LATENCY_MS", "5"))
+THINK_MS = float(os.getenv("BENCH_THINK_MS", "300"))
+SECRET = "bench-secret"
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READS = ("GET", "MGET", "SMEMBERS")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def seed(url: str) -> list:
+    # сделки ждут оплаты: их загрузят инстансы при старте
+    store = RedisStore(url)
+    now = int(time.time())
+    deals = [Deal(f"race{i:05d}", 70_000 + i, f"Gift {i}", "desc", "STARS", f"@u{80_000 + i}",
+                  created_at=now, expires_at=now + 1800, price_value=5.0, status=Status.AWAIT_PAYMENT,
+                  seller_id=80_000 + i, seller_username=f"@u{80_000 + i}", seller_payto="@payto",
+                  seller_deadline=now + 900) for i in range(DEALS)]
+    store.write([("deals", d.id, store.encode(d)) for d in deals])
+    store.close()
+    return deals
+
+
+class Cluster:
+    def __init__(self, n: int, api: FakeBotAPI, store: str, logdir: str):
+        self.n, self.api, self.store, self.logdir = n, api, store, logdir
+        self.urls, self.procs = [], []
+
+    async def __aenter__(self):
+        for i in range(self.n):
+            port = free_port()
+            env = {**os.environ, "BOT_TOKEN": "123456:bench", "BOT_MODE": "webhook", "WEBHOOK_URL": "",
+                   "WEBHOOK_SECRET": SECRET, "PORT": str(port), "TELEGRAM_API_URL": self.api.url,
+                   "STORE_PATH": self.store, "NODE_ID": f"bench{i}", "CHATLOG_DIR": "", "SNAPSHOT_PATH": "",
+                   "OUT_GLOBAL_RATE": "1e9", "OUT_CHAT_RATE": "1e9", "PANEL_COALESCE_MS": "0",
+                   "SLOW_CALLBACK_MS": "60000"}
+            log = open(os.path.join(self.logdir, f"instance{i}.log"), "ab")
+            self.procs.append(await asyncio.create_subprocess_exec(
+                sys.executable, "serve.py", cwd=ROOT, env=env, stdout=log, stderr=log))
+            self.urls.append(f"http://127.0.0.1:{port}")
+        self.http = aiohttp.ClientSession(headers={SECRET_HEADER: SECRET})
+        deadline = time.monotonic() + 30
+        for url in self.urls:
+            while True:
+                try:
+                    async with self.http.get(url + "/health") as resp:
+                        if resp.status == 200:
+                            break
+                except aiohttp.ClientError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{url} did not come up, see {self.logdir}")
+                await asyncio.sleep(0.1)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.http.close()
+        for p in self.procs:
+            p.terminate()
+        await asyncio.gather(*(p.wait() for p in self.procs))
+
+    async def post(self, update: dict, instance: int) -> None:
+        async with self.http.post(self.urls[instance] + "/telegram/webhook", json=update) as resp:
+            assert resp.status == 200, resp.status
+
+
+async def clicks(cluster: Cluster, api: FakeBotAPI, rng: random.Random) -> dict:
+    latencies = []
+    lost = 0
+    counter = iter(range(1, 10**9))
+
+    async def session(uid: int):
+        nonlocal lost
+        for rnd in range(ROUNDS):
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * THINK_MS / 1000)
+            n = next(counter)
+            update = message(n, uid, "/start") if rnd == 0 else callback(n, uid, "settings" if rnd % 2 else "menu")
+            reply = api.next_reply(uid)
+            t0 = time.perf_counter()
+            await cluster.post(update, rng.randrange(cluster.n))
+            try:
+                latencies.append((await asyncio.wait_for(reply, 10)) - t0)
+            except asyncio.TimeoutError:
+                lost += 1   # инстанс счёл панель уже показанной — устаревший near-cache
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(50_000 + i) for i in range(USERS)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {"rate": len(latencies) / elapsed, "p50": statistics.median(latencies) * 1000,
+            "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000, "updates": len(latencies) + lost, "lost": lost}
+
+
+async def race(cluster: Cluster, api: FakeBotAPI, deals: list) -> dict:
+    sellers = {str(d.seller_id) for d in deals}
+    api.reset()
+    n = iter(range(10**6, 10**9))
+    await asyncio.gather(*(cluster.post(callback(next(n), d.creator_id, f"paid:{d.id}"), i % cluster.n)
+                           for d in deals for i in range(2)))
+    deadline = time.monotonic() + 30
+    while api.counts["answerCallbackQuery"] < 2 * len(deals) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(1.0)   # outbox успеет доставить и лишние уведомления, если они есть
+    notified = [p.get("chat_id") for _, m, p in api.calls if m in ("sendMessage", "editMessageText")]
+    notified = [c for c in notified if c in sellers]
+    return {"notices": len(notified), "sellers": len(set(notified)),
+            "answers": api.counts["answerCallbackQuery"]}
+
+
+async def run(label: str, n: int, shared: bool, logdir: str) -> None:
+    api = FakeBotAPI(latency_ms=API_LATENCY_MS)
+    await api.start()
+    redis = FakeRedis()
+    url = await redis.start()
+    deals = await asyncio.to_thread(seed, url) if shared else []
+    try:
+        async with Cluster(n, api, url if shared else "", logdir) as cluster:
+            redis.reset()
+            r = await clicks(cluster, api, random.Random(7))
+            cmds = dict(redis.commands)
+            reads = sum(v for k, v in cmds.items() if k in READS)
+            writes = sum(v for k, v in cmds.items() if k not in READS)
+            line = (f"{label:22s} {r['rate']:6.0f} upd/s  p50 {r['p50']:5.1f} ms  p99 {r['p99']:6.1f} ms  "
+                    f"no reply {r['lost']}")
+            if shared:
+                line += (f"\n{'':22s} store per update: {reads / r['updates']:.2f} read + "
+                         f"{writes / r['updates']:.2f} write commands in {redis.round_trips / r['updates']:.2f} round trips")
+            print(line, flush=True)
+            if shared:
+                redis.reset()
+                x = await race(cluster, api, deals)
+                print(f"{'':22s} double 'paid' on {len(deals)} deals: {x['answers']} answers, "
+                      f"{x['notices']} seller notices to {x['sellers']} sellers, "
+                      f"{redis.aborted} CAS lost at EXEC", flush=True)
+    finally:
+        await redis.stop()
+        await api.stop()
+
+
+async def main():
+    print(f"{USERS} users x {ROUNDS} clicks, think {THINK_MS:.0f} ms, fake API latency {API_LATENCY_MS:.0f} ms, "
+          f"cpu_count {os.cpu_count()}")
+    with tempfile.TemporaryDirectory() as logdir:
+        await run("1 instance, memory", 1, False, logdir)
+        await run("1 instance, redis://", 1, True, logdir)
+        await run("2 instances, redis://", 2, True, logdir)
+        errors = 0
+        for name in sorted(os.listdir(logdir)):
+            with open(os.path.join(logdir, name), errors="replace") as f:
+                errors += f.read().count("Traceback")
+        print(f"tracebacks in instance logs: {errors}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
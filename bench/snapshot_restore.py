@@ -0,0 +1,88 @@
+# Тёплый рестарт: запись снимка Memory на выходе и восстановление при старте.
+# Восстановление идёт в свежем процессе (spawn): один прогон на время, второй
+# под tracemalloc — сколько памяти сверх итоговой Memory нужно на пике. Для
+# сравнения тот же снимок одним pickle: его можно прочитать только целиком.
+#
+#   BENCH_DEALS=1000000 python -m bench.snapshot_restore
+import multiprocessing
+import os
+import pickle
+import random
+import tempfile
+import time
+import tracemalloc
+
+from bench.deal_memory import compact
+
+N = int(os.getenv("BENCH_DEALS", "200000"))
+
+
+def build(memory) -> None:
+    rng = random.Random(1)
+    for i in range(N):
+        d = compact(rng, i)
+        memory.put_deal(d)
+        uid = d.creator_id
+        memory.users[uid] = {"lang": "ru", "pay_method": d.method}
+        memory.usernames[uid] = d.creator_username
+        memory.panel_id[uid] = 1_000 + i
+        memory.all_msgs[uid] = [(uid, 1_000 + i)]
+
+
+def restore(path: str, mode: str, trace: bool, out) -> None:
+    import bot as botmod
+    from snapshot import read_snapshot
+
+    if trace:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    memory = botmod.Memory()
+    if mode == "stream":
+        memory.load(read_snapshot(path))
+    else:
+        with open(path, "rb") as f:
+            sections = pickle.load(f)
+        memory.load(sections.items())
+        del sections
+    elapsed = time.perf_counter() - t0
+    size, peak = tracemalloc.get_traced_memory() if trace else (0, 0)
+    out.put((elapsed, size, peak, len(memory.deals), len(memory.deadlines)))
+
+
+def run_child(path: str, mode: str, trace: bool) -> tuple:
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    p = ctx.Process(target=restore, args=(path, mode, trace, out))
+    p.start()
+    res = out.get()
+    p.join()
+    return res
+
+
+def main():
+    import bot as botmod
+    from snapshot import write_snapshot
+
+    memory = botmod.Memory()
+    t0 = time.perf_counter()
+    build(memory)
+    print(f"{N} deals, {len(memory.users)} users built in {time.perf_counter() - t0:.1f} s")
+    with tempfile.TemporaryDirectory() as tmp:
+        stream_path, whole_path = os.path.join(tmp, "bot.snapshot"), os.path.join(tmp, "whole.pickle")
+        t0 = time.perf_counter()
+        n = write_snapshot(stream_path, memory.snapshot())
+        print(f"write     : {n} entries, {os.path.getsize(stream_path) / 2**20:.1f} MiB "
+              f"in {time.perf_counter() - t0:.2f} s")
+        with open(whole_path, "wb") as f:
+            pickle.dump({s: list(items) for s, items in memory.snapshot()}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        del memory
+        for mode, path in (("stream", stream_path), ("one pickle", whole_path)):
+            elapsed, _, _, deals, deadlines = run_child(path, mode, False)
+            _, size, peak, _, _ = run_child(path, mode, True)
+            print(f"{mode:10s}: {deals} deals ({deadlines} deadlines) restored in {elapsed:.2f} s, "
+                  f"Memory {size / 2**20:.0f} MiB, peak {peak / 2**20:.0f} MiB "
+                  f"(+{(peak - size) / 2**20:.0f} MiB on top)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# Пропускная способность «апдейтов» с MemoryStore и с SQLiteStore (write-behind).
+import asyncio
+import os
+import tempfile
+import time
+
+import bot
+from deals import Deal
+from storage import MemoryStore, SQLiteStore
+
+UPDATES = int(os.getenv("BENCH_UPDATES", "100000"))
+USERS = 5000
+
+
+async def run(store) -> tuple:
+    bot.memory = mem = bot.Memory(store)
+    flusher = asyncio.create_task(bot.store_flusher())
+    started = time.perf_counter()
+    for i in range(UPDATES):
+        uid = i % USERS
+        bot.set_lang(uid, "ru" if i & 1 else "en")
+        deal_id = f"d{uid}"
+        d = mem.deals.get(deal_id)
+        if d is None:
+            d = Deal(deal_id, uid, "title", "desc", "TON", "@seller", created_at=time.time(), expires_at=0)
+        d.expires_at = int(time.time()) + 30 * 60
+        mem.put_deal(d)
+        mem.log(uid, "user", "hello")
+        if i % 64 == 0:
+            await asyncio.sleep(0)  # даём flusher'у место в цикле, как между апдейтами
+    elapsed = time.perf_counter() - started
+    flusher.cancel()
+    t0 = time.perf_counter()
+    await mem.flush()
+    tail = time.perf_counter() - t0
+    store.close()
+    return elapsed, tail
+
+
+async def main():
+    for name, factory in (("memory", MemoryStore), ("sqlite-wal", None)):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = factory() if factory else SQLiteStore(os.path.join(tmp, "bench.db"))
+            elapsed, tail = await run(store)
+        print(f"{name:>10}: {UPDATES / elapsed:10.0f} updates/s  ({elapsed:.2f}s, final flush {tail * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
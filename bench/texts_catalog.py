@@ -0,0 +1,36 @@
+# Стоимость одного вызова: прежний t() (литерал dict на каждый вызов + str.format)
+# против каталога texts.py (готовая таблица + скомпилированный шаблон).
+import timeit
+
+import texts
+
+N = 200_000
+KW = dict(title="Gift box", desc="3 NFT", price_label="12.5 TON", target="@buyer")
+
+
+def _legacy():
+    # тот же код, что был в bot.py: словарь из ~70 шаблонов собирается при каждом вызове
+    items = ", ".join(f"{k!r}: {v!r}" for k, v in texts.RU.items())
+    src = f"def legacy_t(lang, key):\n    RU = {{{items}}}\n    EN = RU\n    return (RU if lang == 'ru' else EN)[key]\n"
+    ns = {}
+    exec(src, ns)
+    return ns["legacy_t"]
+
+
+def main():
+    legacy_t = _legacy()
+    cases = [
+        ("lookup  legacy t()", lambda: legacy_t("ru", "menu")),
+        ("lookup  catalog t()", lambda: texts.t("ru", "menu")),
+        ("render  legacy t().format", lambda: legacy_t("ru", "seller_details").format(**KW)),
+        ("render  catalog t().format", lambda: texts.t("ru", "seller_details").format(**KW)),
+        ("render  catalog tf()", lambda: texts.tf("ru", "seller_details", **KW)),
+    ]
+    assert cases[2][1]() == cases[4][1]()
+    for name, fn in cases:
+        per_call = min(timeit.repeat(fn, number=N, repeat=3)) / N * 1e9
+        print(f"{name:<28} {per_call:8.0f} ns/call")
+
+
+if __name__ == "__main__":
+    main()
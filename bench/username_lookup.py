@@ -0,0 +1,53 @@
+# Поиск пользователя по @username в админке: прежний проход по всем
+# memory.usernames с lower() против UsernameIndex.find / search.
+import os
+import random
+import time
+
+from usernames import UsernameIndex
+
+SIZES = [int(x) for x in os.getenv("BENCH_SIZES", "10000,100000,1000000").split(",")]
+
+
+def legacy_find(usernames: dict, query: str):
+    # admin_get_log / admin_do_purge до индекса
+    for uid, uname in usernames.items():
+        if uname.lower() == query.lower():
+            return uid
+    return None
+
+
+def timed(fn, queries) -> float:
+    t0 = time.perf_counter()
+    for q in queries:
+        fn(q)
+    return (time.perf_counter() - t0) / len(queries) * 1e6
+
+
+def bench(n: int) -> None:
+    rng = random.Random(6)
+    plain = {}
+    index = UsernameIndex()
+    for uid in range(n):
+        name = f"@User_{uid:07d}" if uid % 4 else f"id{uid}"
+        plain[uid] = name
+        index.set(uid, name)
+    queries = [f"@user_{rng.randrange(n):07d}" for _ in range(1000)]
+    scan_q = queries[:max(1, min(200, 2_000_000 // n))]
+
+    scan_us = timed(lambda q: legacy_find(plain, q), scan_q)
+    find_us = timed(index.find, queries)
+    index.search("@user_1")                     # первая сборка сортированного списка
+    search_us = timed(lambda q: index.search(q[:9]), queries)
+    t0 = time.perf_counter()
+    for uid in range(1, 1001):
+        index.set(uid, f"@Renamed_{uid}")      # переименования
+    rename_us = (time.perf_counter() - t0) / 1000 * 1e6
+    assert index.find("@user_0000001") is None and index.find("@renamed_1") == 1
+    print(f"{n:>9} users: scan {scan_us:10.1f} µs | find {find_us:5.2f} µs | "
+          f"prefix search {search_us:6.2f} µs | rename {rename_us:5.2f} µs")
+
+
+if __name__ == "__main__":
+    for size in SIZES:
+        bench(size)
@@ -0,0 +1,116 @@
+# Задержка «апдейт пришёл -> бот ответил» в режиме вебхука (WebhookIngest)
+# и в режиме long polling (dp.start_polling) против одного и того же фейкового API.
+import asyncio
+import os
+import random
+import statistics
+import time
+
+os.environ.setdefault("OUT_GLOBAL_RATE", "100000")
+os.environ.setdefault("OUT_CHAT_RATE", "100000")
+os.environ.setdefault("PANEL_COALESCE_MS", "0")
+
+import aiohttp  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+import bot as botmod  # noqa: E402
+from bench import harness  # noqa: E402
+from bench.fake_api import FakeBotAPI  # noqa: E402
+from webhook import SECRET_HEADER, WebhookIngest  # noqa: E402
+
+USERS = int(os.getenv("BENCH_USERS", "20"))
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "20"))
+THINK_MS = float(os.getenv("BENCH_THINK_MS", "300"))   # средняя пауза между кликами одного пользователя
+SECRET = "bench-secret"
+PATH = "/telegram/webhook"
+
+
+def updates_for(uid: int, rnd: int):
+    return harness.message(uid, "/start") if rnd == 0 else harness.callback(uid, "settings" if rnd % 2 else "menu")
+
+
+async def drive(api: FakeBotAPI, inject) -> dict:
+    latencies = []
+    rng = random.Random(11)
+
+    async def session(uid):
+        for rnd in range(ROUNDS):
+            # пользователи кликают вразнобой, а не залпом
+            await asyncio.sleep(rng.expovariate(1000 / THINK_MS))
+            reply = api.next_reply(uid)
+            t0 = time.perf_counter()
+            await inject(updates_for(uid, rnd))
+            latencies.append((await asyncio.wait_for(reply, 10)) - t0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(20_000 + i) for i in range(USERS)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "updates": len(latencies),
+        "rate": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def run_webhook(api: FakeBotAPI) -> dict:
+    botmod.memory = botmod.Memory()
+    ingest = WebhookIngest(botmod.dp, botmod.bot, SECRET, concurrency=botmod.UPDATE_CONCURRENCY)
+    app = web.Application()
+    app.router.add_post(PATH, ingest.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = "http://127.0.0.1:%d%s" % (site._server.sockets[0].getsockname()[1], PATH)
+    ingest.start()
+    async with aiohttp.ClientSession(headers={SECRET_HEADER: SECRET}) as http:
+        async def inject(update):
+            await asyncio.sleep(api.latency_ms / 2000)  # Telegram -> наш сервер, полкруга
+            async with http.post(url, data=update.model_dump_json(exclude_none=True),
+                                 headers={"Content-Type": "application/json"}) as resp:
+                assert resp.status == 200, resp.status
+        try:
+            return await drive(api, inject)
+        finally:
+            await ingest.stop()
+            await runner.cleanup()
+
+
+async def run_polling(api: FakeBotAPI) -> dict:
+    botmod.memory = botmod.Memory()
+    polling = asyncio.create_task(botmod.dp.start_polling(
+        botmod.bot, handle_signals=False, close_bot_session=False, polling_timeout=10,
+        tasks_concurrency_limit=botmod.UPDATE_CONCURRENCY,
+    ))
+
+    async def inject(update):
+        api.push_update(update.model_dump(mode="json", exclude_none=True))
+
+    try:
+        await asyncio.sleep(0.2)  # get_me + первый getUpdates
+        return await drive(api, inject)
+    finally:
+        await botmod.dp.stop_polling()
+        await polling
+
+
+async def main():
+    api = FakeBotAPI(latency_ms=float(os.getenv("BENCH_API_LATENCY_MS", "30")))
+    url = await api.start()
+    bot = harness.attach(url)
+    try:
+        polled = await run_polling(api)
+        hooked = await run_webhook(api)
+    finally:
+        await bot.session.close()
+        await api.stop()
+    print(f"{USERS} users x {ROUNDS} rounds, fake API latency {api.latency_ms:.0f} ms")
+    for name, r in (("polling", polled), ("webhook", hooked)):
+        print(f"{name:8s}: {r['updates']} updates, {r['rate']:7.0f} upd/s, "
+              f"update->reply p50 {r['p50']:6.1f} ms, p99 {r['p99']:6.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
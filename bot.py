@@ -1,13 +1,23 @@
 import asyncio
+import contextlib
+import copy
+import gc
+import logging
 import secrets
+import time
 import random
 import os
-from datetime import datetime, timedelta, timezone
-from typing import Dict, Optional, List, Tuple
+import signal
+import socket
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, Optional, List, Tuple
 
-from aiogram import Bot, Dispatcher, F
+from aiogram import BaseMiddleware, Bot, Dispatcher, F
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ChatType, ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import CommandStart, Command
 from aiogram.types import (
     Message,
@@ -16,11 +26,36 @@ from aiogram.types import (
     InlineQueryResultArticle,
     InputTextMessageContent,
     InlineKeyboardMarkup,
-    InlineKeyboardButton,
+    Update,
 )
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 
+from chatlog import ChatLog
+from deals import (
+    Deal, DealLocks, DealRegistry, DealSummary, DealTimeline, Status, TRANSITIONS, TransitionError, can_transition,
+)
+from fsmstore import TTLStorage
+# все клавиатуры — закэшированная фабрика в keyboards.py
+from keyboards import (
+    main_menu, back_to_menu, settings_kb, create_nav_prev_only, final_actions, seller_controls,
+    accept_decline_kb, buyer_pay_kb, seller_final_kb, admin_panel_kb, admin_back_only_kb,
+    admin_recent_kb, admin_profile_kb,
+)
+from loopmon import LoopMonitor, handler_codes
+from metrics import ApiMetrics, HandlerMetrics, Metrics, serve_unix
+from scheduler import DeadlineScheduler
+from session import CircuitBreaker, ResilientSession
+from shard import ShardLink, shard_of
+from snapshot import read_snapshot, write_snapshot
+from outbound import NOTIFY, REPLY, Outbound
+from outbox import Notice, Outbox
+from panels import PanelCoalescer
+from profiler import ProfileMiddleware, SamplingProfiler
+from storage import Store, open_store
+from texts import LANG_NAME, t, tf
+from usernames import UsernameIndex
+
 # ---------- CONFIG ----------
 try:
     from dotenv import load_dotenv
@@ -31,6 +66,51 @@ except Exception:
 BOT_TOKEN    = os.getenv("BOT_TOKEN", "")
 BOT_USERNAME = os.getenv("BOT_USERNAME", "")
 ADMIN_ID     = int(os.getenv("ADMIN_ID", "0"))  # Укажи свой ID в .env
+# serve.py с BOT_WORKERS > 1 запускает несколько bot.py, каждый — шард (shard.py)
+SHARD_INDEX  = int(os.getenv("SHARD_INDEX", "0"))
+SHARD_COUNT  = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_SOCKET = os.getenv("SHARD_SOCKET", "")    # апдейты от serve.py; пусто — свой polling
+STORE_PATH   = os.getenv("STORE_PATH", "")              # путь к SQLite или redis://; пусто — только память
+STORE_FILE   = "" if "://" in STORE_PATH else STORE_PATH   # рядом с SQLite-файлом кладём остальные файлы
+NODE_ID      = os.getenv("NODE_ID", "")                  # redis://: имя инстанса для его outbox/журнала (по умолчанию hostname)
+STORE_FLUSH_MS = int(os.getenv("STORE_FLUSH_MS", "200"))  # период write-behind сброса
+CHATLOG_DIR = os.getenv("CHATLOG_DIR", STORE_FILE + ".chatlog" if STORE_FILE else "")  # сегменты старого журнала
+CHATLOG_RING = int(os.getenv("CHATLOG_RING", "50"))         # записей журнала на пользователя в памяти
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")      # свой Bot API сервер (локальный/фейковый)
+OUT_GLOBAL_RATE = float(os.getenv("OUT_GLOBAL_RATE", "30")) / SHARD_COUNT  # сообщений/с на бота, делят шарды
+OUT_CHAT_RATE   = float(os.getenv("OUT_CHAT_RATE", "1"))     # сообщений/с в один чат
+API_POOL_SIZE   = int(os.getenv("API_POOL_SIZE", "100"))         # соединений к Bot API
+API_TIMEOUT_S   = float(os.getenv("API_TIMEOUT_S", "60"))        # таймаут одной попытки
+API_ATTEMPTS    = int(os.getenv("API_ATTEMPTS", "4"))            # попыток на 5xx/сеть, 1 — без повторов
+API_MAX_RETRY_AFTER = float(os.getenv("API_MAX_RETRY_AFTER", "5"))  # RetryAfter длиннее — вызывающему
+API_BREAKER_RATIO = float(os.getenv("API_BREAKER_RATIO", "0.5"))    # доля ошибок, при которой не удаляем мусор
+API_BREAKER_COOLDOWN_S = float(os.getenv("API_BREAKER_COOLDOWN_S", "15"))
+PANEL_COALESCE_MS = int(os.getenv("PANEL_COALESCE_MS", "250"))  # окно склейки перерисовок панели
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))  # апдейтов в обработке одновременно
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))  # сколько Telegram кэширует ответ inline
+METRICS_SOCKET = os.getenv("METRICS_SOCKET", "")  # unix-сокет для /metrics в serve.py (polling-подпроцесс)
+PROFILE_ON = os.getenv("PROFILE_ON", "0") == "1"   # профайлер со старта; иначе — из админки
+PROFILE_RATE = float(os.getenv("PROFILE_RATE", "0.05"))         # доля профилируемых апдейтов
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))  # период снятия стека
+PROFILE_FLUSH_S = float(os.getenv("PROFILE_FLUSH_S", "60"))     # как часто переписывать .folded
+PROFILE_DIR = os.getenv("PROFILE_DIR", (STORE_FILE or "bot") + ".profiles")
+LOOP_TICK_MS = float(os.getenv("LOOP_TICK_MS", "50"))           # как часто мерить задержку loop'а
+SLOW_CALLBACK_MS = float(os.getenv("SLOW_CALLBACK_MS", "100"))  # дольше — пишем стек и хендлер
+LOOP_LOG_S = float(os.getenv("LOOP_LOG_S", "60"))               # период сводки в лог
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "16"))  # уведомлений в доставке одновременно
+FSM_TTL_S = int(os.getenv("FSM_TTL_S", str(24 * 3600)))  # FSM-состояние и черновик сделки без изменений — снимаются
+FSM_CACHE = int(os.getenv("FSM_CACHE", "10000"))        # ключей FSM в кэше чтения (при STORE_PATH)
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", (STORE_FILE or "bot") + ".snapshot")  # снимок на выходе; пусто — нет
+SHARD_GUEST_TIMEOUT = float(os.getenv("SHARD_GUEST_TIMEOUT", "0.5"))  # ждать профиль гостя от его шарда
+SHARD_PANEL_TIMEOUT = float(os.getenv("SHARD_PANEL_TIMEOUT", "10"))   # ждать, пока шард гостя нарисует его панель
+
+def shard_path(path: str) -> str:
+    return f"{path}.{SHARD_INDEX}" if path and SHARD_COUNT > 1 and "://" not in path else path
+
+# у каждого шарда свои файлы (общий redis:// — один на всех, но NODE_ID свой)
+NODE_ID = NODE_ID or socket.gethostname()
+STORE_PATH, NODE_ID, CHATLOG_DIR, PROFILE_DIR, SNAPSHOT_PATH, METRICS_SOCKET = map(
+    shard_path, (STORE_PATH, NODE_ID, CHATLOG_DIR, PROFILE_DIR, SNAPSHOT_PATH, METRICS_SOCKET))
 
 # ---------- STATES ----------
 class SetWallet(StatesGroup):
@@ -48,185 +128,306 @@ class AdminFlow(StatesGroup):
     waiting_user_for_purge = State()
 
 # ---------- TEXTS ----------
-def t(lang: str, key: str) -> str:
-    RU = {
-        "hello": (
-            "👋 <b>MoonGarant</b> — ваш надёжный выбор для сделок с цифровыми подарками и NFT в Telegram.\n\n"
-            "• Создавайте ордера за пару шагов\n"
-            "• Делитесь безопасной ссылкой для продавца\n"
-            "• Авто-таймеры: ссылка — 30 мин, подтверждение — 15 мин\n"
-            "• Красивые карточки и удобные кнопки\n\n"
-            "Выберите действие ниже:"
-        ),
-        "menu": "🏠 <b>Меню</b>",
-
-        # SETTINGS
-        "settings_title": "⚙️ Настройки",
-        "settings_prompt": (
-            "⚙️ <b>Настройки</b>\n\n"
-            "Текущий язык: <b>{lang_name}</b>\n"
-            "Текущий метод оплаты: <b>{pay_method}</b>\n\n"
-            "Выберите метод ниже:"
-        ),
-        "lang_menu_footer": "↩️ В меню / Menu",
-        "lang_ru": "🇷🇺 Русский",
-        "lang_en": "🇬🇧 English",
-
-        "wallet_enter": "👛 <b>Кошелёк</b>\nОтправьте адрес вашего TON-кошелька.",
-        "wallet_saved": "✅ Кошелёк сохранён: <code>{addr}</code>",
-        "wallet_invalid": "⚠️ Похоже, это не TON-адрес. Попробуйте снова.",
-        "deal_expired": "⏳ Срок действия ордера истёк.",
-
-        # Deep-link / creator self-open
-        "creator_open_link": "ℹ️ Вы уже являетесь создателем этого ордера.\nОтправьте ссылку второму участнику сделки.",
-
-        # Seller invite flow
-        "seller_invite": (
-            "👋 Вы приглашены в сделку в <b>MoonGarant</b>.\n\n"
-            "🧾 <b>Ордер</b>\n"
-            "<b>Название:</b> {title}\n"
-            "<b>Описание:</b> {desc}\n"
-            "<b>Оплата:</b> {price_label}\n\n"
-            "Если согласны — нажмите «Принять»."
-        ),
-        "accept_short": "✅ Принять",
-        "decline_short": "❌ Отклонить",
-        "seller_declined": "❌ Продавец отклонил приглашение. Сделка отменена.",
-
-        "accept_btn": "✅ Принять ордер",
-        "seller_details": (
-            "🧾 <b>Ордер</b>\n"
-            "<b>Название:</b> {title}\n"
-            "<b>Описание:</b> {desc}\n"
-            "<b>Цена/условия:</b> {price_label}\n"
-            "<b>Отправить NFT (покупателю):</b> {target}\n\n"
-            "После передачи нажмите «Я перевёл(а) подарки»."
-        ),
-        "seller_stopped": "⛔️ Продавец остановил ордер. Сделка отменена.",
-        "seller_confirmed_wait": "✅ Отправка подарков подтверждена.\n⌛ <b>Ожидайте оплату, не более 15 минут...</b>",
-        "seller_final_needed": "💳 Покупатель отметил оплату.\nЕсли получили средства — нажмите «Подтвердить получение оплаты».",
-        "seller_final_done": "🎉 Оплата подтверждена. Сделка завершена!",
-
-        # requisites prompts
-        "ask_requisite_ton": "Укажите <b>TON-адрес</b> вашего кошелька.",
-        "ask_requisite_stars": "Укажите <b>@username</b>, на который принимать ⭐ STARS.",
-        "ask_requisite_fiat": "Укажите <b>номер карты {method}</b> для оплаты.",
-        "ask_requisite_exchange": "Укажите ваши <b>реквизиты для обмена</b> (например: @user в STARS или TON-адрес).",
-        "bad_card": "⚠️ Нужен номер карты (минимум 8 цифр).",
-
-        # Buyer side
-        "buyer_notif_confirmed": "✅ Продавец подтвердил отправку по ордеру <b>{title}</b>.",
-        "buyer_pay_prompt_std": (
-            "🧾 <b>Детали ордера</b>\n"
-            "<b>Название:</b> {title}\n"
-            "<b>Описание:</b> {desc}\n"
-            "<b>Цена:</b> {price_value} {method}\n"
-            "<b>Куда отправить NFT:</b> {target}\n\n"
-            "💳 <b>Оплата</b>\n"
-            "<b>Кошелёк/реквизиты продавца:</b> <code>{seller_wallet}</code>\n"
-            "<b>Комментарий/MEMO:</b> <code>{memo}</code>\n\n"
-            "⚠️ <b>Внимание!</b> Укажите <b>комментарий/MEMO</b> при переводе: <code>{memo}</code> — иначе оплата не будет засчитана!"
-        ),
-        "buyer_pay_prompt_ex": (
-            "🧾 <b>Детали ордера</b>\n"
-            "<b>Название:</b> {title}\n"
-            "<b>Описание:</b> {desc}\n"
-            "<b>Обмен:</b> {exchange_desc}\n"
-            "<b>Куда отправить NFT:</b> {target}\n\n"
-            "💳 <b>Оплата</b>\n"
-            "<b>Реквизиты продавца:</b> <code>{seller_wallet}</code>\n"
-            "<b>Комментарий/MEMO:</b> <code>{memo}</code>\n\n"
-            "⚠️ <b>Внимание!</b> Укажите <b>комментарий/MEMO</b> при переводе: <code>{memo}</code> — иначе оплата не будет засчитана!"
-        ),
-        "buyer_wait_confirm": "⌛ Ожидайте подтверждения получения оплаты продавцом.",
-        "buyer_final_done": "✅ Продавец подтвердил отправку по ордеру <b>{title}</b>.",
-
-        # Create flow prompts (depend on pay method)
-        "ask_title": "Введите <b>название</b> ордера.",
-        "ask_desc": "Введите <b>описание</b> ордера (содержание подарков).",
-        "ask_price_std": "Введите <b>цену</b> в {method} (например: <code>12.5</code>).",
-        "ask_price_ex": "Укажите <b>условия обмена</b> в формате: <code>100 STARS -> 12 TON</code>.",
-        "ask_user": "Укажите <b>@username</b> покупателя.",
-        "bad_price": "⚠️ Нужно число (можно с точкой).",
-        "bad_user": "⚠️ Укажите username в формате <code>@username</code>.",
-
-        # Final card (buyer side)
-        "final_std": (
-            "🧾 <b>Детали ордера</b>\n\n"
-            "<b>Название:</b> {title}\n"
-            "<b>Описание:</b> {desc}\n"
-            "<b>Цена:</b> {price_value} {method}\n"
-            "<b>Куда отправить NFT:</b> {target}\n\n"
-            "После перехода продавца по ссылке у него будет <b>15 минут</b> на подтверждение отправки.\n\n"
-            "<b>Ссылка:</b> {link}"
-        ),
-        "final_ex": (
-            "🧾 <b>Детали ордера</b>\n\n"
-            "<b>Название:</b> {title}\n"
-            "<b>Описание:</b> {desc}\n"
-            "<b>Обмен:</b> {exchange_desc}\n"
-            "<b>Куда отправить NFT:</b> {target}\n\n"
-            "После перехода продавца по ссылке у него будет <b>15 минут</b> на подтверждение отправки.\n\n"
-            "<b>Ссылка:</b> {link}"
-        ),
-
-        "current_title": "🟡 <b>Текущая сделка</b>",
-        "history_title": "🗂 <b>История сделок</b> (последние 10)",
-        "no_history": "Пока нет завершённых сделок.",
-
-        # Buttons
-        "copy_memo": "📋 Скопировать MEMO",
-        "confirm_paid": "✅ Подтвердить оплату",
-        "confirm_receive": "✅ Подтвердить получение оплаты",
-
-        # Admin
-        "admin_title": "🛡️ <b>Admin Panel</b>\nВыберите действие:",
-        "admin_btn_recent": "📊 Последние сделки",
-        "admin_btn_chatlog": "🕓 История чата пользователя",
-        "admin_btn_purge": "🧹 Удалить сообщения пользователя",
-        "admin_back": "↩️ Назад в панель",
-        "admin_enter_user": "Отправьте @username или числовой ID пользователя.",
-        "admin_no_log": "Нет записей чата для этого пользователя.",
-        "admin_purged": "🧹 Удаление завершено. Что смог — удалил.",
-        "not_admin": "Доступ ограничен.",
-    }
-    EN = RU
-    return (RU if lang == "ru" else EN)[key]
-
-LANG_NAME = {"ru": "русский", "en": "english"}
+# каталог (RU/EN) собирается один раз в texts.py; t() — строка, tf() — готовый рендер
 
 # ---------- MEMORY ----------
 class Memory:
-    def __init__(self):
+    # секции, которые уходят в store; ключи deals и outbox — строки, остальные — user_id
+    PERSISTENT = ("users", "usernames", "deals", "history", "chatlog", "wip", "outbox", "panel_id")
+    # в снимок тёплого рестарта — ещё и то, что store не пишет (panel_digest нет: hash() строк солится заново)
+    SNAPSHOT = PERSISTENT + ("user_msgs", "all_msgs", "last_start_msg")
+    # всё, чей размер видно на /metrics
+    SIZED = PERSISTENT + ("timeline", "inline_results", "user_msgs", "all_msgs", "panel_id", "last_start_msg")
+
+    def __init__(self, store: Optional[Store] = None, chatlog_dir: str = ""):
         self.users: Dict[int, dict] = {}
-        self.usernames: Dict[int, str] = {}
-        self.deals: Dict[str, dict] = {}
-        self.history: Dict[int, List[dict]] = {}
-
-        self.user_msgs: Dict[int, List[int]] = {}      # per-chat: messages to clean on menu
+        self.usernames = UsernameIndex()            # user_id <-> @username
+        self.deals: DealRegistry = DealRegistry()  # deal_id -> Deal + индексы creator/seller/status
+        self.deadlines = DeadlineScheduler()        # expires_at / seller_deadline сделок и "wip" черновиков
+        self.deal_locks = DealLocks()                # deal_id -> замок: переходы одной сделки по очереди
+        self.history: Dict[int, List[DealSummary]] = {}  # creator_id -> завершённые, новые первыми
+        self.timeline = DealTimeline()               # живые + история по времени создания (админка)
+        self.inline_results: Dict[str, list] = {}    # deal_id -> готовые results для answerInlineQuery
+        self.outbox = Outbox(OUTBOX_CONCURRENCY)      # недоставленные уведомления второй стороне
+
+        self.user_msgs: Dict[int, List[Tuple[int, int]]] = {}  # per-chat: (msg_id, epoch) to clean on menu
         self.panel_id: Dict[int, int] = {}             # per-chat panel message id
+        self.panel_digest: Dict[int, int] = {}         # per-chat хэш того, что сейчас на панели
 
-        self.chatlog: Dict[int, List[Tuple[datetime, str, str]]] = {}  # user_id -> [(ts, who, text)]
+        self.chatlog = ChatLog(chatlog_dir, ring=CHATLOG_RING)     # user_id -> кольцо (epoch, who, text) + сегменты
         self.all_msgs: Dict[int, List[Tuple[int, int]]] = {}           # user_id -> [(chat_id, msg_id)]
 
-        self.wip: Dict[int, dict] = {}
+        self.wip: Dict[int, dict] = {}                # user_id -> черновик сделки; снимается через FSM_TTL_S
 
         # для «только один /start»
         self.last_start_msg: Dict[int, int] = {}  # chat_id -> msg_id последнего /start
 
-memory = Memory()
-
-def now() -> datetime:
-    return datetime.now(timezone.utc)
+        # write-behind: хендлеры мутируют объекты в памяти и отмечают ключ грязным,
+        # flush() раз в STORE_FLUSH_MS пишет всё накопленное одной транзакцией
+        self.store: Store = store or open_store("")
+        self.dirty: Dict[str, set] = {s: set() for s in self.PERSISTENT}
+        # один flush за раз — и свой, и FSM: пачки из разных потоков to_thread
+        # иначе доходят до store в любом порядке, старая может лечь поверх новой
+        self.flush_lock = asyncio.Lock()
+
+    def touch(self, section: str, key) -> None:
+        if self.store.persistent:
+            self.dirty[section].add(key)
+
+    @staticmethod
+    def _key(section: str, raw: str):
+        return raw if section in ("deals", "outbox") else int(raw)
+
+    def load(self, snapshot: Iterable[Tuple[str, list]] = ()) -> None:
+        """Сначала store, затем кадры снимка (read_snapshot); индексы — один раз в конце."""
+        # миллион новых контейнеров подряд: со сборщиком каждая полная сборка
+        # заново обходит всё уже прочитанное (на снимке — втрое дольше)
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._load(snapshot)
+        finally:
+            if enabled:
+                gc.enable()
+        gc.freeze()  # прочитанное живёт долго: полные сборки его больше не обходят
+
+    def _load(self, snapshot: Iterable[Tuple[str, list]]) -> None:
+        for section in self.PERSISTENT:
+            self._restore(section, ((self._key(section, key), value) for key, value in self.store.load(section)))
+        for section, items in snapshot:
+            if section not in self.SNAPSHOT:
+                continue
+            self._restore(section, items)
+            if section in self.dirty:
+                # снимок от запуска без store: в store его ещё нет
+                for key, _ in items:
+                    self.touch(section, key)
+        for d in self.deals.values():
+            self.schedule_deal(d)
+        now = int(time.time())
+        for uid, draft in self.wip.items():
+            # черновики из store до TTL — отсчёт с момента загрузки
+            self.deadlines.schedule(uid, "wip", draft.setdefault("at", now) + FSM_TTL_S)
+        self.outbox.release(sorted(self.outbox))  # не доставленное до рестарта
+        # лента строится один раз при старте, дальше только дописывается
+        recs = [h for hs in self.history.values() for h in hs] + list(self.deals.values())
+        recs.sort(key=lambda r: r.created_at or 0)
+        for rec in recs:
+            self.timeline.add(rec)
+
+    def _restore(self, section: str, items: Iterable[tuple]) -> None:
+        target = getattr(self, section)
+        upgrade = self._upgrade
+        for key, value in items:
+            target[key] = upgrade(section, value)
+
+    def snapshot(self) -> Iterator[Tuple[str, Iterator[tuple]]]:
+        # то, что уже лежит в store, в снимок не пишем
+        for section in self.SNAPSHOT:
+            if self.store.persistent and section in self.PERSISTENT:
+                continue
+            yield section, self._entries(getattr(self, section))
+
+    @staticmethod
+    def _entries(src) -> Iterator[tuple]:
+        for key in src:
+            yield key, src.get(key)
+
+    @staticmethod
+    def _upgrade(section: str, value):
+        # store до Deal/DealSummary хранил сделки dict'ами
+        if section == "deals" and isinstance(value, dict):
+            return Deal.from_dict(value)
+        if section == "history":
+            return [DealSummary.from_dict(h) if isinstance(h, dict) else h for h in value]
+        return value
+
+    def collect_dirty(self) -> list:
+        # сериализуем на event loop'е, пока объекты не успели измениться
+        rows = []
+        for section, keys in self.dirty.items():
+            if not keys:
+                continue
+            self.dirty[section] = set()
+            src = getattr(self, section)
+            for key in keys:
+                value = src.get(key)
+                rows.append((section, str(key), None if value is None else self.store.encode(value)))
+        return rows
+
+    async def flush(self) -> int:
+        async with self.flush_lock:
+            self.chatlog.sync()
+            rows = self.collect_dirty()
+            if not rows:
+                return 0
+            try:
+                await asyncio.to_thread(self.store.write, rows)
+            except Exception:
+                # не потеряем изменения: следующий flush запишет актуальные значения
+                for section, key, _ in rows:
+                    self.dirty[section].add(self._key(section, key))
+                raise
+        self.outbox.release(key for section, key, blob in rows if section == "outbox" and blob is not None)
+        return len(rows)
+
+    # --- deals ---
+    def schedule_deal(self, d: Deal) -> None:
+        for kind in ("expires_at", "seller_deadline"):
+            when = getattr(d, kind)
+            if when:
+                self.deadlines.schedule(d.id, kind, when)
+            else:
+                self.deadlines.cancel(d.id, kind)
+
+    def put_deal(self, d: Deal) -> None:
+        self.deals.put(d)
+        self.timeline.add(d)
+        self.schedule_deal(d)
+        self.touch("deals", d.id)
+
+    def update_deal(self, d: Deal) -> None:
+        # сделку поменяли на месте (кроме status/seller_id) — переиндексировать нечего
+        d.version += 1
+        self.schedule_deal(d)
+        self.touch("deals", d.id)
+
+    def set_deal_status(self, d: Deal, status) -> None:
+        d.version += 1
+        self.deals.set_status(d, status)
+        self.inline_results.pop(d.id, None)
+        self.touch("deals", d.id)
+
+    async def transition(self, d: Deal, event: str) -> Status:
+        """Переход по TRANSITIONS; вызывать под memory.deal_locks(d.id).
+        Снятую с реестра сделку не трогаем — иначе touch вернул бы её в store.
+
+        С общим store (redis://) замок держит только этот инстанс, поэтому
+        переход сперва пишется в store CAS'ом: сделка там должна быть в том же
+        статусе и не новее нашей. Проиграли другому инстансу — TransitionError,
+        свежую сделку привезёт инвалидация."""
+        status = TRANSITIONS.get((d.status, event))
+        if status is None or self.deals.get(d.id) is not d:
+            raise TransitionError(d.id, d.status, event)
+        if self.store.shared:
+            after = copy.copy(d)
+            after.status, after.version = status, d.version + 1
+            ok = lambda cur: cur is not None and cur.status == d.status and cur.version <= d.version
+            if not await asyncio.to_thread(self.store.cas, "deals", d.id, ok, self.store.encode(after)) \
+                    or self.deals.get(d.id) is not d:
+                raise TransitionError(d.id, d.status, event)
+        self.set_deal_status(d, status)
+        return status
+
+    def set_deal_seller(self, d: Deal, seller_id: Optional[int]) -> None:
+        d.version += 1
+        self.deals.set_seller(d, seller_id)
+        self.touch("deals", d.id)
+
+    def drop_deal(self, deal_id: str) -> None:
+        self._unlink_deal(deal_id)
+        self.touch("deals", deal_id)
+
+    def _unlink_deal(self, deal_id: str) -> None:
+        self.deals.pop(deal_id, None)
+        self.deadlines.cancel(deal_id)
+        self.timeline.discard_live(deal_id)
+        self.inline_results.pop(deal_id, None)
+
+    def archive_deal(self, d: Deal) -> None:
+        summary = d.summary()
+        self.history.setdefault(d.creator_id, []).insert(0, summary)
+        self.timeline.add(summary)
+        self.touch("history", d.creator_id)
+
+    def notify(self, chat_id: Optional[int], text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+               panel: bool = False) -> None:
+        """Уведомление второй стороне; звать сразу после перехода, без await между
+        ними, — тогда оба попадут в один flush. Доставляет outbox_worker."""
+        if not chat_id:
+            return
+        markup = reply_markup.model_dump(exclude_none=True) if reply_markup else None
+        nid = self.outbox.add(Notice(chat_id, text, markup, panel, time.time()))
+        self.touch("outbox", nid)
+        if not self.store.persistent:
+            self.outbox.release((nid,))
+
+    # --- wip ---
+    def touch_wip(self, uid: int) -> None:
+        draft = self.wip.get(uid)
+        if draft is not None:
+            draft["at"] = int(time.time())
+            self.deadlines.schedule(uid, "wip", draft["at"] + FSM_TTL_S)
+        self.touch("wip", uid)
+
+    def drop_wip(self, uid: int) -> None:
+        self.wip.pop(uid, None)
+        self.deadlines.cancel(uid, "wip")
+        self.touch("wip", uid)
+
+    def log(self, uid: int, who: str, text: str) -> None:
+        self.chatlog.append(uid, who, text)
+        self.touch("chatlog", uid)
+
+    # --- общий store: изменения других инстансов ---
+    def apply(self, section: str, raw: str, value) -> None:
+        """Свежее значение ключа из store после инвалидации; None — ключ удалён.
+        Ключ, ещё ждущий нашего flush, не трогаем: запись рассудит store."""
+        key = self._key(section, raw)
+        if key in self.dirty.get(section, ()):
+            return
+        value = None if value is None else self._upgrade(section, value)
+        if section == "deals":
+            old = self.deals.get(key)
+            if value is None or old is not None:
+                if value is not None and old.version > value.version:
+                    return   # наша запись ещё в пути
+                self._unlink_deal(key)
+            if value is not None:
+                self.deals.put(value)
+                self.timeline.add(value)
+                self.schedule_deal(value)
+            return
+        target = getattr(self, section)
+        if value is None:
+            target.pop(key, None)
+        else:
+            target[key] = value
+        if section == "history":
+            for rec in value or ():
+                self.timeline.add(rec)   # живая сделка в ленте меняется на архивную запись
+        elif section == "wip":
+            if value is None:
+                self.deadlines.cancel(key, "wip")
+            else:
+                self.deadlines.schedule(key, "wip", value.get("at", int(time.time())) + FSM_TTL_S)
+        elif section == "panel_id":
+            self.panel_digest.pop(key, None)
+
+    def resync(self, fresh: Dict[str, Dict[str, object]]) -> None:
+        """fresh: секция -> всё её содержимое в store (после разрыва канала инвалидаций)."""
+        for section, items in fresh.items():
+            gone = [key for key in getattr(self, section) if str(key) not in items]
+            for key in gone:
+                self.apply(section, str(key), None)
+            for raw, value in items.items():
+                self.apply(section, raw, value)
+
+    def sizes(self) -> Dict[str, int]:
+        return {section: len(getattr(self, section)) for section in self.SIZED}
+
+memory = Memory(open_store(STORE_PATH, NODE_ID), CHATLOG_DIR)
 
 def get_lang(uid: int) -> str:
     return memory.users.get(uid, {}).get("lang") or "ru"
 
 def set_lang(uid: int, lang: str):
     memory.users.setdefault(uid, {})["lang"] = lang
+    memory.touch("users", uid)
 
 def set_wallet(uid: int, w: str):
     memory.users.setdefault(uid, {})["wallet"] = w
+    memory.touch("users", uid)
 
 def get_wallet(uid: int) -> Optional[str]:
     return memory.users.get(uid, {}).get("wallet")
@@ -237,16 +438,22 @@ def get_pay_method(uid: int) -> str:
 
 def set_pay_method(uid: int, method: str):
     memory.users.setdefault(uid, {})["pay_method"] = method
+    memory.touch("users", uid)
 
 def set_warning(uid: int, mid: Optional[int]):
-    memory.users.setdefault(uid, {})["warn_id"] = mid
+    d = memory.users.setdefault(uid, {})
+    d["warn_id"] = mid
+    d["warn_at"] = int(time.time())
+    memory.touch("users", uid)
 
-def pop_warning(uid: int) -> Optional[int]:
+def pop_warning(uid: int) -> Optional[Tuple[int, int]]:
+    # -> (msg_id, epoch отправки) или None
     d = memory.users.get(uid, {})
-    mid = d.get("warn_id")
-    if "warn_id" in d:
-        del d["warn_id"]
-    return mid
+    mid = d.pop("warn_id", None)
+    at = d.pop("warn_at", None)
+    if mid is not None or at is not None:
+        memory.touch("users", uid)
+    return (mid, at or int(time.time())) if mid else None
 
 def is_ton_address(text: str) -> bool:
     if not text:
@@ -257,23 +464,33 @@ def is_ton_address(text: str) -> bool:
     return 48 <= len(s) <= 66 and all(c.isalnum() or c in "-_:" for c in s)
 
 def has_active_deal(uid: int) -> bool:
-    for d in memory.deals.values():
-        if d.get("creator_id") == uid and d.get("status") in {"new", "await_payment", "await_seller_final"} and now() < d.get("expires_at", now()):
-            return True
-    return False
+    return memory.deals.has_active_for_creator(uid, time.time())
 
 def has_history(uid: int) -> bool:
     return bool(memory.history.get(uid))
 
 def is_admin(uid: int) -> bool:
-    return ADMIN_ID and uid == ADMIN_ID
+    return bool(ADMIN_ID) and uid == ADMIN_ID
 
 def remember_username(u) -> None:
     if u:
-        if getattr(u, "username", None):
-            memory.usernames[u.id] = f"@{u.username}"
-        else:
-            memory.usernames.setdefault(u.id, f"id{u.id}")
+        # переименование или снятый username снимают старый handle из индекса
+        name = f"@{u.username}" if getattr(u, "username", None) else f"id{u.id}"
+        if memory.usernames.set(u.id, name):
+            memory.touch("usernames", u.id)
+
+def resolve_user(query: str) -> Optional[int]:
+    if query.startswith("@"):
+        return memory.usernames.find(query)
+    try: return int(query)
+    except ValueError: return None
+
+def not_found_text(query: str) -> str:
+    text = t("ru", "admin_user_not_found")
+    hits = memory.usernames.search(query, 8) if query.startswith("@") and len(query) > 1 else []
+    if hits:
+        text += "\n\n" + tf("ru", "admin_user_similar", hits=", ".join(f"@{h} (<code>{uid}</code>)" for h, uid in hits))
+    return text
 
 # ---------- HELPERS ----------
 async def register_start_and_keep_single(m: Message):
@@ -287,184 +504,249 @@ async def register_start_and_keep_single(m: Message):
             pass
     memory.last_start_msg[chat_id] = m.message_id
 
-# ---------- KEYBOARDS ----------
-def main_menu(lang: str, has_active: bool = False, has_history_: bool = False, uid: Optional[int] = None) -> InlineKeyboardMarkup:
-    t_ru = ("⚙️ Настройки", "👛 Кошелёк", "📦 Создать сделку", "🟡 Текущая сделка", "🗂 История сделок")
-    t_en = ("⚙️ Settings", "👛 Wallet", "📦 Create deal", "🟡 Current deal", "🗂 Deal history")
-    t_local = t_ru if lang == "ru" else t_en
-    rows = [
-        [InlineKeyboardButton(text=t_local[0], callback_data="settings")],
-        [InlineKeyboardButton(text=t_local[1], callback_data="wallet")],
-        [InlineKeyboardButton(text=t_local[2], callback_data="create")],
-    ]
-    if has_active:
-        rows.append([InlineKeyboardButton(text=t_local[3], callback_data="current")])
-    if has_history_:
-        rows.append([InlineKeyboardButton(text=t_local[4], callback_data="history")])
-    if uid and is_admin(uid):
-        rows.append([InlineKeyboardButton(text="🛡️ Admin", callback_data="admin_panel")])
-    return InlineKeyboardMarkup(inline_keyboard=rows)
-
-def back_to_menu(lang: str) -> InlineKeyboardMarkup:
-    txt = "↩️ В меню" if lang == "ru" else "↩️ Menu"
-    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=txt, callback_data="menu")]])
-
-def settings_kb(lang: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="RUB", callback_data="pay:RUB"),
-            InlineKeyboardButton(text="USD", callback_data="pay:USD"),
-            InlineKeyboardButton(text="KZT", callback_data="pay:KZT"),
-        ],
-        [InlineKeyboardButton(text="⭐ STARS", callback_data="pay:STARS")],
-        [
-            InlineKeyboardButton(text="TON", callback_data="pay:TON"),
-            InlineKeyboardButton(text="🔁 Обмен", callback_data="pay:EXCHANGE"),
-        ],
-        [
-            InlineKeyboardButton(text=t("ru","lang_ru"), callback_data="lang_ru"),
-            InlineKeyboardButton(text=t("ru","lang_en"), callback_data="lang_en"),
-        ],
-        [InlineKeyboardButton(text=t("ru","lang_menu_footer"), callback_data="menu")]
-    ])
-
-def create_nav_prev_only(lang: str, step: int) -> InlineKeyboardMarkup:
-    prev_txt = "⬅️ Пред" if lang == "ru" else "⬅️ Prev"
-    cancel_txt = "⛔️ Отменить" if lang == "ru" else "⛔️ Cancel"
-    menu_txt = "↩️ В меню" if lang == "ru" else "↩️ Menu"
-    rows = []
-    if step > 1:
-        rows.append([InlineKeyboardButton(text=prev_txt, callback_data="create_prev")])
-    rows.append([InlineKeyboardButton(text=cancel_txt, callback_data="create_cancel")])
-    rows.append([InlineKeyboardButton(text=menu_txt, callback_data="menu")])
-    return InlineKeyboardMarkup(inline_keyboard=rows)
-
-def final_actions(lang: str, deal_id: str) -> InlineKeyboardMarkup:
-    send_txt = "📩 Отправить продавцу" if lang == "ru" else "📩 Send to seller"
-    cancel_txt = "⛔️ Отменить ордер" if lang == "ru" else "⛔️ Cancel order"
-    menu_txt = "↩️ В меню" if lang == "ru" else "↩️ Menu"
-    btn_send = InlineKeyboardButton(
-        text=send_txt,
-        switch_inline_query_chosen_chat={"query": f"deal_{deal_id}", "allow_user_chats": True,
-                                         "allow_bot_chats": False, "allow_group_chats": True,
-                                         "allow_channel_chats": False}
-    )
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [btn_send],
-        [InlineKeyboardButton(text=cancel_txt, callback_data=f"deal:{deal_id}:stop")],
-        [InlineKeyboardButton(text=menu_txt, callback_data="menu")],
-    ])
-
-def seller_controls(lang: str, deal_id: str) -> InlineKeyboardMarkup:
-    texts = ("⛔️ Остановить ордер", "✅ Я перевёл(а) подарки") if lang == "ru" else ("⛔️ Stop order", "✅ I sent the gifts")
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=texts[0], callback_data=f"deal:{deal_id}:stop")],
-        [InlineKeyboardButton(text=texts[1], callback_data=f"deal:{deal_id}:confirm")],
-    ])
-
-def accept_order_kb(lang: str, deal_id: str) -> InlineKeyboardMarkup:
-    txt = t(lang, "accept_btn")
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=txt, callback_data=f"deal:{deal_id}:accept")],
-        [InlineKeyboardButton(text=("↩️ В меню" if lang == "ru" else "↩️ Menu"), callback_data="menu")]
-    ])
-
-def accept_decline_kb(lang: str, deal_id: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text=t(lang, "accept_short"),  callback_data=f"deal:{deal_id}:accept_invite"),
-            InlineKeyboardButton(text=t(lang, "decline_short"), callback_data=f"deal:{deal_id}:decline"),
-        ],
-        [InlineKeyboardButton(text=("↩️ В меню" if lang == "ru" else "↩️ Menu"), callback_data="menu")]
-    ])
-
-def buyer_pay_kb(lang: str, deal_id: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=t(lang, "copy_memo"), callback_data=f"memo:{deal_id}")],
-        [InlineKeyboardButton(text=t(lang, "confirm_paid"), callback_data=f"paid:{deal_id}")],
-        [InlineKeyboardButton(text=("↩️ В меню" if lang == "ru" else "↩️ Menu"), callback_data="menu")],
-    ])
-
-def seller_final_kb(lang: str, deal_id: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=t(lang, "confirm_receive"), callback_data=f"finish:{deal_id}")],
-        [InlineKeyboardButton(text=("↩️ В меню" if lang == "ru" else "↩️ Menu"), callback_data="menu")],
-    ])
-
-def admin_panel_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=t("ru","admin_btn_recent"), callback_data="admin_recent")],
-        [InlineKeyboardButton(text=t("ru","admin_btn_chatlog"), callback_data="admin_chatlog")],
-        [InlineKeyboardButton(text=t("ru","admin_btn_purge"), callback_data="admin_purge")],
-        [InlineKeyboardButton(text=t("ru","admin_back"), callback_data="admin_back_menu")]
-    ])
-
-def admin_back_only_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=t("ru","admin_back"), callback_data="admin_back")]
-    ])
-
 # ---------- PANEL / LOG ----------
-async def show_panel(chat_id: int, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
-    memory.chatlog.setdefault(chat_id, []).append((now(), "bot", text))
+async def send(chat_id: int, text: str, lane: int = REPLY, **kwargs) -> Message:
+    # все исходящие сообщения идут через outbound: лимиты Telegram и RetryAfter
+    return await outbound.call(chat_id, lambda: bot.send_message(chat_id, text, **kwargs), lane)
+
+def panel_digest(text: str, reply_markup: Optional[InlineKeyboardMarkup]) -> int:
+    return hash((text, reply_markup.model_dump_json() if reply_markup else None))
+
+async def apply_panel(chat_id: int, text: str, reply_markup: Optional[InlineKeyboardMarkup], lane: int) -> bool:
+    digest = panel_digest(text, reply_markup)
     mid = memory.panel_id.get(chat_id)
+    if mid and memory.panel_digest.get(chat_id) == digest:
+        return False  # на панели уже ровно это — Telegram ответил бы «message is not modified»
+    memory.log(chat_id, "bot", text)
     try:
         if mid:
-            msg = await bot.edit_message_text(
+            await outbound.call(chat_id, lambda: bot.edit_message_text(
                 chat_id=chat_id,
                 message_id=mid,
                 text=text,
                 reply_markup=reply_markup,
                 parse_mode=ParseMode.HTML,
-            )
-            memory.panel_id[chat_id] = msg.message_id
-            memory.all_msgs.setdefault(chat_id, []).append((chat_id, msg.message_id))
-            return
+            ), lane)
+            memory.panel_digest[chat_id] = digest
+            if memory.store.shared:
+                memory.touch("panel_id", chat_id)  # другие инстансы сбросят свой panel_digest
+            return True
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            memory.panel_digest[chat_id] = digest
+            return True
     except Exception:
         pass
-    msg = await bot.send_message(chat_id, text, reply_markup=reply_markup)
+    msg = await send(chat_id, text, lane, reply_markup=reply_markup)
     memory.panel_id[chat_id] = msg.message_id
+    memory.touch("panel_id", chat_id)
+    memory.panel_digest[chat_id] = digest
     memory.all_msgs.setdefault(chat_id, []).append((chat_id, msg.message_id))
+    return True
+
+async def show_panel(chat_id: int, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None, lane: int = REPLY):
+    home = shard_of(chat_id, SHARD_COUNT)
+    if shard_link is not None and home != SHARD_INDEX:
+        # панель гостя (panel_id, panel_digest) — состояние его шарда: рисует он
+        markup = reply_markup.model_dump(mode="json", exclude_none=True) if reply_markup else None
+        await shard_link.call(home, "panel", chat_id, text, markup, lane, timeout=SHARD_PANEL_TIMEOUT)
+        return
+    # быстрые повторные перерисовки одного чата склеиваются в один edit
+    await panels.render(chat_id, text, reply_markup, lane)
 
 async def add_user_msg(m: Message):
-    memory.user_msgs.setdefault(m.chat.id, []).append(m.message_id)
+    memory.user_msgs.setdefault(m.chat.id, []).append((m.message_id, int(m.date.timestamp())))
     memory.all_msgs.setdefault(m.from_user.id, []).append((m.chat.id, m.message_id))
-    memory.chatlog.setdefault(m.from_user.id, []).append((now(), "user", m.text or ""))
+    memory.log(m.from_user.id, "user", m.text or "")
+
+DELETE_WINDOW = 48 * 3600 - 60   # Telegram даёт удалять сообщения 48 часов; минута запаса
+DELETE_BATCH = 100               # лимит deleteMessages за один вызов
 
-async def clear_flow_messages(chat_id: int):
-    for mid in memory.user_msgs.get(chat_id, []):
+async def delete_many(chat_id: int, items: List[Tuple[int, int]]):
+    # старые сообщения Telegram всё равно не удалит — не тратим на них запросы
+    cutoff = time.time() - DELETE_WINDOW
+    ids = sorted({mid for mid, at in items if at >= cutoff})
+    for i in range(0, len(ids), DELETE_BATCH):
         try:
-            await bot.delete_message(chat_id, mid)
+            await bot.delete_messages(chat_id, ids[i:i + DELETE_BATCH])
         except Exception:
             pass
+
+async def clear_flow_messages(chat_id: int, warn_of: Optional[int] = None):
+    # warn_of=uid — заодно убрать его последнее предупреждение, тем же вызовом
+    items = memory.user_msgs.get(chat_id, [])
     memory.user_msgs[chat_id] = []
+    warn = pop_warning(warn_of) if warn_of else None
+    if warn:
+        items = items + [warn]
+    if items:
+        await delete_many(chat_id, items)
 
 # ---------- BOT ----------
-bot = Bot(BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher()
+def make_session() -> ResilientSession:
+    # повторы 5xx/сети/коротких RetryAfter — здесь; Outbound и Outbox видят только то, что не прошло
+    api = {"api": TelegramAPIServer.from_base(TELEGRAM_API_URL)} if TELEGRAM_API_URL else {}
+    return ResilientSession(max_attempts=API_ATTEMPTS, max_retry_after=API_MAX_RETRY_AFTER,
+                            limit=API_POOL_SIZE, timeout=API_TIMEOUT_S,
+                            breaker=CircuitBreaker(ratio=API_BREAKER_RATIO, cooldown=API_BREAKER_COOLDOWN_S), **api)
+
+api_session = make_session()   # бенчи подменяют bot, счётчики сессии остаются за этой
+bot = Bot(BOT_TOKEN, session=api_session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+fsm = TTLStorage(memory.store, FSM_TTL_S, FSM_CACHE, flush_lock=memory.flush_lock)
+dp = Dispatcher(storage=fsm)
+outbound = Outbound(global_rate=OUT_GLOBAL_RATE, chat_rate=OUT_CHAT_RATE)
+metrics = Metrics()
+dp.update.outer_middleware(HandlerMetrics(metrics))
+bot.session.middleware(ApiMetrics(metrics))
+metrics.gauge("botnew_memory_entries", "section", lambda: memory.sizes())  # memory бенчи подменяют
+profiler = SamplingProfiler(PROFILE_DIR, rate=PROFILE_RATE, interval=PROFILE_INTERVAL_MS / 1000,
+                            flush_every=PROFILE_FLUSH_S)
+for observer in (dp.message, dp.callback_query, dp.inline_query):
+    observer.middleware(ProfileMiddleware(profiler))
+loopmon = LoopMonitor(tick=LOOP_TICK_MS / 1000, threshold=SLOW_CALLBACK_MS / 1000, log_every=LOOP_LOG_S)
+metrics.histogram("botnew_loop_lag_seconds", "Event loop scheduling delay.", (), lambda: {(): loopmon.lag})
+metrics.counter("botnew_loop_slow_callbacks_total", "Times the loop was held longer than SLOW_CALLBACK_MS.",
+                ("handler",), lambda: loopmon.slow_by_handler)
+metrics.counter("botnew_outbox_notices_total", "Counterparty notices by outcome.",
+                ("result",), lambda: memory.outbox.stats())
+metrics.counter("botnew_api_calls_total", "Bot API calls by final outcome, retries included; shed = dropped by the circuit breaker.",
+                ("method", "result"), lambda: api_session.calls)
+metrics.counter("botnew_api_retries_total", "Bot API attempts repeated after a transient error.",
+                ("method", "reason"), lambda: api_session.retries)
+metrics.histogram("botnew_api_attempt_seconds", "Single Bot API attempt latency.",
+                  ("method",), lambda: api_session.attempt_ms)
+metrics.gauge("botnew_api_circuit", "state", api_session.circuit)
+metrics.counter("botnew_fsm_lookups_total", "FSM storage cache hits, store misses and expired keys.",
+                ("event",), lambda: fsm.stats())
+panels = PanelCoalescer(apply_panel, PANEL_COALESCE_MS / 1000)
 
-async def clear_warn_if_any(uid: int, cid: int):
-    wid = pop_warning(uid)
-    if wid:
+# ---------- EXPIRY WORKER ----------
+async def on_deadline(deal_id: str, kind: str):
+    async with memory.deal_locks(deal_id):
+        d = memory.deals.get(deal_id)
+        event = "expire" if kind == "expires_at" else "pay_timeout"
+        if not d or not can_transition(d.status, event):
+            return  # сделку уже двинули дальше вручную
+        was = d.status
         try:
-            await bot.delete_message(cid, wid)
-        except Exception:
-            pass
+            await memory.transition(d, event)
+        except TransitionError:
+            return  # другой инстанс (redis://) успел первым
+        if event == "expire":
+            memory.notify(d.creator_id, t(d.lang, "deal_expired"))
+            if was != Status.NEW:
+                # продавец уже в сделке: предупредить и его, сделку — в историю
+                memory.notify(d.seller_id, t(get_lang(d.seller_id), "deal_expired"))
+                memory.archive_deal(d)
+            memory.drop_deal(deal_id)
+        else:
+            # покупатель не отметил оплату за 15 минут — отменяем и предупреждаем обоих
+            for uid in (d.creator_id, d.seller_id):
+                memory.notify(uid, tf(get_lang(uid), "payment_timeout", title=d.title))
+            memory.archive_deal(d)
+            memory.drop_deal(deal_id)
+
+async def on_timer(key, kind: str):
+    if kind == "wip":
+        memory.drop_wip(key)  # черновик бросили: key — user_id
+    else:
+        await on_deadline(key, kind)
 
-# ---------- EXPIRY WORKER ----------
 async def expiry_worker():
+    # спит ровно до ближайшего дедлайна, без опроса всех сделок
+    await memory.deadlines.run(on_timer)
+
+# ---------- OUTBOX WORKER ----------
+async def deliver_notice(n: Notice) -> None:
+    markup = InlineKeyboardMarkup.model_validate(n.markup) if n.markup else None
+    if n.panel:
+        await show_panel(n.chat_id, n.text, reply_markup=markup, lane=NOTIFY)
+        return
+    msg = await send(n.chat_id, n.text, NOTIFY, reply_markup=markup)
+    memory.all_msgs.setdefault(n.chat_id, []).append((n.chat_id, msg.message_id))
+
+async def outbox_worker():
+    # сеть второй стороны — здесь, а не в хендлере, который сделал переход
+    await memory.outbox.run(deliver_notice, lambda nid: memory.touch("outbox", nid))
+
+# ---------- STORE FLUSHER ----------
+async def store_flusher():
+    if not memory.store.persistent:
+        return
     while True:
-        await asyncio.sleep(5)
-        for deal_id, d in list(memory.deals.items()):
-            if d.get("status") in ("done", "stopped"):
+        await asyncio.sleep(STORE_FLUSH_MS / 1000)
+        try:
+            await memory.flush()
+            await fsm.flush()
+        except Exception:
+            logging.exception("store flush failed")
+
+# ---------- SHARED STORE ----------
+# STORE_PATH=redis://: несколько инстансов с одним токеном, апдейты любого
+# пользователя могут прийти на любой. Изменения апдейта пишутся в store сразу
+# по его окончании, чужие приходят инвалидациями (redisstore.py) и
+# перечитываются в Memory и кэш FSM — хендлеры по-прежнему читают из памяти.
+store_changes: asyncio.Queue = asyncio.Queue()   # (section, key) от других инстансов
+store_synced: Dict[str, int] = defaultdict(int)  # section -> перечитано ключей
+
+class FlushAfterUpdate(BaseMiddleware):
+    async def __call__(self, handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: Dict[str, Any]) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            try:
+                await memory.flush()
+                await fsm.flush()
+            except Exception:
+                logging.exception("store flush failed")
+
+if memory.store.shared:
+    dp.update.outer_middleware(FlushAfterUpdate())
+    metrics.counter("botnew_store_synced_total", "Keys re-read after another instance changed them; "
+                    "lost_write — our write lost to a newer one.", ("section",),
+                    lambda: {**store_synced, "lost_write": memory.store.conflicts})
+
+def listen_store() -> None:
+    loop = asyncio.get_running_loop()
+    memory.store.listen(lambda section, key: loop.call_soon_threadsafe(store_changes.put_nowait, (section, key)))
+
+async def store_sync():
+    while True:
+        batch = {await store_changes.get()}
+        while not store_changes.empty():
+            batch.add(store_changes.get_nowait())
+        if ("*", "") in batch:
+            # канал рвался: сверяем общие секции целиком
+            sections = [s for s in Memory.PERSISTENT if s not in memory.store.local]
+            fresh = await asyncio.to_thread(lambda: {s: dict(memory.store.load(s)) for s in sections})
+            memory.resync(fresh)
+            for k in list(fsm.cache):
+                fsm.forget(k)
+            store_synced["*"] += 1
+            continue
+        keys = []
+        for section, key in batch:
+            store_synced[section] += 1
+            if section == "fsm":
+                if key in fsm.cache:
+                    keys.append((section, key))   # свежее значение — сразу в кэш FSM
+                else:
+                    fsm.forget(key)
+            elif section in Memory.PERSISTENT:
+                keys.append((section, key))
+        if keys:
+            try:
+                values = await asyncio.to_thread(memory.store.mget, keys)
+            except Exception:
+                logging.exception("store sync failed")
+                store_changes.put_nowait(("*", ""))
                 continue
-            if d.get("expires_at") and now() > d["expires_at"]:
-                try:
-                    msg = await bot.send_message(d["creator_id"], t(d.get("lang", "ru"), "deal_expired"))
-                    memory.all_msgs.setdefault(d["creator_id"], []).append((d["creator_id"], msg.message_id))
-                except Exception:
-                    pass
-                memory.deals.pop(deal_id, None)
+            for (section, key), value in zip(keys, values):
+                if section == "fsm":
+                    fsm.apply(key, value)
+                else:
+                    memory.apply(section, key, value)
 
 # ---------- START ----------
 @dp.message(CommandStart())
@@ -482,12 +764,12 @@ async def cmd_start(m: Message, state: FSMContext):
     if len(args) == 2 and args[1].startswith("deal_"):
         deal_id = args[1].split("_", 1)[1]
         d = memory.deals.get(deal_id)
-        if not d or now() > d["expires_at"]:
+        if not d or time.time() > d.expires_at:
             await show_panel(m.chat.id, t(lang, "deal_expired"), reply_markup=back_to_menu(lang))
             return
 
         # Если ссылку открыл создатель — подсказать и удалить именно текущий /start
-        if m.from_user.id == d.get("creator_id"):
+        if m.from_user.id == d.creator_id:
             await show_panel(m.chat.id, t(lang, "creator_open_link"), reply_markup=back_to_menu(lang))
             try:
                 await bot.delete_message(m.chat.id, m.message_id)  # удалить повторный /start
@@ -497,20 +779,18 @@ async def cmd_start(m: Message, state: FSMContext):
             return
 
         # Если уже назначен продавец и это он — показать ему карточку управления
-        if d.get("seller_id") and m.from_user.id == d["seller_id"]:
-            price_label = d.get("exchange_desc") or (f"{d['price_value']} {d['method']}" if d.get("price_value") is not None else d.get("method"))
+        if d.seller_id and m.from_user.id == d.seller_id:
             await show_panel(
                 m.chat.id,
-                t(lang, "seller_details").format(title=d["title"], desc=d["desc"], price_label=price_label, target=d["target_user"]),
+                tf(lang, "seller_details", title=d.title, desc=d.desc, price_label=d.price_label, target=d.target_user),
                 reply_markup=seller_controls(lang, deal_id),
             )
             return
 
         # Приглашение новому продавцу
-        price_label = d.get("exchange_desc") or (f"{d['price_value']} {d['method']}" if d.get("price_value") is not None else d.get("method"))
         await state.update_data(deal_id=deal_id)
-        await show_panel(m.chat.id, t(lang, "seller_invite").format(
-            title=d["title"], desc=d["desc"], price_label=price_label
+        await show_panel(m.chat.id, tf(lang, "seller_invite",
+            title=d.title, desc=d.desc, price_label=d.price_label
         ), reply_markup=accept_decline_kb(lang, deal_id))
         await state.set_state(SellerOnboarding.waiting_accept)
         return
@@ -518,7 +798,7 @@ async def cmd_start(m: Message, state: FSMContext):
     await show_panel(
         m.chat.id,
         t(lang, "hello"),
-        reply_markup=main_menu(lang, has_active_deal(m.from_user.id), has_history(m.from_user.id), uid=m.from_user.id),
+        reply_markup=main_menu(lang, has_active_deal(m.from_user.id), has_history(m.from_user.id), is_admin(m.from_user.id)),
     )
 
 # ---------- /admin ----------
@@ -537,36 +817,42 @@ async def cb_admin_panel(c: CallbackQuery, state: FSMContext):
     await state.clear()
     await show_panel(c.message.chat.id, t("ru","admin_title"), reply_markup=admin_panel_kb()); await c.answer()
 
-@dp.callback_query(F.data=="admin_recent")
+ADMIN_PAGE = 20  # сделок на странице «Последние сделки»
+
+@dp.callback_query(F.data.startswith("admin_recent"))
 async def admin_recent(c: CallbackQuery, state: FSMContext):
     if not is_admin(c.from_user.id):
         await c.answer(t("ru","not_admin"), show_alert=True); return
-    items = list(memory.deals.values()) + [d for hs in memory.history.values() for d in hs]
-    items = sorted(items, key=lambda x: x.get("created_at", now()), reverse=True)[:20]
+    # admin_recent | admin_recent:older:<seq> | admin_recent:newer:<seq>
+    parts = c.data.split(":")
+    cursor = int(parts[2]) if len(parts) == 3 else None
+    if len(parts) == 3 and parts[1] == "newer":
+        items, older, newer = memory.timeline.page(ADMIN_PAGE, after=cursor)
+    else:
+        items, older, newer = memory.timeline.page(ADMIN_PAGE, before=cursor)
     if not items:
-        text = "📊 <b>Последние сделки</b>\nНет данных."
+        text = t("ru", "admin_recent_title") + "\n" + t("ru", "admin_recent_empty")
     else:
         rows = []
         for d in items:
-            cid = d.get("creator_id")
-            sid = d.get("seller_id")
+            cid = d.creator_id
+            sid = d.seller_id
             cuser = memory.usernames.get(cid, f"id{cid}") if cid else "-"
             suser = memory.usernames.get(sid, f"id{sid}") if sid else "-"
-            price_label = d.get("exchange_desc") or (f"{d.get('price_value','-')} {d.get('method','')}" if d.get("price_value") is not None else d.get("method"))
             rows.append(
-                f"<b>#{d.get('id')}</b> — {d.get('status','-')} — {price_label}\n"
-                f"🏷 {d.get('title','-')}\n"
+                f"<b>#{d.id}</b> — {d.status} — {d.price_label}\n"
+                f"🏷 {d.title or '-'}\n"
                 f"👤 buyer: {cuser} • seller: {suser}\n"
             )
-        text = "📊 <b>Последние сделки</b>\n\n" + "\n".join(rows)
-    await show_panel(c.message.chat.id, text, reply_markup=admin_back_only_kb()); await c.answer()
+        text = t("ru", "admin_recent_title") + "\n\n" + "\n".join(rows)
+    await show_panel(c.message.chat.id, text, reply_markup=admin_recent_kb(older, newer)); await c.answer()
 
 @dp.callback_query(F.data=="admin_chatlog")
 async def admin_chatlog(c: CallbackQuery, state: FSMContext):
     if not is_admin(c.from_user.id):
         await c.answer(t("ru","not_admin"), show_alert=True); return
     await state.set_state(AdminFlow.waiting_user_for_log)
-    await show_panel(c.message.chat.id, "🕓 <b>История чата</b>\n" + t("ru","admin_enter_user"), reply_markup=admin_back_only_kb()); await c.answer()
+    await show_panel(c.message.chat.id, t("ru","admin_chatlog_title") + "\n" + t("ru","admin_enter_user"), reply_markup=admin_back_only_kb()); await c.answer()
 
 @dp.message(AdminFlow.waiting_user_for_log)
 async def admin_get_log(m: Message, state: FSMContext):
@@ -578,39 +864,31 @@ async def admin_get_log(m: Message, state: FSMContext):
         return
 
     query = (m.text or "").strip()
-    uid = None
-    if query.startswith("@"):
-        for _uid, uname in memory.usernames.items():
-            if uname.lower() == query.lower():
-                uid = _uid; break
-    else:
-        try: uid = int(query)
-        except: uid = None
+    uid = resolve_user(query)
 
     if not uid:
-        await m.reply("Не нашёл пользователя. Введите @username или ID ещё раз.")
+        await m.reply(not_found_text(query))
         try: await bot.delete_message(m.chat.id, to_delete)
         except Exception: pass
         return
 
-    logs = memory.chatlog.get(uid, [])
+    logs = memory.chatlog.tail(uid, 50)
     if not logs:
-        await show_panel(m.chat.id, "🕓 <b>История чата</b>\n" + t("ru","admin_no_log"), reply_markup=admin_back_only_kb())
+        await show_panel(m.chat.id, t("ru","admin_chatlog_title") + "\n" + t("ru","admin_no_log"), reply_markup=admin_back_only_kb())
         await state.clear()
         try: await bot.delete_message(m.chat.id, to_delete)
         except Exception: pass
         return
 
-    logs = logs[-50:]
     lines = []
     for ts, who, text in logs:
-        ts_local = ts.astimezone().strftime("%d.%m %H:%М:%S")
+        ts_local = datetime.fromtimestamp(ts).strftime("%d.%m %H:%M:%S")
         prefix = "👤" if who == "user" else "🤖"
         text = (text or "").strip()
         if len(text) > 500:
             text = text[:500] + "…"
         lines.append(f"{ts_local} {prefix} {text}")
-    out = "🕓 <b>История чата</b>\n\n" + "\n".join(lines)
+    out = t("ru", "admin_chatlog_title") + "\n\n" + "\n".join(lines)
     await show_panel(m.chat.id, out, reply_markup=admin_back_only_kb())
     await state.clear()
     try: await bot.delete_message(m.chat.id, to_delete)
@@ -621,7 +899,7 @@ async def admin_purge(c: CallbackQuery, state: FSMContext):
     if not is_admin(c.from_user.id):
         await c.answer(t("ru","not_admin"), show_alert=True); return
     await state.set_state(AdminFlow.waiting_user_for_purge)
-    await show_panel(c.message.chat.id, "🧹 <b>Удаление сообщений</b>\n" + t("ru","admin_enter_user"), reply_markup=admin_back_only_kb()); await c.answer()
+    await show_panel(c.message.chat.id, t("ru","admin_purge_title") + "\n" + t("ru","admin_enter_user"), reply_markup=admin_back_only_kb()); await c.answer()
 
 @dp.message(AdminFlow.waiting_user_for_purge)
 async def admin_do_purge(m: Message, state: FSMContext):
@@ -633,16 +911,9 @@ async def admin_do_purge(m: Message, state: FSMContext):
         return
 
     query = (m.text or "").strip()
-    uid = None
-    if query.startswith("@"):
-        for _uid, uname in memory.usernames.items():
-            if uname.lower() == query.lower():
-                uid = _uid; break
-    else:
-        try: uid = int(query)
-        except: uid = None
+    uid = resolve_user(query)
     if not uid:
-        await m.reply("Не нашёл пользователя. Введите @username или ID ещё раз.")
+        await m.reply(not_found_text(query))
         try: await bot.delete_message(m.chat.id, to_delete)
         except Exception: pass
         return
@@ -662,14 +933,30 @@ async def admin_do_purge(m: Message, state: FSMContext):
             await bot.delete_message(uid, pid)
             removed += 1
             memory.panel_id.pop(uid, None)
+            memory.touch("panel_id", uid)
+            memory.panel_digest.pop(uid, None)
     except Exception:
         pass
 
-    await show_panel(m.chat.id, f"🧹 Удалено сообщений: <b>{removed}</b>\n\n" + t("ru","admin_purged"), reply_markup=admin_back_only_kb())
+    await show_panel(m.chat.id, tf("ru", "admin_purged_count", removed=removed) + "\n\n" + t("ru","admin_purged"), reply_markup=admin_back_only_kb())
     await state.clear()
     try: await bot.delete_message(m.chat.id, to_delete)
     except Exception: pass
 
+@dp.callback_query(F.data.in_(["admin_profile", "admin_profile:on", "admin_profile:off"]))
+async def admin_profile(c: CallbackQuery, state: FSMContext):
+    if not is_admin(c.from_user.id):
+        await c.answer(t("ru","not_admin"), show_alert=True); return
+    if c.data == "admin_profile:on":
+        profiler.start()
+    elif c.data == "admin_profile:off":
+        await asyncio.to_thread(profiler.stop)  # stop() ждёт последний сброс файлов
+    st = profiler.stats()
+    text = tf("ru", "admin_profile", state="ON" if st["enabled"] else "OFF", rate=st["rate"],
+              interval_ms=f"{st['interval_ms']:g}", profiled=st["profiled"], samples=st["samples"],
+              out_dir=st["out_dir"])
+    await show_panel(c.message.chat.id, text, reply_markup=admin_profile_kb(st["enabled"])); await c.answer()
+
 @dp.callback_query(F.data.in_(["admin_back","admin_back_menu"]))
 async def admin_back(c: CallbackQuery, state: FSMContext):
     if not is_admin(c.from_user.id):
@@ -679,7 +966,7 @@ async def admin_back(c: CallbackQuery, state: FSMContext):
         await show_panel(
             c.message.chat.id,
             t(lang, "hello"),
-            reply_markup=main_menu(lang, has_active_deal(c.from_user.id), has_history(c.from_user.id), uid=c.from_user.id),
+            reply_markup=main_menu(lang, has_active_deal(c.from_user.id), has_history(c.from_user.id), is_admin(c.from_user.id)),
         )
     else:
         await show_panel(c.message.chat.id, t("ru","admin_title"), reply_markup=admin_panel_kb())
@@ -701,7 +988,7 @@ async def wallet_set(m: Message, state: FSMContext):
     txt = (m.text or "").strip()
     if is_ton_address(txt):
         set_wallet(m.from_user.id, txt)
-        await show_panel(m.chat.id, t(lang, "wallet_saved").format(addr=txt), reply_markup=back_to_menu(lang))
+        await show_panel(m.chat.id, tf(lang, "wallet_saved", addr=txt), reply_markup=back_to_menu(lang))
     else:
         warn = await m.answer(t(lang, "wallet_invalid"))
         set_warning(m.from_user.id, warn.message_id)
@@ -710,7 +997,7 @@ def settings_text(uid: int) -> str:
     lang = get_lang(uid)
     lang_name = LANG_NAME.get(lang, lang)
     method = get_pay_method(uid)
-    return t(lang, "settings_prompt").format(lang_name=lang_name, pay_method=method)
+    return tf(lang, "settings_prompt", lang_name=lang_name, pay_method=method)
 
 @dp.callback_query(F.data == "settings")
 async def cb_settings(c: CallbackQuery):
@@ -734,13 +1021,24 @@ async def cb_set_pay(c: CallbackQuery):
     set_pay_method(uid, method)  # RUB/USD/KZT/STARS/TON/EXCHANGE
     lang = get_lang(uid)
     await show_panel(c.message.chat.id, settings_text(uid), reply_markup=settings_kb(lang))
-    await c.answer("Метод оплаты обновлён")
+    await c.answer(t(lang, "pay_method_updated"))
 
 # ---------- CREATE FLOW ----------
+def new_deal_id() -> str:
+    # serve.py шлёт ссылку и кнопки сделки на shard_of(id): подбираем id под свой шард
+    while True:
+        deal_id = secrets.token_urlsafe(8)
+        if shard_of(deal_id, SHARD_COUNT) == SHARD_INDEX:
+            return deal_id
+
 def wip(uid: int) -> dict:
     # price_value: float|None (для всех кроме EXCHANGE)
     # exchange_desc: str|None (для EXCHANGE)
-    return memory.wip.setdefault(uid, {"step": 1, "title": "", "desc": "", "price_value": None, "exchange_desc": None, "username": ""})
+    draft = memory.wip.get(uid)
+    if draft is None:
+        draft = memory.wip[uid] = {"step": 1, "title": "", "desc": "", "price_value": None, "exchange_desc": None, "username": ""}
+        memory.touch_wip(uid)  # черновик откуда угодно (хоть со старой кнопки) — сразу со сроком жизни
+    return draft
 
 def prompt_for_step(uid: int, draft: dict) -> str:
     lang = get_lang(uid)
@@ -754,20 +1052,20 @@ def prompt_for_step(uid: int, draft: dict) -> str:
         if method == "EXCHANGE":
             return t(lang, "ask_price_ex")
         else:
-            return t(lang, "ask_price_std").format(method=method)
+            return tf(lang, "ask_price_std", method=method)
     if s == 4:
         return t(lang, "ask_user")
     return "..."
 
-def final_text(uid: int, snap: dict) -> str:
+def final_text(uid: int, d: Deal) -> str:
     lang = get_lang(uid)
-    if snap.get("exchange_desc"):
-        return t(lang, "final_ex").format(
-            title=snap["title"], desc=snap["desc"], exchange_desc=snap["exchange_desc"], target=snap["target_user"], link=snap["deep_link"]
+    if d.exchange_desc:
+        return tf(lang, "final_ex",
+            title=d.title, desc=d.desc, exchange_desc=d.exchange_desc, target=d.target_user, link=d.deep_link
         )
     else:
-        return t(lang, "final_std").format(
-            title=snap["title"], desc=snap["desc"], price_value=snap["price_value"], method=snap["method"], target=snap["target_user"], link=snap["deep_link"]
+        return tf(lang, "final_std",
+            title=d.title, desc=d.desc, price_value=d.price_value, method=d.method, target=d.target_user, link=d.deep_link
         )
 
 @dp.callback_query(F.data == "create")
@@ -778,6 +1076,7 @@ async def cb_create(c: CallbackQuery, state: FSMContext):
     memory.user_msgs[c.message.chat.id] = []
     draft = wip(uid)
     draft.update({"step": 1, "title": "", "desc": "", "price_value": None, "exchange_desc": None, "username": ""})
+    memory.touch_wip(uid)
     await state.set_state(CreateDeal.entering)
     await show_panel(c.message.chat.id, prompt_for_step(uid, draft), reply_markup=create_nav_prev_only(lang, draft["step"]))
     await c.answer()
@@ -789,6 +1088,7 @@ async def cb_prev(c: CallbackQuery, state: FSMContext):
     draft = wip(uid)
     if draft["step"] > 1:
         draft["step"] -= 1
+        memory.touch_wip(uid)
     await show_panel(c.message.chat.id, prompt_for_step(uid, draft), reply_markup=create_nav_prev_only(lang, draft["step"]))
     await c.answer()
 
@@ -796,12 +1096,12 @@ async def cb_prev(c: CallbackQuery, state: FSMContext):
 async def cb_cancel(c: CallbackQuery, state: FSMContext):
     uid = c.from_user.id
     lang = get_lang(uid)
-    memory.wip[uid] = {"step": 1, "title": "", "desc": "", "price_value": None, "exchange_desc": None, "username": ""}
+    memory.drop_wip(uid)
     await clear_flow_messages(c.message.chat.id)
     await show_panel(
         c.message.chat.id,
         t(lang, "hello"),
-        reply_markup=main_menu(lang, has_active_deal(uid), has_history(uid), uid=uid),
+        reply_markup=main_menu(lang, has_active_deal(uid), has_history(uid), is_admin(uid)),
     )
     await state.clear()
     await c.answer()
@@ -815,6 +1115,7 @@ async def create_input(m: Message, state: FSMContext):
     draft = wip(uid)
     await add_user_msg(m)
     text = (m.text or "").strip()
+    memory.touch_wip(uid)
 
     if draft["step"] == 1:
         draft["title"] = text
@@ -844,34 +1145,31 @@ async def create_input(m: Message, state: FSMContext):
             return
         draft["username"] = text
 
-        deal_id = secrets.token_urlsafe(8)
+        deal_id = new_deal_id()
         url = f"https://t.me/{BOT_USERNAME}?start=deal_{deal_id}"
-        snapshot = {
-            "id": deal_id,
-            "creator_id": uid,
-            "creator_username": memory.usernames.get(uid, f"id{uid}"),
-            "title": draft["title"],
-            "desc": draft["desc"],
-            "price_value": draft["price_value"],   # float или None
-            "exchange_desc": draft["exchange_desc"],  # str или None
-            "method": method,                      # RUB/USD/KZT/STARS/TON/EXCHANGE
-            "target_user": draft["username"],
-            "lang": lang,
-            "status": "new",
-            "created_at": now(),
-            "expires_at": now() + timedelta(minutes=30),
-            "seller_id": None,
-            "seller_deadline": None,
-            "deep_link": url,
-            "seller_payto": None,  # универсальные реквизиты продавца (адрес/карта/@user и т.д.)
-            "memo": None,
-        }
-        memory.deals[deal_id] = snapshot
+        created = int(time.time())
+        deal = Deal(
+            id=deal_id,
+            creator_id=uid,
+            creator_username=memory.usernames.get(uid, f"id{uid}"),
+            title=draft["title"],
+            desc=draft["desc"],
+            price_value=draft["price_value"],
+            exchange_desc=draft["exchange_desc"],
+            method=method,
+            target_user=draft["username"],
+            lang=lang,
+            created_at=created,
+            expires_at=created + 30 * 60,
+            deep_link=url,
+        )
+        memory.put_deal(deal)
+        memory.inline_results[deal_id] = inline_results(deal)
 
         await clear_flow_messages(m.chat.id)
-        await show_panel(m.chat.id, final_text(uid, snapshot), reply_markup=final_actions(lang, deal_id))
+        await show_panel(m.chat.id, final_text(uid, deal), reply_markup=final_actions(lang, deal_id))
 
-        memory.wip[uid] = {"step": 1, "title": "", "desc": "", "price_value": None, "exchange_desc": None, "username": ""}
+        memory.drop_wip(uid)
         await state.clear()
         return
 
@@ -883,38 +1181,41 @@ async def seller_invite_actions(c: CallbackQuery, state: FSMContext):
     lang = get_lang(c.from_user.id)
     parts = c.data.split(":")
     _, deal_id, action = parts
-    d = memory.deals.get(deal_id)
-    if not d:
-        await show_panel(c.message.chat.id, t(lang, "deal_expired"), reply_markup=back_to_menu(lang))
-        await c.answer(); return
-
-    if action == "decline":
-        d["status"] = "stopped"
-        await show_panel(c.message.chat.id, t(lang, "seller_declined"), reply_markup=back_to_menu(lang))
-        try:
-            msg = await bot.send_message(d["creator_id"], f"❌ Продавец отклонил ордер <b>{d['title']}</b>.")
-            memory.all_msgs.setdefault(d["creator_id"], []).append((d["creator_id"], msg.message_id))
-        except Exception:
-            pass
-        memory.history.setdefault(d["creator_id"], []).insert(0, d.copy())
-        memory.deals.pop(deal_id, None)
-        await state.clear(); await c.answer(); return
-
-    # accept_invite → спросим реквизиты в зависимости от метода
-    method = d.get("method", "TON")
-    await state.update_data(deal_id=deal_id)
-    if method == "TON":
-        prompt = t(lang, "ask_requisite_ton")
-    elif method == "STARS":
-        prompt = t(lang, "ask_requisite_stars")
-    elif method in ("RUB", "USD", "KZT"):
-        prompt = t(lang, "ask_requisite_fiat").format(method=method)
-    else:  # EXCHANGE и прочие
-        prompt = t(lang, "ask_requisite_exchange")
-
-    await show_panel(c.message.chat.id, prompt, reply_markup=back_to_menu(lang))
-    await state.set_state(SellerOnboarding.waiting_requisite)
-    await c.answer()
+    async with memory.deal_locks(deal_id):
+        d = memory.deals.get(deal_id)
+        if not d:
+            await show_panel(c.message.chat.id, t(lang, "deal_expired"), reply_markup=back_to_menu(lang))
+            await c.answer(); return
+        if d.status != Status.NEW:
+            # сделка уже ушла дальше: приглашение устарело
+            await c.answer(t(lang, "deal_changed"), show_alert=True); return
+
+        if action == "decline":
+            try:
+                await memory.transition(d, "decline")
+            except TransitionError:
+                await c.answer(t(lang, "deal_changed"), show_alert=True); return
+            memory.notify(d.creator_id, tf(get_lang(d.creator_id), "buyer_seller_declined", title=d.title))
+            memory.archive_deal(d)
+            memory.drop_deal(deal_id)
+            await show_panel(c.message.chat.id, t(lang, "seller_declined"), reply_markup=back_to_menu(lang))
+            await state.clear(); await c.answer(); return
+
+        # accept_invite → спросим реквизиты в зависимости от метода
+        method = d.method
+        await state.update_data(deal_id=deal_id)
+        if method == "TON":
+            prompt = t(lang, "ask_requisite_ton")
+        elif method == "STARS":
+            prompt = t(lang, "ask_requisite_stars")
+        elif method in ("RUB", "USD", "KZT"):
+            prompt = tf(lang, "ask_requisite_fiat", method=method)
+        else:  # EXCHANGE и прочие
+            prompt = t(lang, "ask_requisite_exchange")
+
+        await show_panel(c.message.chat.id, prompt, reply_markup=back_to_menu(lang))
+        await state.set_state(SellerOnboarding.waiting_requisite)
+        await c.answer()
 
 @dp.message(SellerOnboarding.waiting_requisite)
 async def seller_requisite(m: Message, state: FSMContext):
@@ -923,49 +1224,56 @@ async def seller_requisite(m: Message, state: FSMContext):
     await add_user_msg(m)
     data = await state.get_data()
     deal_id = data.get("deal_id")
-    d = memory.deals.get(deal_id)
-    if not d:
+    if not deal_id:
         await show_panel(m.chat.id, t(lang, "deal_expired"), reply_markup=back_to_menu(lang))
         await state.clear(); return
+    async with memory.deal_locks(deal_id):
+        d = memory.deals.get(deal_id)
+        if not d:
+            await show_panel(m.chat.id, t(lang, "deal_expired"), reply_markup=back_to_menu(lang))
+            await state.clear(); return
+        if d.status != Status.NEW or d.seller_id not in (None, m.from_user.id):
+            # реквизиты меняем только до подтверждения и только своему продавцу
+            await show_panel(m.chat.id, t(lang, "deal_changed"), reply_markup=back_to_menu(lang))
+            await state.clear(); return
+
+        method = d.method
+        txt = (m.text or "").strip()
+
+        def is_card(s: str) -> bool:
+            digits = "".join(ch for ch in s if ch.isdigit())
+            return len(digits) >= 8
+
+        if method == "TON":
+            if not is_ton_address(txt):
+                warn = await m.answer(t(lang, "wallet_invalid")); set_warning(m.from_user.id, warn.message_id); return
+        elif method == "STARS":
+            if not (txt.startswith("@") and len(txt) > 1):
+                warn = await m.answer(t(lang, "bad_user")); set_warning(m.from_user.id, warn.message_id); return
+        elif method in ("RUB", "USD", "KZT"):
+            if not is_card(txt):
+                warn = await m.answer(t(lang, "bad_card")); set_warning(m.from_user.id, warn.message_id); return
+        else:
+            if not txt:
+                warn = await m.answer(t(lang, "bad_card")); set_warning(m.from_user.id, warn.message_id); return
 
-    method = d.get("method", "TON")
-    txt = (m.text or "").strip()
-
-    def is_card(s: str) -> bool:
-        digits = "".join(ch for ch in s if ch.isdigit())
-        return len(digits) >= 8
-
-    if method == "TON":
-        if not is_ton_address(txt):
-            warn = await m.answer(t(lang, "wallet_invalid")); set_warning(m.from_user.id, warn.message_id); return
-    elif method == "STARS":
-        if not (txt.startswith("@") and len(txt) > 1):
-            warn = await m.answer(t(lang, "bad_user")); set_warning(m.from_user.id, warn.message_id); return
-    elif method in ("RUB", "USD", "KZT"):
-        if not is_card(txt):
-            warn = await m.answer(t(lang, "bad_card")); set_warning(m.from_user.id, warn.message_id); return
-    else:
-        if not txt:
-            warn = await m.answer(t(lang, "bad_card")); set_warning(m.from_user.id, warn.message_id); return
-
-    d["seller_id"] = m.from_user.id
-    d["seller_username"] = memory.usernames.get(m.from_user.id, f"id{m.from_user.id}")
-    d["seller_payto"] = txt
-    memory.deals[deal_id] = d
+        memory.set_deal_seller(d, m.from_user.id)
+        d.seller_username = memory.usernames.get(m.from_user.id, f"id{m.from_user.id}")
+        d.seller_payto = txt
+        memory.update_deal(d)
 
-    try:
-        await bot.delete_message(m.chat.id, m.message_id)
-    except Exception:
-        pass
-    await clear_flow_messages(m.chat.id)
+        try:
+            await bot.delete_message(m.chat.id, m.message_id)
+        except Exception:
+            pass
+        await clear_flow_messages(m.chat.id)
 
-    price_label = d.get("exchange_desc") or (f"{d['price_value']} {d['method']}" if d.get("price_value") is not None else d.get("method"))
-    await show_panel(
-        m.chat.id,
-        t(lang, "seller_details").format(title=d["title"], desc=d["desc"], price_label=price_label, target=d["target_user"]),
-        reply_markup=seller_controls(lang, deal_id),
-    )
-    await state.clear()
+        await show_panel(
+            m.chat.id,
+            tf(lang, "seller_details", title=d.title, desc=d.desc, price_label=d.price_label, target=d.target_user),
+            reply_markup=seller_controls(lang, deal_id),
+        )
+        await state.clear()
 
 # ---------- SELLER/BUYER ACTIONS ----------
 @dp.callback_query(F.data.startswith("deal:"))
@@ -973,147 +1281,164 @@ async def seller_action(c: CallbackQuery):
     remember_username(c.from_user)
     parts = c.data.split(":")
     _, deal_id, action = parts
-    d = memory.deals.get(deal_id)
     lang = get_lang(c.from_user.id)
 
-    if not d:
-        await show_panel(c.message.chat.id, t(lang, "deal_expired"), reply_markup=back_to_menu(lang))
-        await c.answer()
+    if action == "confirm":
+        await seller_confirm(c, lang, deal_id)
         return
 
-    if action == "accept":
-        price_label = d.get("exchange_desc") or (f"{d['price_value']} {d['method']}" if d.get("price_value") is not None else d.get("method"))
-        await show_panel(
-            c.message.chat.id,
-            t(lang, "seller_details").format(title=d["title"], desc=d["desc"], price_label=price_label, target=d["target_user"]),
-            reply_markup=seller_controls(lang, deal_id),
-        )
-        await c.answer(); return
-
-    if action == "stop":
-        d["status"] = "stopped"
-        await show_panel(c.message.chat.id, t(lang, "seller_stopped"), reply_markup=back_to_menu(lang))
-        try:
-            msg = await bot.send_message(d["creator_id"], f"⛔️ Продавец остановил ордер <b>{d['title']}</b>.")
-            memory.all_msgs.setdefault(d["creator_id"], []).append((d["creator_id"], msg.message_id))
-        except Exception:
-            pass
-        memory.history.setdefault(d["creator_id"], []).insert(0, d.copy())
-        memory.deals.pop(deal_id, None)
-        await c.answer(); return
-
-    if action == "confirm":
-        if not d.get("seller_payto"):
-            await c.answer("Сначала укажите реквизиты.", show_alert=True); return
+    async with memory.deal_locks(deal_id):
+        d = memory.deals.get(deal_id)
+        if not d:
+            await show_panel(c.message.chat.id, t(lang, "deal_expired"), reply_markup=back_to_menu(lang))
+            await c.answer()
+            return
 
-        delay = random.randint(4, 7)
-        await show_panel(c.message.chat.id, "⏳ Обработка подтверждения...", reply_markup=None)
-        await asyncio.sleep(delay)
+        if action == "accept":
+            await show_panel(
+                c.message.chat.id,
+                tf(lang, "seller_details", title=d.title, desc=d.desc, price_label=d.price_label, target=d.target_user),
+                reply_markup=seller_controls(lang, deal_id),
+            )
+            await c.answer(); return
 
-        d["status"] = "await_payment"
-        d["seller_deadline"] = now() + timedelta(minutes=15)
+        if action == "stop":
+            try:
+                await memory.transition(d, "stop")
+            except TransitionError:
+                await c.answer(t(lang, "deal_changed"), show_alert=True); return
+            memory.notify(d.creator_id, tf(get_lang(d.creator_id), "buyer_seller_stopped", title=d.title))
+            memory.archive_deal(d)
+            memory.drop_deal(deal_id)
+            await show_panel(c.message.chat.id, t(lang, "seller_stopped"), reply_markup=back_to_menu(lang))
+            await c.answer(); return
+
+CONFIRM_DELAY = (4, 7)  # секунд «обработки» подтверждения
+
+async def seller_confirm(c: CallbackQuery, lang: str, deal_id: str):
+    # пауза «обработки» — вне замка, чтобы не держать остальные апдейты сделки;
+    # после неё переход применяется, только если сделку за это время не меняли
+    async with memory.deal_locks(deal_id):
+        d = memory.deals.get(deal_id)
+        if not d:
+            await show_panel(c.message.chat.id, t(lang, "deal_expired"), reply_markup=back_to_menu(lang))
+            await c.answer(); return
+        if not d.seller_payto:
+            await c.answer(t(lang, "seller_payto_first"), show_alert=True); return
+        if not can_transition(d.status, "confirm"):
+            await c.answer(t(lang, "deal_changed"), show_alert=True); return
+        version = d.version
+
+    await show_panel(c.message.chat.id, t(lang, "confirm_processing"), reply_markup=None)
+    await asyncio.sleep(random.uniform(*CONFIRM_DELAY))
+
+    async with memory.deal_locks(deal_id):
+        d = memory.deals.get(deal_id)
+        if not d or d.version != version:
+            # пока «обрабатывали», сделку остановили, она истекла или её подтвердили вторым нажатием
+            await show_panel(c.message.chat.id, t(lang, "deal_changed"), reply_markup=back_to_menu(lang))
+            await c.answer(); return
+        try:
+            await memory.transition(d, "confirm")
+        except TransitionError:
+            await show_panel(c.message.chat.id, t(lang, "deal_changed"), reply_markup=back_to_menu(lang))
+            await c.answer(); return
+        d.seller_deadline = int(time.time()) + 15 * 60
         memo = "MG-" + secrets.token_urlsafe(4).upper().replace("_", "").replace("-", "")
-        d["memo"] = memo
-        memory.deals[deal_id] = d
-
-        await show_panel(c.message.chat.id, t(lang, "seller_confirmed_wait"), reply_markup=back_to_menu(lang))
+        d.memo = memo
+        memory.update_deal(d)
 
-        buyer_lang = get_lang(d["creator_id"])
-        if d.get("exchange_desc"):
+        buyer_lang = get_lang(d.creator_id)
+        if d.exchange_desc:
             buyer_text = (
-                t(buyer_lang, "buyer_notif_confirmed").format(title=d["title"]) + "\n\n" +
-                t(buyer_lang, "buyer_pay_prompt_ex").format(
-                    title=d["title"], desc=d["desc"], exchange_desc=d["exchange_desc"],
-                    target=d["target_user"], seller_wallet=d.get("seller_payto","—"), memo=memo
+                tf(buyer_lang, "buyer_notif_confirmed", title=d.title) + "\n\n" +
+                tf(buyer_lang, "buyer_pay_prompt_ex",
+                    title=d.title, desc=d.desc, exchange_desc=d.exchange_desc,
+                    target=d.target_user, seller_wallet=d.seller_payto or "—", memo=memo
                 )
             )
         else:
             buyer_text = (
-                t(buyer_lang, "buyer_notif_confirmed").format(title=d["title"]) + "\n\n" +
-                t(buyer_lang, "buyer_pay_prompt_std").format(
-                    title=d["title"], desc=d["desc"], price_value=d["price_value"], method=d["method"],
-                    target=d["target_user"], seller_wallet=d.get("seller_payto","—"), memo=memo
+                tf(buyer_lang, "buyer_notif_confirmed", title=d.title) + "\n\n" +
+                tf(buyer_lang, "buyer_pay_prompt_std",
+                    title=d.title, desc=d.desc, price_value=d.price_value, method=d.method,
+                    target=d.target_user, seller_wallet=d.seller_payto or "—", memo=memo
                 )
             )
-        await show_panel(d["creator_id"], buyer_text, reply_markup=buyer_pay_kb(buyer_lang, deal_id))
-        await c.answer(); return
+        memory.notify(d.creator_id, buyer_text, buyer_pay_kb(buyer_lang, deal_id), panel=True)
+
+        await show_panel(c.message.chat.id, t(lang, "seller_confirmed_wait"), reply_markup=back_to_menu(lang))
+        await c.answer()
 
 @dp.callback_query(F.data.startswith("memo:"))
 async def copy_memo(c: CallbackQuery):
     deal_id = c.data.split(":", 1)[1]
     d = memory.deals.get(deal_id)
-    if not d or not d.get("memo"):
-        await c.answer("MEMO недоступен.", show_alert=True); return
-    await c.answer(f"MEMO: {d['memo']}", show_alert=True)
+    if not d or not d.memo:
+        await c.answer(t(get_lang(c.from_user.id), "memo_unavailable"), show_alert=True); return
+    await c.answer(f"MEMO: {d.memo}", show_alert=True)
 
 @dp.callback_query(F.data.startswith("paid:"))
 async def buyer_paid(c: CallbackQuery):
     deal_id = c.data.split(":", 1)[1]
-    d = memory.deals.get(deal_id)
-    lang = get_lang(c.from_user.id)
-    if not d:
-        await c.answer("Ордер недоступен.", show_alert=True); return
-    if c.from_user.id != d["creator_id"]:
-        await c.answer("Недоступно.", show_alert=True); return
-
-    d["status"] = "await_seller_final"
-    memory.deals[deal_id] = d
-
-    await show_panel(c.message.chat.id, t(lang, "buyer_wait_confirm"), reply_markup=back_to_menu(lang))
+    async with memory.deal_locks(deal_id):
+        d = memory.deals.get(deal_id)
+        lang = get_lang(c.from_user.id)
+        if not d:
+            await c.answer(t(lang, "deal_unavailable"), show_alert=True); return
+        if c.from_user.id != d.creator_id:
+            await c.answer(t(lang, "not_allowed"), show_alert=True); return
+        try:
+            await memory.transition(d, "paid")
+        except TransitionError:
+            await c.answer(t(lang, "deal_changed"), show_alert=True); return
+        seller_lang = get_lang(d.seller_id or c.from_user.id)
+        memory.notify(d.seller_id, t(seller_lang, "seller_final_needed"), seller_final_kb(seller_lang, deal_id), panel=True)
 
-    seller_lang = get_lang(d.get("seller_id") or c.from_user.id)
-    await show_panel(
-        d["seller_id"],
-        t(seller_lang, "seller_final_needed"),
-        reply_markup=seller_final_kb(seller_lang, deal_id)
-    )
-    await c.answer("Отмечено. Ожидаем подтверждения продавца.")
+        await show_panel(c.message.chat.id, t(lang, "buyer_wait_confirm"), reply_markup=back_to_menu(lang))
+        await c.answer(t(lang, "buyer_paid_ack"))
 
 @dp.callback_query(F.data.startswith("finish:"))
 async def seller_finish(c: CallbackQuery):
     deal_id = c.data.split(":", 1)[1]
-    d = memory.deals.get(deal_id)
-    lang = get_lang(c.from_user.id)
-    if not d:
-        await c.answer("Ордер недоступен.", show_alert=True); return
-    if c.from_user.id != d.get("seller_id"):
-        await c.answer("Недоступно.", show_alert=True); return
-
-    d["status"] = "done"
-    memory.history.setdefault(d["creator_id"], []).insert(0, d.copy())
-
-    await show_panel(c.message.chat.id, t(lang, "seller_final_done"), reply_markup=back_to_menu(lang))
-
-    buyer_lang = get_lang(d["creator_id"])
-    await show_panel(d["creator_id"], t(buyer_lang, "buyer_final_done").format(title=d["title"]), reply_markup=back_to_menu(buyer_lang))
+    async with memory.deal_locks(deal_id):
+        d = memory.deals.get(deal_id)
+        lang = get_lang(c.from_user.id)
+        if not d:
+            await c.answer(t(lang, "deal_unavailable"), show_alert=True); return
+        if c.from_user.id != d.seller_id:
+            await c.answer(t(lang, "not_allowed"), show_alert=True); return
+        try:
+            await memory.transition(d, "finish")
+        except TransitionError:
+            await c.answer(t(lang, "deal_changed"), show_alert=True); return
+        buyer_lang = get_lang(d.creator_id)
+        memory.notify(d.creator_id, tf(buyer_lang, "buyer_final_done", title=d.title), back_to_menu(buyer_lang), panel=True)
+        memory.archive_deal(d)
+        memory.drop_deal(deal_id)
 
-    memory.deals.pop(deal_id, None)
-    await c.answer("Готово.")
+        await show_panel(c.message.chat.id, t(lang, "seller_final_done"), reply_markup=back_to_menu(lang))
+        await c.answer(t(lang, "done"))
 
 # ---------- CURRENT / HISTORY ----------
 @dp.callback_query(F.data == "current")
 async def cb_current(c: CallbackQuery):
     lang = get_lang(c.from_user.id)
-    active = [
-        d for d in memory.deals.values()
-        if d.get("creator_id") == c.from_user.id
-        and d.get("status") in {"new", "await_payment", "await_seller_final"}
-        and now() < d.get("expires_at", now())
-    ]
+    active = memory.deals.active_for_creator(c.from_user.id, time.time())
     if not active:
         await show_panel(
             c.message.chat.id,
             t(lang, "hello"),
-            reply_markup=main_menu(lang, False, has_history(c.from_user.id), uid=c.from_user.id),
+            reply_markup=main_menu(lang, False, has_history(c.from_user.id), is_admin(c.from_user.id)),
         )
         await c.answer(); return
 
-    d = sorted(active, key=lambda x: x["created_at"], reverse=True)[0]
+    d = max(active, key=lambda x: x.created_at)
     txt = final_text(c.from_user.id, d)
     await show_panel(
         c.message.chat.id,
         t(lang, "current_title") + "\n\n" + txt,
-        reply_markup=final_actions(lang, d["id"]),
+        reply_markup=final_actions(lang, d.id),
     )
     await c.answer()
 
@@ -1127,14 +1452,8 @@ async def cb_history(c: CallbackQuery):
 
     lines = []
     for i, d in enumerate(items, 1):
-        when = d.get("created_at")
-        if when:
-            try: when = when.astimezone().strftime("%d.%m %H:%M")
-            except Exception: when = "-"
-        else:
-            when = "-"
-        price_label = d.get("exchange_desc") or (f"{d['price_value']} {d['method']}" if d.get("price_value") is not None else d.get("method"))
-        lines.append(f"{i}. <b>{d.get('title') or '[title]'}</b> — {price_label} — {d.get('status','done')} — {when}")
+        when = datetime.fromtimestamp(d.created_at).strftime("%d.%m %H:%M") if d.created_at else "-"
+        lines.append(f"{i}. <b>{d.title or '[title]'}</b> — {d.price_label} — {d.status} — {when}")
 
     await show_panel(c.message.chat.id, t(lang, "history_title") + "\n\n" + "\n".join(lines), reply_markup=back_to_menu(lang))
     await c.answer()
@@ -1143,35 +1462,43 @@ async def cb_history(c: CallbackQuery):
 @dp.callback_query(F.data == "menu")
 async def cb_menu(c: CallbackQuery):
     lang = get_lang(c.from_user.id)
-    await clear_warn_if_any(c.from_user.id, c.message.chat.id)
-    await clear_flow_messages(c.message.chat.id)
+    await clear_flow_messages(c.message.chat.id, warn_of=c.from_user.id)
     await show_panel(
         c.message.chat.id,
         t(lang, "hello"),
-        reply_markup=main_menu(lang, has_active_deal(c.from_user.id), has_history(c.from_user.id), uid=c.from_user.id),
+        reply_markup=main_menu(lang, has_active_deal(c.from_user.id), has_history(c.from_user.id), is_admin(c.from_user.id)),
     )
     await c.answer()
 
 # ---------- INLINE SHARE ----------
+NO_RESULTS: list = []  # общий пустой ответ; не мутировать
+
+def inline_results(d: Deal) -> list:
+    # собирается один раз на сделку (create_input) и живёт в memory.inline_results,
+    # пока у сделки не сменится статус или она не истечёт
+    text = tf(d.lang, "share_text", link=d.deep_link)
+    return [InlineQueryResultArticle(
+        id=d.id,
+        title=t(d.lang, "share_title"),
+        description=f"{d.price_label} • {d.target_user}",
+        input_message_content=InputTextMessageContent(message_text=text, parse_mode=ParseMode.HTML),
+    )]
+
 @dp.inline_query()
 async def inline_share(iq: InlineQuery):
     q = (iq.query or "").strip()
-    results = []
+    results = NO_RESULTS
     if q.startswith("deal_"):
         deal_id = q.split("_", 1)[1]
-        d = memory.deals.get(deal_id)
-        if d:
-            url = d["deep_link"]
-            text = f"{url}\n\nMoonGarant - ваш выбор в проведении сделок!"
-            results.append(
-                InlineQueryResultArticle(
-                    id=deal_id,
-                    title="MoonGarant • Ссылка на сделку",
-                    description=(d.get("exchange_desc") or f"{d.get('price_value')} {d.get('method')}") + f" • {d['target_user']}",
-                    input_message_content=InputTextMessageContent(message_text=text, parse_mode=ParseMode.HTML),
-                )
-            )
-    await iq.answer(results=results, cache_time=0, is_personal=True)
+        results = memory.inline_results.get(deal_id)
+        if results is None:
+            d = memory.deals.get(deal_id)
+            if d:
+                # после рестарта или смены статуса — пересобираем один раз
+                results = memory.inline_results[deal_id] = inline_results(d)
+            else:
+                results = NO_RESULTS
+    await iq.answer(results=results, cache_time=INLINE_CACHE_TIME, is_personal=True)
 
 # ---------- GUARD ----------
 @dp.message(F.chat.type == ChatType.PRIVATE)
@@ -1185,14 +1512,174 @@ async def guard_delete_noise(m: Message, state: FSMContext):
         except Exception:
             pass
     else:
-        memory.chatlog.setdefault(m.from_user.id, []).append((now(), "user", m.text or ""))
+        memory.log(m.from_user.id, "user", m.text or "")
+
+# ---------- SHARDS ----------
+# serve.py с BOT_WORKERS > 1: этот процесс — шард SHARD_INDEX. Здесь живут его
+# пользователи (shard_of(user_id)) и созданные здесь сделки. Продавец чужой
+# сделки приходит сюда гостем: настройки берём у его шарда, а пока у него здесь
+# открыт сценарий FSM (ввод реквизитов), serve.py шлёт сюда и его текст (pin).
+# Его панель рисует только домашний шард (show_panel -> guest_panel).
+shard_link: Optional[ShardLink] = None
+GUEST_FIELDS = ("lang", "pay_method", "wallet")
+
+def guest_profile(uid: int) -> dict:
+    # вызов от другого шарда: uid живёт здесь
+    prof = memory.users.get(uid, {})
+    return {k: prof[k] for k in GUEST_FIELDS if k in prof}
+
+async def guest_panel(chat_id: int, text: str, markup: Optional[dict], lane: int) -> None:
+    # вызов от шарда сделки: панель чата chat_id живёт здесь
+    await panels.render(chat_id, text, InlineKeyboardMarkup.model_validate(markup) if markup else None, lane)
+
+class GuestMiddleware(BaseMiddleware):
+    async def __call__(self, handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        home = shard_of(user.id, SHARD_COUNT) if user else SHARD_INDEX
+        if home == SHARD_INDEX or shard_link is None:
+            return await handler(event, data)
+        # pin — до хендлера: следующий текст гостя придёт после ответа, а ответ — после pin
+        shard_link.pin(user.id, FSM_TTL_S)
+        try:
+            profile = await shard_link.call(home, "profile", user.id, timeout=SHARD_GUEST_TIMEOUT)
+            memory.users.setdefault(user.id, {}).update(profile)
+        except Exception as e:
+            # шард гостя перезапускается — обойдёмся тем, что помним сами
+            logging.warning("guest %s: no profile from shard %d: %r", user.id, home, e)
+        try:
+            return await handler(event, data)
+        finally:
+            state = data.get("state")
+            if state is None or await state.get_state() is None:
+                shard_link.unpin(user.id)  # сценарий здесь не открыт — текст снова домой
+
+if SHARD_SOCKET:
+    dp.update.outer_middleware(GuestMiddleware())
+
+async def feed_shard(raw: bytes) -> None:
+    await dp.feed_update(bot, Update.model_validate_json(raw, context={"bot": bot}))
+
+def check_shard_store() -> None:
+    # пользователи и сделки шарда лежат в его store: при другом BOT_WORKERS
+    # их апдейты ушли бы в другие процессы
+    layout = memory.store.get("meta", "shards")
+    if layout is None:
+        memory.store.write([("meta", "shards", memory.store.encode([SHARD_INDEX, SHARD_COUNT]))])
+    elif list(layout) != [SHARD_INDEX, SHARD_COUNT]:
+        raise RuntimeError(f"{STORE_PATH} belongs to shard {layout[0]} of {layout[1]}, "
+                           f"not {SHARD_INDEX} of {SHARD_COUNT}")
+
+async def serve_shard() -> None:
+    global shard_link
+    shard_link = ShardLink(SHARD_SOCKET, SHARD_INDEX, feed_shard,
+                           {"profile": guest_profile, "panel": guest_panel, "stats": lambda: shard_link.stats()},
+                           concurrency=UPDATE_CONCURRENCY)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    link = asyncio.create_task(shard_link.run())
+    stopping = asyncio.create_task(stop.wait())
+    await asyncio.wait((link, stopping), return_when=asyncio.FIRST_COMPLETED)
+    stopping.cancel()
+    await shard_link.stop()  # соединение ещё читается: ответы на вызовы и хвост апдейтов
+    if link.done():
+        link.result()  # не подключились к serve.py — пусть перезапустит с паузой
+    link.cancel()
+
+# ---------- SNAPSHOT ----------
+# на чистом выходе Memory и FSM пишутся в SNAPSHOT_PATH, при старте читаются
+# и файл удаляется: после падения старый снимок не воскресит старые сделки
+def save_snapshot() -> None:
+    # на loop'е и после остановки фоновых задач: объекты не меняются, пока их пишем
+    sections = list(memory.snapshot()) + [("fsm", fsm.snapshot())]
+    t0 = time.perf_counter()
+    n = write_snapshot(SNAPSHOT_PATH, sections)
+    logging.info("snapshot: %d entries -> %s in %.2f s", n, SNAPSHOT_PATH, time.perf_counter() - t0)
+
+def snapshot_frames(path: str):
+    try:
+        for section, items in read_snapshot(path):
+            if section != "fsm":
+                yield section, items
+            else:
+                fsm.restore(items)
+    except Exception:
+        # битый хвост: остаётся то, что успели прочитать
+        logging.exception("snapshot %s is damaged", path)
+
+def load_memory() -> None:
+    if not SNAPSHOT_PATH or not os.path.exists(SNAPSHOT_PATH):
+        memory.load()
+        return
+    t0 = time.perf_counter()
+    memory.load(snapshot_frames(SNAPSHOT_PATH))
+    os.unlink(SNAPSHOT_PATH)
+    logging.info("snapshot: restored %d deals, %d users in %.2f s",
+                 len(memory.deals), len(memory.users), time.perf_counter() - t0)
 
 # ---------- MAIN ----------
-async def main():
+background: List[asyncio.Task] = []
+
+async def on_startup():
+    # общее для polling (main) и webhook (serve.py)
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN is empty. Put it into .env")
-    asyncio.create_task(expiry_worker())
-    await dp.start_polling(bot)
+    if SHARD_COUNT > 1:
+        check_shard_store()
+    if memory.store.shared:
+        listen_store()  # до загрузки: изменения других инстансов во время неё не пропадут
+    load_memory()  # до polling/вебхука: первые апдейты уже видят сделки
+    fsm.load()
+    loopmon.handlers = handler_codes(dp)  # все хендлеры уже зарегистрированы
+    background.append(asyncio.create_task(loopmon.run(), name="loop_monitor"))
+    background.append(asyncio.create_task(expiry_worker(), name="expiry_worker"))
+    background.append(asyncio.create_task(outbox_worker(), name="outbox_worker"))
+    background.append(asyncio.create_task(fsm.run(), name="fsm_expiry"))
+    background.append(asyncio.create_task(store_flusher(), name="store_flusher"))
+    if memory.store.shared:
+        background.append(asyncio.create_task(store_sync(), name="store_sync"))
+    if PROFILE_ON:
+        profiler.start()
+
+async def on_shutdown():
+    outbound.stop()
+    await asyncio.to_thread(profiler.stop)
+    for task in background:
+        task.cancel()
+    for task in background:
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    background.clear()
+    await memory.flush()
+    await fsm.flush()
+    if SNAPSHOT_PATH:
+        try:
+            save_snapshot()
+        except Exception:
+            logging.exception("snapshot failed")
+    memory.store.close()
+    memory.chatlog.close()
+
+def background_alive() -> bool:
+    # store_flusher без персистентного store завершается сразу — это норма
+    return all(not task.done() or (task.get_name() == "store_flusher" and not task.cancelled() and task.exception() is None)
+               for task in background)
+
+async def main():
+    await on_startup()
+    exporter = await serve_unix(METRICS_SOCKET, metrics.render) if METRICS_SOCKET else None
+    try:
+        if SHARD_SOCKET:
+            await serve_shard()  # getUpdates/вебхук — у serve.py
+        else:
+            await bot.delete_webhook(drop_pending_updates=False)  # getUpdates не работает при активном вебхуке
+            await dp.start_polling(bot, tasks_concurrency_limit=UPDATE_CONCURRENCY)
+    finally:
+        if exporter is not None:
+            exporter.close()
+        await on_shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
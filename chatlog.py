@@ -0,0 +1,178 @@
+# chatlog.py — журнал чата: короткое кольцо в памяти + сжатые сегменты на диске
+import os
+import struct
+import sys
+import time
+import zlib
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from storage import decode, encode
+
+Entry = Tuple[int, str, str]   # (epoch, who, text)
+
+# блок сегмента: заголовок + zlib(pickle(list[Entry])), все записи одного пользователя
+_HEADER = struct.Struct("<qIII")   # uid, count, len(payload), crc32(payload)
+_SEGMENT_NAME = "seg-%06d.log"
+
+
+def _entry(ts, who: str, text: str) -> Entry:
+    if isinstance(ts, datetime):
+        ts = int(ts.timestamp())
+    return int(ts), sys.intern(who), text
+
+
+class ChatLog:
+    """Последние ring записей пользователя — в deque; вытесненные копятся в
+    pending и пачками по spill_batch уходят сжатым блоком в сегмент.
+
+    Индекс блоков (uid -> [(сегмент, смещение, длина, count)]) не хранится
+    отдельно: при открытии восстанавливается проходом по заголовкам.
+    Без каталога (dir="") вытесненное просто отбрасывается.
+
+    Значение для store — (spilled, pending + ring): по spilled при загрузке
+    отбрасываются записи, которые успели уйти в сегмент до падения.
+    """
+
+    def __init__(self, dir: str = "", ring: int = 50, spill_batch: int = 50, segment_bytes: int = 64 << 20):
+        self.dir = dir
+        self.ring = ring
+        self.spill_batch = spill_batch
+        self.segment_bytes = segment_bytes
+        self._rings: Dict[int, Deque[Entry]] = {}
+        self._pending: Dict[int, List[Entry]] = {}
+        self._index: Dict[int, List[Tuple[int, int, int, int]]] = {}
+        self._spilled: Dict[int, int] = {}
+        self._seg_no = 0
+        self._fh = None
+        self._unsynced = False
+        if dir:
+            os.makedirs(dir, exist_ok=True)
+            self._scan()
+
+    # --- dict-подобный доступ для Memory.load / collect_dirty ---
+    def get(self, uid: int, default=None):
+        if uid not in self._rings:
+            return default
+        return self._spilled.get(uid, 0), self._pending.get(uid, []) + list(self._rings[uid])
+
+    def __setitem__(self, uid: int, value) -> None:
+        # value: (spilled, entries) — из JSON-store списком; старый формат — list[(datetime, who, text)]
+        pair = isinstance(value, tuple) or (len(value) == 2 and isinstance(value[0], int))
+        spilled, entries = value if pair else (0, value)
+        entries = [_entry(*e) for e in entries]
+        already = self._spilled.get(uid, 0) - spilled
+        if already > 0:
+            entries = entries[already:]
+        ring = self._rings[uid] = deque(maxlen=self.ring)
+        cut = max(0, len(entries) - self.ring)
+        ring.extend(entries[cut:])
+        if cut:
+            self._pending[uid] = entries[:cut]
+            if cut >= self.spill_batch:
+                self._spill(uid)
+
+    def __contains__(self, uid: int) -> bool:
+        return uid in self._rings
+
+    def __len__(self) -> int:
+        return len(self._rings)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._rings)
+
+    # --- запись / чтение ---
+    def append(self, uid: int, who: str, text: str, ts: Optional[int] = None) -> None:
+        ring = self._rings.get(uid)
+        if ring is None:
+            ring = self._rings[uid] = deque(maxlen=self.ring)
+        if len(ring) == self.ring:
+            pending = self._pending.setdefault(uid, [])
+            pending.append(ring[0])
+            if len(pending) >= self.spill_batch:
+                self._spill(uid)
+        ring.append((int(time.time()) if ts is None else ts, sys.intern(who), text))
+
+    def tail(self, uid: int, n: int) -> List[Entry]:
+        """Последние n записей, от старых к новым."""
+        ring = self._rings.get(uid)
+        if ring is None and uid not in self._index:
+            return []
+        out = list(ring or ())[-n:]
+        if len(out) < n:
+            out = self._pending.get(uid, [])[-(n - len(out)):] + out
+        blocks = self._index.get(uid, ())
+        i = len(blocks)
+        while len(out) < n and i:
+            i -= 1
+            out = self._read(blocks[i])[-(n - len(out)):] + out
+        return out
+
+    def count(self, uid: int) -> int:
+        return self._spilled.get(uid, 0) + len(self._pending.get(uid, ())) + len(self._rings.get(uid, ()))
+
+    # --- сегменты ---
+    def _spill(self, uid: int) -> None:
+        entries = self._pending.pop(uid, None)
+        if not entries or not self.dir:
+            return
+        payload = zlib.compress(encode(entries), 6)
+        fh = self._segment()
+        offset = fh.tell()
+        fh.write(_HEADER.pack(uid, len(entries), len(payload), zlib.crc32(payload)))
+        fh.write(payload)
+        self._unsynced = True
+        self._index.setdefault(uid, []).append((self._seg_no, offset + _HEADER.size, len(payload), len(entries)))
+        self._spilled[uid] = self._spilled.get(uid, 0) + len(entries)
+
+    def _segment(self):
+        if self._fh is not None and self._fh.tell() >= self.segment_bytes:
+            self._fh.close()
+            self._fh = None
+            self._seg_no += 1
+        if self._fh is None:
+            self._fh = open(os.path.join(self.dir, _SEGMENT_NAME % self._seg_no), "ab")
+        return self._fh
+
+    def _read(self, block: Tuple[int, int, int, int]) -> List[Entry]:
+        seg, offset, length, _ = block
+        if seg == self._seg_no and self._unsynced:
+            self.sync()
+        with open(os.path.join(self.dir, _SEGMENT_NAME % seg), "rb") as f:
+            f.seek(offset)
+            return decode(zlib.decompress(f.read(length)))
+
+    def _scan(self) -> None:
+        segs = sorted(int(name[4:10]) for name in os.listdir(self.dir)
+                      if name.startswith("seg-") and name.endswith(".log"))
+        for seg in segs:
+            path = os.path.join(self.dir, _SEGMENT_NAME % seg)
+            with open(path, "rb") as f:
+                offset = 0
+                while True:
+                    head = f.read(_HEADER.size)
+                    if len(head) < _HEADER.size:
+                        break
+                    uid, count, length, crc = _HEADER.unpack(head)
+                    payload = f.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        break  # недописанный хвост после падения
+                    self._index.setdefault(uid, []).append((seg, offset + _HEADER.size, length, count))
+                    self._spilled[uid] = self._spilled.get(uid, 0) + count
+                    offset += _HEADER.size + length
+            if offset < os.path.getsize(path):
+                os.truncate(path, offset)
+        self._seg_no = segs[-1] if segs else 0
+
+    def sync(self) -> None:
+        # сегменты дописываем до того, как store запишет укороченный pending
+        if self._fh is not None and self._unsynced:
+            self._fh.flush()
+            self._unsynced = False
+
+    def close(self) -> None:
+        self.sync()
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
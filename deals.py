@@ -0,0 +1,426 @@
+# deals.py — запись сделки и реестр живых сделок с вторичными индексами
+import asyncio
+import bisect
+from datetime import datetime
+from enum import Enum
+from operator import attrgetter
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from storage import register
+
+
+class _Code(str, Enum):
+    """Строковый код: равен своей строке ("new" == Status.NEW), а в f-строках и
+    шаблонах texts.py печатается как значение, а не как Status.NEW."""
+
+    def __str__(self) -> str:
+        return self.value
+
+    __format__ = str.__format__
+
+
+class Status(_Code):
+    NEW = "new"
+    AWAIT_PAYMENT = "await_payment"
+    AWAIT_SELLER_FINAL = "await_seller_final"
+    DONE = "done"
+    STOPPED = "stopped"
+
+
+class Method(_Code):
+    RUB = "RUB"
+    USD = "USD"
+    KZT = "KZT"
+    STARS = "STARS"
+    TON = "TON"
+    EXCHANGE = "EXCHANGE"
+
+
+ACTIVE_STATUSES = frozenset({Status.NEW, Status.AWAIT_PAYMENT, Status.AWAIT_SELLER_FINAL})
+FINAL_STATUSES = frozenset({Status.DONE, Status.STOPPED})
+
+# (статус, событие) -> новый статус. Чего нет в таблице, то запрещено: повторное
+# нажатие, устаревшая кнопка или дедлайн после ручного действия — no-op.
+TRANSITIONS: Dict[Tuple[Status, str], Status] = {
+    (Status.NEW, "decline"): Status.STOPPED,                        # продавец отклонил приглашение
+    (Status.NEW, "stop"): Status.STOPPED,
+    (Status.NEW, "expire"): Status.STOPPED,                         # expires_at: продавец так и не подтвердил
+    (Status.NEW, "confirm"): Status.AWAIT_PAYMENT,
+    (Status.AWAIT_PAYMENT, "stop"): Status.STOPPED,
+    (Status.AWAIT_PAYMENT, "pay_timeout"): Status.STOPPED,          # seller_deadline
+    (Status.AWAIT_PAYMENT, "paid"): Status.AWAIT_SELLER_FINAL,
+    (Status.AWAIT_PAYMENT, "expire"): Status.STOPPED,               # expires_at раньше seller_deadline
+    (Status.AWAIT_SELLER_FINAL, "finish"): Status.DONE,
+    (Status.AWAIT_SELLER_FINAL, "expire"): Status.STOPPED,          # продавец так и не подтвердил получение
+}
+
+
+class TransitionError(Exception):
+    def __init__(self, deal_id: str, status, event: str):
+        super().__init__(f"deal {deal_id}: {event!r} not allowed in {status}")
+        self.deal_id = deal_id
+        self.status = status
+        self.event = event
+
+
+def can_transition(status, event: str) -> bool:
+    return (status, event) in TRANSITIONS
+
+
+def _epoch(value) -> Optional[int]:
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return None if value is None else int(value)
+
+
+class Deal:
+    """Живая сделка. Время — epoch-секунды; status и seller_id меняем только
+    через DealRegistry.set_status / set_seller, иначе разъедутся индексы."""
+
+    __slots__ = ("id", "creator_id", "creator_username", "title", "desc", "price_value", "exchange_desc",
+                 "method", "target_user", "lang", "status", "created_at", "expires_at", "seller_id",
+                 "seller_username", "seller_deadline", "deep_link", "seller_payto", "memo", "version",
+                 "_price_label")
+
+    def __init__(self, id: str, creator_id: int, title: str, desc: str, method, target_user: str,
+                 created_at, expires_at, price_value: Optional[float] = None, exchange_desc: Optional[str] = None,
+                 creator_username: str = "", lang: str = "ru", status=Status.NEW, deep_link: str = "",
+                 seller_id: Optional[int] = None, seller_username: Optional[str] = None, seller_deadline=None,
+                 seller_payto: Optional[str] = None, memo: Optional[str] = None, version: int = 0):
+        self.id = id
+        self.creator_id = creator_id
+        self.creator_username = creator_username
+        self.title = title
+        self.desc = desc
+        self.price_value = price_value      # float или None (для EXCHANGE)
+        self.exchange_desc = exchange_desc  # str или None
+        self.method = Method(method)
+        self.target_user = target_user
+        self.lang = lang
+        self.status = Status(status)
+        self.created_at = _epoch(created_at)
+        self.expires_at = _epoch(expires_at)
+        self.seller_id = seller_id
+        self.seller_username = seller_username
+        self.seller_deadline = _epoch(seller_deadline)
+        self.deep_link = deep_link
+        self.seller_payto = seller_payto    # универсальные реквизиты продавца (адрес/карта/@user и т.д.)
+        self.memo = memo
+        self.version = version              # растёт на каждом изменении через Memory
+        self._price_label: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Deal":
+        # снапшоты старого формата (dict) из store
+        return cls(**{k: v for k, v in d.items() if k in cls.__slots__})
+
+    @property
+    def price_label(self) -> str:
+        # цена не меняется после создания — считаем один раз
+        if self._price_label is None:
+            if self.exchange_desc:
+                self._price_label = self.exchange_desc
+            elif self.price_value is not None:
+                self._price_label = f"{self.price_value} {self.method}"
+            else:
+                self._price_label = str(self.method)
+        return self._price_label
+
+    def summary(self) -> "DealSummary":
+        return DealSummary(self.id, self.creator_id, self.seller_id, self.title, self.price_label,
+                           self.status, self.created_at)
+
+    def __getstate__(self):
+        return _deal_state(self)
+
+    def __setstate__(self, state) -> None:
+        if len(state) == 20:
+            # прямое присваивание слотам вчетверо быстрее цикла с setattr — заметно на снимке в 1M сделок
+            (self.id, self.creator_id, self.creator_username, self.title, self.desc, self.price_value,
+             self.exchange_desc, self.method, self.target_user, self.lang, self.status, self.created_at,
+             self.expires_at, self.seller_id, self.seller_username, self.seller_deadline, self.deep_link,
+             self.seller_payto, self.memo, self.version) = state
+        else:
+            self.version = 0  # снапшоты до версий короче на одно поле
+            for k, v in zip(self.__slots__, state):
+                setattr(self, k, v)
+        self._price_label = None
+
+    def __repr__(self) -> str:
+        return f"Deal({self.id!r}, {self.status}, creator={self.creator_id}, seller={self.seller_id})"
+
+
+_deal_state = attrgetter(*Deal.__slots__[:-1])   # кортеж полей одним вызовом C, без _price_label
+
+
+class DealSummary(NamedTuple):
+    """Завершённая сделка в истории: только то, что показываем в /history и админке."""
+    id: str
+    creator_id: int
+    seller_id: Optional[int]
+    title: str
+    price_label: str
+    status: Status
+    created_at: Optional[int]
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "DealSummary":
+        return Deal.from_dict(d).summary()
+
+
+# в store (storage.encode): Deal — dict полей, статус и метод обратно в enum'ы
+register(Deal, lambda d: dict(zip(Deal.__slots__, _deal_state(d))), Deal.from_dict)
+register(DealSummary, load=lambda v: DealSummary(**{**v, "status": Status(v["status"])}))
+
+
+class DealRegistry:
+    """deal_id -> сделка плюс индексы по creator_id, seller_id и status.
+
+    Индексы обновляются только через put/pop/set_status/set_seller, поэтому
+    status и seller_id живой сделки напрямую не присваиваем.
+    """
+
+    def __init__(self):
+        self._deals: Dict[str, Deal] = {}
+        self._by_creator: Dict[int, Set[str]] = {}
+        self._by_seller: Dict[int, Set[str]] = {}
+        self._by_status: Dict[str, Set[str]] = {}
+
+    # --- dict-подобный доступ ---
+    def __len__(self) -> int:
+        return len(self._deals)
+
+    def __contains__(self, deal_id) -> bool:
+        return deal_id in self._deals
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._deals)
+
+    def __getitem__(self, deal_id: str) -> Deal:
+        return self._deals[deal_id]
+
+    def __setitem__(self, deal_id: str, d: Deal) -> None:
+        self.put(d)
+
+    def get(self, deal_id: str, default=None) -> Optional[Deal]:
+        return self._deals.get(deal_id, default)
+
+    def values(self):
+        return self._deals.values()
+
+    def items(self):
+        return self._deals.items()
+
+    # --- изменения ---
+    @staticmethod
+    def _link(index: dict, key, deal_id: str) -> None:
+        if key is not None:
+            index.setdefault(key, set()).add(deal_id)
+
+    @staticmethod
+    def _unlink(index: dict, key, deal_id: str) -> None:
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(deal_id)
+            if not ids:
+                del index[key]
+
+    def put(self, d: Deal) -> None:
+        deal_id = d.id
+        old = self._deals.get(deal_id)
+        if old is not None:
+            self._unindex(old)
+        self._deals[deal_id] = d
+        self._link(self._by_creator, d.creator_id, deal_id)
+        self._link(self._by_seller, d.seller_id, deal_id)
+        self._link(self._by_status, d.status, deal_id)
+
+    def _unindex(self, d: Deal) -> None:
+        deal_id = d.id
+        self._unlink(self._by_creator, d.creator_id, deal_id)
+        self._unlink(self._by_seller, d.seller_id, deal_id)
+        self._unlink(self._by_status, d.status, deal_id)
+
+    def pop(self, deal_id: str, default=None) -> Optional[Deal]:
+        d = self._deals.pop(deal_id, None)
+        if d is None:
+            return default
+        self._unindex(d)
+        return d
+
+    def set_status(self, d: Deal, status) -> None:
+        status = Status(status)
+        deal_id = d.id
+        if deal_id in self._deals:
+            self._unlink(self._by_status, d.status, deal_id)
+            self._link(self._by_status, status, deal_id)
+        d.status = status
+
+    def set_seller(self, d: Deal, seller_id: Optional[int]) -> None:
+        deal_id = d.id
+        if deal_id in self._deals:
+            self._unlink(self._by_seller, d.seller_id, deal_id)
+            self._link(self._by_seller, seller_id, deal_id)
+        d.seller_id = seller_id
+
+    # --- выборки ---
+    def by_creator(self, uid: int) -> List[Deal]:
+        return [self._deals[i] for i in self._by_creator.get(uid, ())]
+
+    def by_seller(self, uid: int) -> List[Deal]:
+        return [self._deals[i] for i in self._by_seller.get(uid, ())]
+
+    def by_status(self, status: str) -> List[Deal]:
+        return [self._deals[i] for i in self._by_status.get(status, ())]
+
+    def active_for_creator(self, uid: int, at: float) -> List[Deal]:
+        # O(сделок пользователя), а не O(всех сделок); at — epoch
+        out = []
+        for deal_id in self._by_creator.get(uid, ()):
+            d = self._deals[deal_id]
+            if d.status in ACTIVE_STATUSES and (d.expires_at is None or at < d.expires_at):
+                out.append(d)
+        return out
+
+    def has_active_for_creator(self, uid: int, at: float) -> bool:
+        for deal_id in self._by_creator.get(uid, ()):
+            d = self._deals[deal_id]
+            if d.status in ACTIVE_STATUSES and (d.expires_at is None or at < d.expires_at):
+                return True
+        return False
+
+
+class _Held:
+    __slots__ = ("locks", "deal_id", "entry")
+
+    def __init__(self, locks: "DealLocks", deal_id: str):
+        self.locks = locks
+        self.deal_id = deal_id
+        self.entry = None
+
+    async def __aenter__(self):
+        table = self.locks._locks
+        entry = table.get(self.deal_id)
+        if entry is None:
+            entry = table[self.deal_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self.entry = entry
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._release_ref()
+            raise
+
+    async def __aexit__(self, *exc):
+        self.entry[0].release()
+        self._release_ref()
+
+    def _release_ref(self) -> None:
+        self.entry[1] -= 1
+        if not self.entry[1]:
+            del self.locks._locks[self.deal_id]
+
+
+class DealLocks:
+    """deal_id -> asyncio.Lock. Апдейты одной сделки идут строго по очереди,
+    разных — параллельно. Замок живёт, пока его держат или ждут."""
+
+    def __init__(self):
+        self._locks: Dict[str, list] = {}   # deal_id -> [Lock, держатели + ожидающие]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def __call__(self, deal_id: str) -> _Held:
+        return _Held(self, deal_id)
+
+
+class DealTimeline:
+    """Все сделки (живые и из истории) в порядке создания — для админки.
+
+    Append-only: seq растёт с каждым add, поэтому курсор страницы — это seq
+    крайней показанной строки, и он переживает удаления. Удалённые
+    (истёкшие без архива) записи пропускаются лениво и вычищаются, когда
+    их становится больше половины.
+    """
+
+    def __init__(self):
+        self._seqs: List[int] = []          # возрастающие seq
+        self._ids: List[str] = []           # deal_id на той же позиции
+        self._records: Dict[str, object] = {}  # deal_id -> Deal | DealSummary
+        self._seq_of: Dict[str, int] = {}
+        self._next = 0
+        self._dead = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def add(self, rec) -> None:
+        # повторный add (архивировали живую сделку) меняет запись, но не место
+        if rec.id not in self._records:
+            self._seqs.append(self._next)
+            self._ids.append(rec.id)
+            self._seq_of[rec.id] = self._next
+            self._next += 1
+        self._records[rec.id] = rec
+
+    def discard(self, deal_id: str) -> None:
+        if self._records.pop(deal_id, None) is not None:
+            del self._seq_of[deal_id]
+            self._dead += 1
+            if self._dead > len(self._records):
+                self._compact()
+
+    def discard_live(self, deal_id: str) -> None:
+        # из реестра ушла сделка, не попавшая в историю (истекла) — из ленты тоже
+        if isinstance(self._records.get(deal_id), Deal):
+            self.discard(deal_id)
+
+    def _compact(self) -> None:
+        keep = [i for i, deal_id in enumerate(self._ids) if self._seq_of.get(deal_id) == self._seqs[i]]
+        self._seqs = [self._seqs[i] for i in keep]
+        self._ids = [self._ids[i] for i in keep]
+        self._dead = 0
+
+    def _alive(self, i: int):
+        deal_id = self._ids[i]
+        if self._seq_of.get(deal_id) == self._seqs[i]:
+            return self._records[deal_id]
+        return None
+
+    def page(self, limit: int, before: Optional[int] = None, after: Optional[int] = None):
+        """Страница из limit записей, новые первыми.
+
+        before=seq — записи старше seq (следующая страница), after=seq — новее
+        (предыдущая). Возвращает (записи, older, newer): курсоры для соседних
+        страниц или None, если дальше ничего нет. O(limit + пропущенные удалённые).
+        """
+        out = []
+        if after is None:
+            i = len(self._seqs) - 1 if before is None else bisect.bisect_left(self._seqs, before) - 1
+            while i >= 0 and len(out) < limit:
+                rec = self._alive(i)
+                if rec is not None:
+                    out.append((self._seqs[i], rec))
+                i -= 1
+        else:
+            i = bisect.bisect_right(self._seqs, after)
+            while i < len(self._seqs) and len(out) < limit:
+                rec = self._alive(i)
+                if rec is not None:
+                    out.append((self._seqs[i], rec))
+                i += 1
+            out.reverse()
+        if not out:
+            return [], None, None
+        older = out[-1][0] if self._exists(out[-1][0], -1) else None
+        newer = out[0][0] if self._exists(out[0][0], +1) else None
+        return [rec for _, rec in out], older, newer
+
+    def _exists(self, seq: int, step: int) -> bool:
+        i = bisect.bisect_left(self._seqs, seq) + step
+        while 0 <= i < len(self._seqs):
+            if self._alive(i) is not None:
+                return True
+            i += step
+        return False
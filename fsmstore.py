@@ -0,0 +1,197 @@
+# fsmstore.py — FSM aiogram поверх Store: TTL, кэш чтения, запись пачками
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, Mapping, NamedTuple, Optional, Tuple
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from scheduler import DeadlineScheduler
+from storage import Store, register
+
+SECTION = "fsm"
+
+
+class Record(NamedTuple):
+    state: Optional[str]
+    data: dict
+    expires_at: float
+
+
+register(Record)
+
+class TTLStorage(BaseStorage):
+    """Состояние и данные FSM — одна запись на ключ; живёт ttl секунд с
+    последнего изменения, потом снимается из кэша и store. Брошенный на
+    полпути сценарий после этого ничего не стоит.
+
+    Чтение — через LRU-кэш на cache_size ключей (отсутствие записи тоже
+    кэшируется: get_state зовётся на каждый апдейт), промах — один SELECT по
+    ключу; из общего store — в потоке, loop не ждёт сеть. Изменения копятся в dirty, flush() (из store_flusher) пишет их
+    одной транзакцией. Без персистентного store кэш и есть хранилище: он не
+    вытесняется, а пустые ключи в нём не держим.
+    """
+
+    def __init__(self, store: Store, ttl: float, cache_size: int = 10_000, key_builder: Optional[KeyBuilder] = None,
+                 flush_lock: Optional[asyncio.Lock] = None):
+        self.store = store
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.cache: "OrderedDict[str, Optional[Record]]" = OrderedDict()
+        self.dirty: Dict[str, Optional[Record]] = {}     # None — удалить из store
+        self.flush_lock = flush_lock or asyncio.Lock()    # общий с Memory.flush: пачки в store по порядку
+        self.expiry = DeadlineScheduler()                 # (ключ, "fsm") -> expires_at
+        self.hits = self.misses = self.expired = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"hit": self.hits, "miss": self.misses, "expired": self.expired}
+
+    # --- кэш ---
+    async def _get(self, k: str) -> Optional[Record]:
+        if k in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(k)
+            rec = self.cache[k]
+        elif k in self.dirty:
+            rec = self.dirty[k]
+            self._cache(k, rec)
+        else:
+            self.misses += 1
+            rec = await self._read(k)
+            if k in self.dirty:
+                rec = self.dirty[k]   # пока читали, хендлер успел записать
+            elif k in self.cache:
+                rec = self.cache[k]   # или пришло значение другого инстанса (apply)
+            else:
+                self._cache(k, rec)
+        if rec is not None and rec.expires_at <= time.time():
+            self.expired += 1
+            self._drop(k)   # expiry-задача ещё не дошла, но для хендлера записи уже нет
+            return None
+        return rec
+
+    async def _read(self, k: str) -> Optional[Record]:
+        if self.store.shared:
+            return await asyncio.to_thread(self.store.get, SECTION, k)
+        return self.store.get(SECTION, k)   # локальный SQLite: точечный SELECT быстрее переключения потока
+
+    def _cache(self, k: str, rec: Optional[Record]) -> None:
+        if not self.store.persistent:
+            if rec is not None:
+                self.cache[k] = rec
+            return
+        self.cache[k] = rec
+        self.cache.move_to_end(k)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)   # в store или в dirty оно уже есть
+
+    def _put(self, k: str, state: Optional[str], data: dict) -> None:
+        if state is None and not data:
+            self._drop(k)
+            return
+        rec = Record(state, data, time.time() + self.ttl)
+        self._cache(k, rec)
+        if self.store.persistent:
+            self.dirty[k] = rec
+        self.expiry.schedule(k, SECTION, rec.expires_at)
+
+    def _drop(self, k: str) -> None:
+        self.expiry.cancel(k, SECTION)
+        if self.store.persistent:
+            self._cache(k, None)
+            self.dirty[k] = None
+        else:
+            self.cache.pop(k, None)
+
+    # --- BaseStorage ---
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = self.key_builder.build(key)
+        rec = await self._get(k)
+        self._put(k, state.state if isinstance(state, State) else state, rec.data if rec else {})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        rec = await self._get(self.key_builder.build(key))
+        return rec.state if rec else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        k = self.key_builder.build(key)
+        rec = await self._get(k)
+        self._put(k, rec.state if rec else None, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        rec = await self._get(self.key_builder.build(key))
+        return rec.data.copy() if rec else {}
+
+    async def close(self) -> None:
+        # Dispatcher зовёт на shutdown polling'а; store закрывает владелец — Memory
+        await self.flush()
+
+    def forget(self, k: str) -> None:
+        """Ключ поменял другой инстанс общего store: следующее чтение — из store.
+        Истечение теперь на том, кто писал последним."""
+        if k not in self.dirty:
+            self.cache.pop(k, None)
+            self.expiry.cancel(k, SECTION)
+
+    def apply(self, k: str, rec: Optional[Record]) -> None:
+        """То же, но свежее значение уже прочитано (store_sync, пачкой в потоке):
+        кладём его в кэш, как Memory.apply, и чтение не идёт в store."""
+        if k not in self.dirty:
+            self.expiry.cancel(k, SECTION)
+            self._cache(k, rec)
+
+    # --- фон ---
+    def load(self) -> None:
+        """При старте: живые ключи — в расписание истечения (в кэш их поднимет
+        первое чтение), истёкшие за время простоя — на удаление."""
+        now = time.time()
+        for k, rec in self.store.load(SECTION):
+            if rec.expires_at <= now:
+                self.dirty[k] = None
+            else:
+                self.expiry.schedule(k, SECTION, rec.expires_at)
+
+    async def run(self) -> None:
+        await self.expiry.run(self._expire)
+
+    async def _expire(self, k: str, _kind: str) -> None:
+        self.expired += 1
+        self._drop(k)
+
+    async def flush(self) -> int:
+        async with self.flush_lock:
+            if not self.dirty:
+                return 0
+            batch, self.dirty = self.dirty, {}
+            rows = [(SECTION, k, None if rec is None else self.store.encode(rec)) for k, rec in batch.items()]
+            try:
+                await asyncio.to_thread(self.store.write, rows)
+            except Exception:
+                # более свежие изменения, пришедшие за время записи, не затираем
+                for k, rec in batch.items():
+                    self.dirty.setdefault(k, rec)
+                raise
+            return len(rows)
+
+    # --- снимок тёплого рестарта (snapshot.py) ---
+    def snapshot(self) -> Iterator[Tuple[str, Record]]:
+        if self.store.persistent:
+            return iter(())   # всё уже в store
+        return iter(list(self.cache.items()))
+
+    def restore(self, items: Iterable[Tuple[Any, Any]]) -> None:
+        now = time.time()
+        for k, rec in items:
+            if isinstance(k, StorageKey):
+                # снимок времён MemoryStorage: (StorageKey, MemoryStorageRecord)
+                k, rec = self.key_builder.build(k), Record(rec.state, rec.data, now + self.ttl)
+            if rec.expires_at > now:
+                self._cache(k, rec)
+                if self.store.persistent:
+                    self.dirty[k] = rec
+                self.expiry.schedule(k, SECTION, rec.expires_at)
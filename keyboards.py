@@ -1,42 +1,214 @@
+from functools import lru_cache
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.types.switch_inline_query_chosen_chat import SwitchInlineQueryChosenChat
 
-def main_menu(lang: str, has_active: bool=False, has_history: bool=False) -> InlineKeyboardMarkup:
-    t = {"ru": ("⚙️ Настройки", "👛 Кошелёк", "📦 Создать сделку", "🟡 Текущая сделка", "🗂 История сделок"), "en": ("⚙️ Settings", "👛 Wallet", "📦 Create deal", "🟡 Current deal", "🗂 Deal history")}[lang]
-    rows = [[InlineKeyboardButton(text=t[0], callback_data="settings")],[InlineKeyboardButton(text=t[1], callback_data="wallet")],[InlineKeyboardButton(text=t[2], callback_data="create")]]
+from texts import t
+
+# Клавиатуры строятся один раз и переиспользуются: pydantic-валидация дерева
+# кнопок дорогая, а статические меню зависят только от пары флагов.
+# Возвращаемые объекты общие — их нельзя мутировать.
+# Клавиатуры сделок собираются из закэшированного шаблона подстановкой deal_id.
+
+DEAL = "{deal_id}"          # плейсхолдер в шаблонах клавиатур сделок
+DEAL_KB_CACHE = 4096        # сколько готовых клавиатур сделок держим
+
+
+def _menu_txt(lang: str) -> str:
+    return "↩️ В меню" if lang == "ru" else "↩️ Menu"
+
+
+def _fill_button(b: InlineKeyboardButton, deal_id: str) -> InlineKeyboardButton:
+    if b.callback_data and DEAL in b.callback_data:
+        return b.model_copy(update={"callback_data": b.callback_data.replace(DEAL, deal_id)})
+    sic = b.switch_inline_query_chosen_chat
+    if sic is not None and DEAL in (sic.query or ""):
+        sic = sic.model_copy(update={"query": sic.query.replace(DEAL, deal_id)})
+        return b.model_copy(update={"switch_inline_query_chosen_chat": sic})
+    return b  # статичная кнопка («В меню») общая для всех сделок
+
+
+def _fill(tpl: InlineKeyboardMarkup, deal_id: str) -> InlineKeyboardMarkup:
+    rows = [[_fill_button(b, deal_id) for b in row] for row in tpl.inline_keyboard]
+    return tpl.model_copy(update={"inline_keyboard": rows})
+
+
+# ---------- STATIC ----------
+@lru_cache(maxsize=None)
+def main_menu(lang: str, has_active: bool = False, has_history: bool = False, is_admin: bool = False) -> InlineKeyboardMarkup:
+    t_ru = ("⚙️ Настройки", "👛 Кошелёк", "📦 Создать сделку", "🟡 Текущая сделка", "🗂 История сделок")
+    t_en = ("⚙️ Settings", "👛 Wallet", "📦 Create deal", "🟡 Current deal", "🗂 Deal history")
+    t_local = t_ru if lang == "ru" else t_en
+    rows = [[InlineKeyboardButton(text=t_local[0], callback_data="settings")],[InlineKeyboardButton(text=t_local[1], callback_data="wallet")],[InlineKeyboardButton(text=t_local[2], callback_data="create")]]
     if has_active:
-        rows.append([InlineKeyboardButton(text=t[3], callback_data="current")])
+        rows.append([InlineKeyboardButton(text=t_local[3], callback_data="current")])
     if has_history:
-        rows.append([InlineKeyboardButton(text=t[4], callback_data="history")])
+        rows.append([InlineKeyboardButton(text=t_local[4], callback_data="history")])
+    if is_admin:
+        rows.append([InlineKeyboardButton(text="🛡️ Admin", callback_data="admin_panel")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
+@lru_cache(maxsize=None)
 def back_to_menu(lang: str) -> InlineKeyboardMarkup:
-    txt = "↩️ В меню" if lang == "ru" else "↩️ Menu"
-    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=txt, callback_data="menu")]])
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=_menu_txt(lang), callback_data="menu")]])
 
+@lru_cache(maxsize=None)
 def lang_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🇷🇺 Русский", callback_data="lang_ru"), InlineKeyboardButton(text="🇬🇧 English", callback_data="lang_en")],[InlineKeyboardButton(text="↩️ В меню / Menu", callback_data="menu")]])
 
+@lru_cache(maxsize=None)
+def settings_kb(lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="RUB", callback_data="pay:RUB"),
+            InlineKeyboardButton(text="USD", callback_data="pay:USD"),
+            InlineKeyboardButton(text="KZT", callback_data="pay:KZT"),
+        ],
+        [InlineKeyboardButton(text="⭐ STARS", callback_data="pay:STARS")],
+        [
+            InlineKeyboardButton(text="TON", callback_data="pay:TON"),
+            InlineKeyboardButton(text="🔁 Обмен" if lang == "ru" else "🔁 Exchange", callback_data="pay:EXCHANGE"),
+        ],
+        [
+            InlineKeyboardButton(text=t(lang, "lang_ru"), callback_data="lang_ru"),
+            InlineKeyboardButton(text=t(lang, "lang_en"), callback_data="lang_en"),
+        ],
+        [InlineKeyboardButton(text=t(lang, "lang_menu_footer"), callback_data="menu")]
+    ])
+
+@lru_cache(maxsize=None)
 def create_nav(lang: str, step: int) -> InlineKeyboardMarkup:
     prev_txt = "⬅️ Пред" if lang=="ru" else "⬅️ Prev"
     next_txt = "➡️ След" if lang=="ru" else "➡️ Next"
     cancel_txt = "⛔️ Отменить" if lang=="ru" else "⛔️ Cancel"
-    menu_txt = "↩️ В меню" if lang=="ru" else "↩️ Menu"
     rows = []
     if step > 1:
         rows.append([InlineKeyboardButton(text=prev_txt, callback_data="create_prev")])
     rows.append([InlineKeyboardButton(text=next_txt, callback_data="create_next")])
     rows.append([InlineKeyboardButton(text=cancel_txt, callback_data="create_cancel")])
-    rows.append([InlineKeyboardButton(text=menu_txt, callback_data="menu")])
+    rows.append([InlineKeyboardButton(text=_menu_txt(lang), callback_data="menu")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
-def final_actions(lang: str, deal_id: str) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def create_nav_prev_only(lang: str, step: int) -> InlineKeyboardMarkup:
+    prev_txt = "⬅️ Пред" if lang == "ru" else "⬅️ Prev"
+    cancel_txt = "⛔️ Отменить" if lang == "ru" else "⛔️ Cancel"
+    rows = []
+    if step > 1:
+        rows.append([InlineKeyboardButton(text=prev_txt, callback_data="create_prev")])
+    rows.append([InlineKeyboardButton(text=cancel_txt, callback_data="create_cancel")])
+    rows.append([InlineKeyboardButton(text=_menu_txt(lang), callback_data="menu")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+@lru_cache(maxsize=None)
+def admin_panel_kb() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=t("ru","admin_btn_recent"), callback_data="admin_recent")],
+        [InlineKeyboardButton(text=t("ru","admin_btn_chatlog"), callback_data="admin_chatlog")],
+        [InlineKeyboardButton(text=t("ru","admin_btn_purge"), callback_data="admin_purge")],
+        [InlineKeyboardButton(text=t("ru","admin_btn_profile"), callback_data="admin_profile")],
+        [InlineKeyboardButton(text=t("ru","admin_back"), callback_data="admin_back_menu")]
+    ])
+
+@lru_cache(maxsize=None)
+def admin_profile_kb(enabled: bool) -> InlineKeyboardMarkup:
+    toggle = ("admin_profile_off", "admin_profile:off") if enabled else ("admin_profile_on", "admin_profile:on")
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=t("ru",toggle[0]), callback_data=toggle[1])],
+        [InlineKeyboardButton(text=t("ru","admin_back"), callback_data="admin_back")]
+    ])
+
+@lru_cache(maxsize=None)
+def admin_back_only_kb() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=t("ru","admin_back"), callback_data="admin_back")]
+    ])
+
+@lru_cache(maxsize=256)
+def admin_recent_kb(older=None, newer=None) -> InlineKeyboardMarkup:
+    # older/newer — курсоры DealTimeline.page; None — в ту сторону листать некуда
+    nav = []
+    if newer is not None:
+        nav.append(InlineKeyboardButton(text=t("ru","admin_newer"), callback_data=f"admin_recent:newer:{newer}"))
+    if older is not None:
+        nav.append(InlineKeyboardButton(text=t("ru","admin_older"), callback_data=f"admin_recent:older:{older}"))
+    rows = [nav] if nav else []
+    rows.append([InlineKeyboardButton(text=t("ru","admin_back"), callback_data="admin_back")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+# ---------- PER-DEAL TEMPLATES ----------
+@lru_cache(maxsize=None)
+def _final_actions_tpl(lang: str) -> InlineKeyboardMarkup:
     send_txt = "📩 Отправить продавцу" if lang=="ru" else "📩 Send to seller"
     cancel_txt = "⛔️ Отменить ордер" if lang=="ru" else "⛔️ Cancel order"
-    menu_txt = "↩️ В меню" if lang=="ru" else "↩️ Menu"
-    sic = SwitchInlineQueryChosenChat(query=f"deal_{deal_id}", allow_user_chats=True, allow_bot_chats=False, allow_group_chats=True, allow_channel_chats=False)
-    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=send_txt, switch_inline_query_chosen_chat=sic)],[InlineKeyboardButton(text=cancel_txt, callback_data=f"deal:{deal_id}:stop")],[InlineKeyboardButton(text=menu_txt, callback_data="menu")]])
+    sic = SwitchInlineQueryChosenChat(query=f"deal_{DEAL}", allow_user_chats=True, allow_bot_chats=False, allow_group_chats=True, allow_channel_chats=False)
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=send_txt, switch_inline_query_chosen_chat=sic)],
+        [InlineKeyboardButton(text=cancel_txt, callback_data=f"deal:{DEAL}:stop")],
+        [InlineKeyboardButton(text=_menu_txt(lang), callback_data="menu")],
+    ])
+
+@lru_cache(maxsize=None)
+def _seller_controls_tpl(lang: str) -> InlineKeyboardMarkup:
+    texts = ("⛔️ Остановить ордер", "✅ Я перевёл(а) подарки") if lang == "ru" else ("⛔️ Stop order", "✅ I sent the gifts")
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=texts[0], callback_data=f"deal:{DEAL}:stop")],
+        [InlineKeyboardButton(text=texts[1], callback_data=f"deal:{DEAL}:confirm")],
+    ])
+
+@lru_cache(maxsize=None)
+def _accept_order_tpl(lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=t(lang, "accept_btn"), callback_data=f"deal:{DEAL}:accept")],
+        [InlineKeyboardButton(text=_menu_txt(lang), callback_data="menu")]
+    ])
+
+@lru_cache(maxsize=None)
+def _accept_decline_tpl(lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text=t(lang, "accept_short"),  callback_data=f"deal:{DEAL}:accept_invite"),
+            InlineKeyboardButton(text=t(lang, "decline_short"), callback_data=f"deal:{DEAL}:decline"),
+        ],
+        [InlineKeyboardButton(text=_menu_txt(lang), callback_data="menu")]
+    ])
 
+@lru_cache(maxsize=None)
+def _buyer_pay_tpl(lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=t(lang, "copy_memo"), callback_data=f"memo:{DEAL}")],
+        [InlineKeyboardButton(text=t(lang, "confirm_paid"), callback_data=f"paid:{DEAL}")],
+        [InlineKeyboardButton(text=_menu_txt(lang), callback_data="menu")],
+    ])
+
+@lru_cache(maxsize=None)
+def _seller_final_tpl(lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=t(lang, "confirm_receive"), callback_data=f"finish:{DEAL}")],
+        [InlineKeyboardButton(text=_menu_txt(lang), callback_data="menu")],
+    ])
+
+# ---------- PER-DEAL ----------
+@lru_cache(maxsize=DEAL_KB_CACHE)
+def final_actions(lang: str, deal_id: str) -> InlineKeyboardMarkup:
+    return _fill(_final_actions_tpl(lang), deal_id)
+
+@lru_cache(maxsize=DEAL_KB_CACHE)
 def seller_controls(lang: str, deal_id: str) -> InlineKeyboardMarkup:
-    texts = {"ru": ("⛔️ Остановить ордер", "✅ Я перевёл(а) подарки"), "en": ("⛔️ Stop order", "✅ I sent the gifts")}[lang]
-    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=texts[0], callback_data=f"deal:{deal_id}:stop")],[InlineKeyboardButton(text=texts[1], callback_data=f"deal:{deal_id}:confirm")]])
+    return _fill(_seller_controls_tpl(lang), deal_id)
+
+@lru_cache(maxsize=DEAL_KB_CACHE)
+def accept_order_kb(lang: str, deal_id: str) -> InlineKeyboardMarkup:
+    return _fill(_accept_order_tpl(lang), deal_id)
+
+@lru_cache(maxsize=DEAL_KB_CACHE)
+def accept_decline_kb(lang: str, deal_id: str) -> InlineKeyboardMarkup:
+    return _fill(_accept_decline_tpl(lang), deal_id)
+
+@lru_cache(maxsize=DEAL_KB_CACHE)
+def buyer_pay_kb(lang: str, deal_id: str) -> InlineKeyboardMarkup:
+    return _fill(_buyer_pay_tpl(lang), deal_id)
+
+@lru_cache(maxsize=DEAL_KB_CACHE)
+def seller_final_kb(lang: str, deal_id: str) -> InlineKeyboardMarkup:
+    return _fill(_seller_final_tpl(lang), deal_id)
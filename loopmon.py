@@ -0,0 +1,125 @@
+# loopmon.py — задержка event loop'а и поиск колбэков, которые его держат
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from types import CodeType
+from typing import Deque, Dict, NamedTuple, Optional
+
+from outbound import Histogram
+
+log = logging.getLogger("loopmon")
+
+STACK_LIMIT = 20   # кадров в сохранённом стеке
+
+
+class SlowCallback(NamedTuple):
+    at: float          # epoch начала блокировки
+    ms: float          # сколько loop не отвечал
+    handler: str       # хендлер aiogram из стека или "unknown"
+    stack: str         # стек потока loop'а в момент блокировки ("" — не успели снять)
+
+
+def handler_codes(router) -> Dict[CodeType, str]:
+    """code object -> имя для всех хендлеров роутера и его подроутеров."""
+    out = {}
+    for r in router.chain_tail:
+        for observer in r.observers.values():
+            for h in observer.handlers:
+                code = getattr(h.callback, "__code__", None)
+                if code is not None:
+                    out[code] = h.callback.__name__
+    return out
+
+
+class LoopMonitor:
+    """Корутина на loop'е спит tick секунд и меряет, насколько позже
+    проснулась, — это задержка планирования (lag), она идёт в гистограмму.
+
+    Сторожевой поток смотрит на время последнего «сердцебиения»: если loop
+    молчит дольше threshold, он снимает стек потока loop'а — это стек того,
+    кто держит loop, — и ищет в нём хендлер aiogram. Когда loop оживает,
+    запись дополняется полной длительностью блокировки и пишется в лог.
+    """
+
+    def __init__(self, tick: float = 0.05, threshold: float = 0.1, log_every: float = 60,
+                 keep: int = 50, handlers: Optional[Dict[CodeType, str]] = None):
+        self.tick = tick
+        self.threshold = threshold
+        self.log_every = log_every
+        self.handlers = handlers or {}
+        self.lag = Histogram()                           # мс
+        self.max_lag_ms = 0.0                            # за текущее окно лога
+        self.recent: Deque[SlowCallback] = deque(maxlen=keep)
+        self.slow_by_handler: Dict[str, int] = {}
+        self._loop_thread = 0
+        self._beat = time.monotonic()                    # когда монитор последний раз уснул
+        self._reported = 0.0
+        self._pending: Optional[tuple] = None            # (at, handler, stack) от сторожа
+
+    async def run(self) -> None:
+        self._loop_thread = threading.get_ident()
+        stop = threading.Event()
+        watchdog = threading.Thread(target=self._watch, args=(stop,), name="loopmon", daemon=True)
+        watchdog.start()
+        last_log = time.monotonic()
+        try:
+            while True:
+                self._beat = time.monotonic()
+                await asyncio.sleep(self.tick)
+                now = time.monotonic()
+                lag = now - self._beat - self.tick
+                self.lag.observe(lag * 1000)
+                self.max_lag_ms = max(self.max_lag_ms, lag * 1000)
+                if lag >= self.threshold:
+                    self._record(lag)
+                if now - last_log >= self.log_every:
+                    self._log_summary()
+                    last_log = now
+        finally:
+            stop.set()
+
+    def _record(self, lag: float) -> None:
+        pending, self._pending = self._pending, None
+        at, handler, stack = pending or (time.time() - lag, "unknown", "")
+        rec = SlowCallback(at, lag * 1000, handler, stack)
+        self.recent.append(rec)
+        self.slow_by_handler[handler] = self.slow_by_handler.get(handler, 0) + 1
+        log.warning("event loop blocked for %.0f ms in %s%s", rec.ms, handler, "\n" + stack if stack else "")
+
+    def _log_summary(self) -> None:
+        top = sorted(self.slow_by_handler.items(), key=lambda kv: -kv[1])[:5]
+        log.info("loop lag p50=%.1fms p99=%.1fms max=%.1fms; slow callbacks %d%s",
+                 self.lag.quantile(0.5), self.lag.quantile(0.99), self.max_lag_ms, len(self.recent),
+                 " (" + ", ".join(f"{h}={n}" for h, n in top) + ")" if top else "")
+        self.max_lag_ms = 0.0
+
+    # --- сторожевой поток ---
+    def _watch(self, stop: threading.Event) -> None:
+        while not stop.wait(self.threshold / 2):
+            beat = self._beat
+            if time.monotonic() - beat - self.tick < self.threshold or self._reported == beat:
+                continue
+            self._reported = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            self._pending = (time.time() - (time.monotonic() - beat - self.tick),
+                             self._handler_of(frame),
+                             "".join(traceback.format_stack(frame, limit=STACK_LIMIT)))
+
+    def _handler_of(self, frame) -> str:
+        # ближайший к вершине стека кадр, который является хендлером
+        while frame is not None:
+            name = self.handlers.get(frame.f_code)
+            if name is not None:
+                return name
+            frame = frame.f_back
+        return "unknown"
+
+    def stats(self) -> dict:
+        return {"lag_p50_ms": self.lag.quantile(0.5), "lag_p99_ms": self.lag.quantile(0.99),
+                "slow_callbacks": sum(self.slow_by_handler.values()), "by_handler": dict(self.slow_by_handler)}
@@ -0,0 +1,229 @@
+# metrics.py — счётчики бота в текстовом формате Prometheus
+import asyncio
+import contextlib
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import Update
+
+from outbound import LATENCY_BUCKETS_MS, Histogram
+
+MAX_SERIES = 256          # защита от мусорного callback_data: дальше всё идёт в "other"
+COMMANDS = ("/start", "/admin")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+GaugeFn = Callable[[], Dict[str, int]]
+
+
+def handler_label(update: Update) -> str:
+    # префикс callback_data до ":" ("deal:abc:accept" -> "deal"), команда или тип апдейта
+    if update.callback_query is not None:
+        return (update.callback_query.data or "").split(":", 1)[0] or "callback"
+    if update.message is not None:
+        text = update.message.text or ""
+        if text.startswith("/"):
+            cmd = text.split(maxsplit=1)[0].split("@", 1)[0]
+            return cmd if cmd in COMMANDS else "command"
+        return "message"
+    if update.inline_query is not None:
+        return "inline"
+    return update.event_type
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+_LE = [f"{b / 1000:g}" for b in LATENCY_BUCKETS_MS] + ["+Inf"]
+
+
+class Metrics:
+    """Реестр одного процесса. Запись — пара словарных операций и bisect,
+    вся работа по форматированию — в render() во время скрейпа."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.handlers: Dict[Tuple[str, str], Histogram] = {}     # (handler, state) -> мс
+        self.handler_errors: Dict[Tuple[str, str], int] = {}     # (handler, error)
+        self.api: Dict[str, Histogram] = {}                      # метод Bot API -> мс
+        self.api_errors: Dict[Tuple[str, str], int] = {}         # (method, error)
+        self.gauges: List[Tuple[str, str, GaugeFn]] = []         # (имя, label, источник)
+        self.sources: List[tuple] = []                           # (kind, имя, help, labels, источник)
+
+    def _series(self, table: dict, key, factory):
+        h = table.get(key)
+        if h is None:
+            if len(table) >= MAX_SERIES:
+                key = ("other",) + key[1:] if isinstance(key, tuple) else "other"
+                h = table.get(key)
+            if h is None:
+                h = table[key] = factory()
+        return h
+
+    def observe_handler(self, handler: str, state: str, ms: float, error: str = "") -> None:
+        self._series(self.handlers, (handler, state), Histogram).observe(ms)
+        if error:
+            key = (handler, error)
+            self.handler_errors[key] = self.handler_errors.get(key, 0) + 1
+
+    def observe_api(self, method: str, ms: float, error: str = "") -> None:
+        self._series(self.api, method, Histogram).observe(ms)
+        if error:
+            key = (method, error)
+            self.api_errors[key] = self.api_errors.get(key, 0) + 1
+
+    def gauge(self, name: str, label: str, source: GaugeFn) -> None:
+        """source() -> {значение label: число}; вызывается только при скрейпе."""
+        self.gauges.append((name, label, source))
+
+    def histogram(self, name: str, help_: str, labels: Tuple[str, ...], source: Callable[[], dict]) -> None:
+        """Чужие гистограммы: source() -> {значения labels: Histogram}."""
+        self.sources.append(("histogram", name, help_, labels, source))
+
+    def counter(self, name: str, help_: str, labels: Tuple[str, ...], source: Callable[[], dict]) -> None:
+        self.sources.append(("counter", name, help_, labels, source))
+
+    # --- экспозиция ---
+    @staticmethod
+    def _histogram(out: List[str], name: str, help_: str, names: Tuple[str, ...], table: dict) -> None:
+        out.append(f"# HELP {name} {help_}")
+        out.append(f"# TYPE {name} histogram")
+        for key, h in sorted(table.items()):
+            labels = _labels(names, key if isinstance(key, tuple) else (key,))
+            acc = 0
+            for le, c in zip(_LE, h.counts):
+                acc += c
+                out.append(f'{name}_bucket{{{labels + "," if labels else ""}le="{le}"}} {acc}')
+            labels = f"{{{labels}}}" if labels else ""
+            out.append(f"{name}_sum{labels} {h.sum / 1000:.6f}")
+            out.append(f"{name}_count{labels} {h.total}")
+
+    @staticmethod
+    def _counter(out: List[str], name: str, help_: str, names: Tuple[str, ...], table: dict) -> None:
+        out.append(f"# HELP {name} {help_}")
+        out.append(f"# TYPE {name} counter")
+        for key, v in sorted(table.items()):
+            labels = _labels(names, key if isinstance(key, tuple) else (key,))
+            out.append(f"{name}{{{labels}}} {v}" if labels else f"{name} {v}")
+
+    def render(self) -> str:
+        out: List[str] = []
+        self._histogram(out, "botnew_handler_seconds", "Update handling time, outer middleware to return.",
+                        ("handler", "state"), self.handlers)
+        self._counter(out, "botnew_handler_errors_total", "Updates whose handler raised.",
+                      ("handler", "error"), self.handler_errors)
+        self._histogram(out, "botnew_api_seconds", "Bot API call latency.", ("method",), self.api)
+        self._counter(out, "botnew_api_errors_total", "Bot API calls that raised.",
+                      ("method", "error"), self.api_errors)
+        for kind, name, help_, labels, source in self.sources:
+            (self._histogram if kind == "histogram" else self._counter)(out, name, help_, labels, source())
+        seen = set()
+        for name, label, source in self.gauges:
+            if name not in seen:
+                seen.add(name)
+                out.append(f"# TYPE {name} gauge")
+            for key, v in source().items():
+                out.append(f'{name}{{{label}="{_escape(key)}"}} {v}')
+        out.append("# TYPE botnew_process_start_time_seconds gauge")
+        out.append(f"botnew_process_start_time_seconds {self.started_at:.0f}")
+        return "\n".join(out) + "\n"
+
+
+# ---------- MIDDLEWARES ----------
+class HandlerMetrics(BaseMiddleware):
+    """Outer-middleware на dp.update. Регистрируется после FSMContextMiddleware
+    самого Dispatcher, поэтому raw_state уже в data."""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(self, handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: Dict[str, Any]) -> Any:
+        t0 = time.perf_counter()
+        result = error = ""
+        try:
+            result = await handler(event, data)
+            return result
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            # чужой callback_data без хендлера не должен плодить серии
+            label = "unhandled" if result is UNHANDLED else handler_label(event)
+            self.metrics.observe_handler(label, data.get("raw_state") or "",
+                                         (time.perf_counter() - t0) * 1000, error)
+
+
+class ApiMetrics(BaseRequestMiddleware):
+    """Request-middleware сессии Bot: каждый вызов API, включая ошибки Telegram."""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(self, make_request, bot, method):
+        t0 = time.perf_counter()
+        try:
+            response = await make_request(bot, method)
+        except Exception as e:
+            self.metrics.observe_api(method.__api_method__, (time.perf_counter() - t0) * 1000, type(e).__name__)
+            raise
+        self.metrics.observe_api(method.__api_method__, (time.perf_counter() - t0) * 1000)
+        return response
+
+
+# ---------- IPC ----------
+# polling-бот живёт в подпроцессе serve.py: отдаёт render() в unix-сокет,
+# serve.py на /metrics подключается и пересылает текст как есть
+async def serve_unix(path: str, render: Callable[[], str]) -> asyncio.AbstractServer:
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+
+    async def client(_reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            writer.write(render().encode())
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_unix_server(client, path)
+
+
+async def fetch_unix(path: str, timeout: float = 2.0) -> str:
+    async def read() -> bytes:
+        reader, writer = await asyncio.open_unix_connection(path)
+        try:
+            return await reader.read()
+        finally:
+            writer.close()
+
+    return (await asyncio.wait_for(read(), timeout)).decode()
+
+
+def merge_shards(bodies: List[str]) -> str:
+    """Выводы воркеров пула в один текст: каждой серии метка shard="i",
+    HELP/TYPE семейства — один раз, серии семейства — подряд (так требует формат)."""
+    families: Dict[str, List[str]] = {}
+    for i, body in enumerate(bodies):
+        family = ""
+        for line in body.splitlines():
+            if line.startswith("#"):
+                family = line.split()[2]
+                head = families.setdefault(family, [])
+                if line not in head:
+                    head.append(line)
+                continue
+            if not line:
+                continue
+            cut = min(p for p in (line.find("{"), line.find(" ")) if p >= 0)
+            rest = line[cut + 1:] if line[cut] == "{" else "} " + line[cut + 1:]
+            sample = f'{line[:cut]}{{shard="{i}"{"," if rest[0] != "}" else ""}{rest}'
+            families.setdefault(family or line[:cut], []).append(sample)
+    return "".join(line + "\n" for lines in families.values() for line in lines)
@@ -0,0 +1,314 @@
+# outbound.py — очередь исходящих вызовов Bot API с лимитами Telegram
+import asyncio
+import bisect
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from aiogram.exceptions import TelegramRetryAfter
+
+REPLY = 0    # ответы пользователю, который сейчас жмёт кнопки
+NOTIFY = 1   # фоновые уведомления второй стороне, истечения и т.п.
+LANES = (REPLY, NOTIFY)
+LANE_NAMES = {REPLY: "reply", NOTIFY: "notify"}
+
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def _refill(self, at: float) -> None:
+        if at > self.stamp:
+            self.tokens = min(self.burst, self.tokens + (at - self.stamp) * self.rate)
+            self.stamp = at
+
+    def wait_time(self, at: float) -> float:
+        self._refill(at)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, at: float) -> None:
+        self._refill(at)
+        self.tokens -= 1
+
+    def block(self, at: float, seconds: float) -> None:
+        # RetryAfter: следующий токен появится не раньше, чем через seconds
+        self._refill(at)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.total += 1
+        self.sum += ms
+
+    def quantile(self, q: float) -> float:
+        # верхняя граница бакета, в который попадает квантиль
+        if not self.total:
+            return 0.0
+        rank = q * self.total
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= rank:
+                return float(LATENCY_BUCKETS_MS[i]) if i < len(LATENCY_BUCKETS_MS) else float("inf")
+        return float("inf")
+
+
+class _Job:
+    __slots__ = ("chat_id", "lane", "factory", "future", "enqueued", "attempts")
+
+    def __init__(self, chat_id, lane, factory, future):
+        self.chat_id = chat_id
+        self.lane = lane
+        self.factory = factory
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+
+
+class _ChatQueue:
+    """Очередь одного чата: FIFO внутри полосы, REPLY обгоняет NOTIFY."""
+    __slots__ = ("lanes",)
+
+    def __init__(self):
+        self.lanes = tuple(deque() for _ in LANES)
+
+    def __len__(self) -> int:
+        return sum(len(q) for q in self.lanes)
+
+    def __iter__(self):
+        return itertools.chain(*self.lanes)
+
+    def push(self, job: _Job, front: bool = False) -> None:
+        if front:
+            self.lanes[job.lane].appendleft(job)
+        else:
+            self.lanes[job.lane].append(job)
+
+    def head_lane(self) -> int:
+        for lane, q in enumerate(self.lanes):
+            if q:
+                return lane
+        return LANES[-1]
+
+    def pop(self) -> _Job:
+        return self.lanes[self.head_lane()].popleft()
+
+
+class Outbound:
+    """Диспетчер исходящих сообщений.
+
+    Внутри чата порядок FIFO в пределах полосы, REPLY обгоняет NOTIFY;
+    готовые чаты тоже обслуживаются по приоритету полосы. Глобальный бакет держит общий
+    лимит (~30/с), бакет на чат — ~1/с с небольшим запасом на всплеск.
+    TelegramRetryAfter ставит чат на паузу и повторяет вызов.
+    """
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 concurrency: int = 16, max_retries: int = 3):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._buckets: Dict[Any, TokenBucket] = {}
+        self._queues: Dict[Any, _ChatQueue] = {}
+        self._busy: set = set()                                   # чаты, у которых вызов в полёте
+        self._ready: Dict[int, Deque[Any]] = {lane: deque() for lane in LANES}
+        self._sleeping: List[Tuple[float, int, Any]] = []        # (not_before, seq, chat_id)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._task: Optional[asyncio.Task] = None
+        # счётчики
+        self.enqueued = {lane: 0 for lane in LANES}
+        self.sent = {lane: 0 for lane in LANES}
+        self.failed = {lane: 0 for lane in LANES}
+        self.retried = 0
+        self.pending = 0
+        self.max_depth = 0
+        self.wait_ms = {lane: Histogram() for lane in LANES}     # ожидание в очереди
+        self.total_ms = {lane: Histogram() for lane in LANES}    # постановка -> ответ API
+
+    # --- публичное API ---
+    def depth(self, lane: Optional[int] = None) -> int:
+        if lane is None:
+            return self.pending
+        return sum(1 for q in self._queues.values() for j in q if j.lane == lane)
+
+    def submit(self, chat_id, factory: Callable[[], Awaitable[Any]], lane: int = REPLY) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        job = _Job(chat_id, lane, factory, fut)
+        q = self._queues.get(chat_id)
+        if q is None:
+            q = self._queues[chat_id] = _ChatQueue()
+        q.push(job)
+        self.enqueued[lane] += 1
+        self.pending += 1
+        self.max_depth = max(self.max_depth, self.pending)
+        if chat_id not in self._busy and (len(q) == 1 or (lane == REPLY and len(q.lanes[REPLY]) == 1)):
+            # первый вызов чата — или ответ, который должен обогнать уже
+            # стоящие в NOTIFY уведомления (дубли в _ready отсеет _run)
+            self._arm(chat_id)
+        if len(self._buckets) > 4 * 4096:
+            self._prune()
+        self._ensure_running()
+        return fut
+
+    async def call(self, chat_id, factory: Callable[[], Awaitable[Any]], lane: int = REPLY):
+        return await self.submit(chat_id, factory, lane)
+
+    def stats(self) -> dict:
+        out = {"depth": self.pending, "retried": self.retried, "max_depth": self.max_depth, "lanes": {}}
+        for lane in LANES:
+            out["lanes"][LANE_NAMES[lane]] = {
+                "depth": self.depth(lane),
+                "enqueued": self.enqueued[lane],
+                "sent": self.sent[lane],
+                "failed": self.failed[lane],
+                "wait_p50_ms": self.wait_ms[lane].quantile(0.5),
+                "wait_p99_ms": self.wait_ms[lane].quantile(0.99),
+                "total_p50_ms": self.total_ms[lane].quantile(0.5),
+                "total_p99_ms": self.total_ms[lane].quantile(0.99),
+            }
+        return out
+
+    async def drain(self) -> None:
+        while self._queues or self._busy:
+            await asyncio.sleep(0.01)
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    # --- планировщик ---
+    def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        self._wakeup.set()
+
+    def _bucket(self, chat_id) -> TokenBucket:
+        b = self._buckets.get(chat_id)
+        if b is None:
+            b = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return b
+
+    def _prune(self) -> None:
+        # бакет полностью восстановился и чат простаивает — его можно забыть
+        at = time.monotonic()
+        for chat_id, b in list(self._buckets.items()):
+            if chat_id not in self._queues and chat_id not in self._busy and b.wait_time(at) == 0 and b.tokens >= b.burst:
+                del self._buckets[chat_id]
+
+    def _arm(self, chat_id) -> None:
+        # голова очереди чата: либо сразу в готовые, либо ждать своего бакета
+        q = self._queues.get(chat_id)
+        if not q:
+            self._queues.pop(chat_id, None)
+            return
+        wait = self._bucket(chat_id).wait_time(time.monotonic())
+        if wait <= 0:
+            self._ready[q.head_lane()].append(chat_id)
+        else:
+            heapq.heappush(self._sleeping, (time.monotonic() + wait, next(self._seq), chat_id))
+        self._wakeup.set()
+
+    def _next_chat(self):
+        at = time.monotonic()
+        while self._sleeping and self._sleeping[0][0] <= at:
+            _, _, chat_id = heapq.heappop(self._sleeping)
+            q = self._queues.get(chat_id)
+            if q:
+                self._ready[q.head_lane()].append(chat_id)
+        for lane in LANES:
+            if self._ready[lane]:
+                return self._ready[lane].popleft()
+        return None
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            wait = self.global_bucket.wait_time(time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            chat_id = self._next_chat()
+            if chat_id is None:
+                timeout = self._sleeping[0][0] - time.monotonic() if self._sleeping else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if chat_id in self._busy or not self._queues.get(chat_id):
+                continue  # устаревшая запись: чат уже обслужен
+            if self._bucket(chat_id).wait_time(time.monotonic()) > 0:
+                self._arm(chat_id)
+                continue
+            await self._slots.acquire()
+            at = time.monotonic()
+            self.global_bucket.take(at)
+            self._bucket(chat_id).take(at)
+            job = self._queues[chat_id].pop()
+            self.pending -= 1
+            self._busy.add(chat_id)
+            asyncio.get_running_loop().create_task(self._deliver(job))
+
+    async def _deliver(self, job: _Job) -> None:
+        if not job.attempts:
+            self.wait_ms[job.lane].observe((time.monotonic() - job.enqueued) * 1000)
+        requeue = False
+        try:
+            job.attempts += 1
+            result = await job.factory()
+        except TelegramRetryAfter as e:
+            if job.attempts <= self.max_retries:
+                # чат на паузу, вызов — обратно в голову его очереди
+                self.retried += 1
+                self._bucket(job.chat_id).block(time.monotonic(), e.retry_after)
+                self._queues.setdefault(job.chat_id, _ChatQueue()).push(job, front=True)
+                self.pending += 1
+                requeue = True
+            else:
+                self._finish(job, exc=e)
+        except Exception as e:
+            self._finish(job, exc=e)
+        else:
+            self._finish(job, result=result)
+        finally:
+            self._slots.release()
+            self._busy.discard(job.chat_id)
+            if requeue or self._queues.get(job.chat_id):
+                self._arm(job.chat_id)
+            else:
+                self._queues.pop(job.chat_id, None)
+
+    def _finish(self, job: _Job, result=None, exc: Optional[BaseException] = None) -> None:
+        self.total_ms[job.lane].observe((time.monotonic() - job.enqueued) * 1000)
+        if exc is not None:
+            self.failed[job.lane] += 1
+            logging.debug("outbound call to %s failed: %r", job.chat_id, exc)
+            if not job.future.done():
+                job.future.set_exception(exc)
+        else:
+            self.sent[job.lane] += 1
+            if not job.future.done():
+                job.future.set_result(result)
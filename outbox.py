@@ -0,0 +1,145 @@
+# outbox.py — уведомления второй стороне сделки: пишутся вместе с переходом, доставляются пулом
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Iterable, Iterator, NamedTuple, Optional, Set
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNotFound
+
+from storage import register
+
+log = logging.getLogger("outbox")
+
+# бот заблокирован, чат не найден, кривой текст — повтор не поможет
+PERMANENT = (TelegramBadRequest, TelegramForbiddenError, TelegramNotFound)
+
+
+class Notice(NamedTuple):
+    chat_id: int
+    text: str
+    markup: Optional[dict] = None   # InlineKeyboardMarkup.model_dump(): в store — простые типы
+    panel: bool = False             # True — перерисовать панель, иначе отдельное сообщение
+    created_at: float = 0.0
+
+
+register(Notice)
+
+DeliverFn = Callable[[Notice], Awaitable[None]]
+
+
+class Outbox:
+    """Записи id -> Notice. Для Memory это ещё одна секция store ("outbox"):
+    уведомление, добавленное без await после перехода сделки, уходит в SQLite
+    той же транзакцией flush, что и сама сделка.
+
+    Доставлять можно только записанное: release() вызывает Memory.flush после
+    успешной записи (без store — сразу). run() раздаёт готовые записи задачам,
+    одновременно не больше concurrency; неудачные повторяются с растущей паузой,
+    после max_attempts или на постоянной ошибке запись снимается. Доставленная
+    запись удаляется из store следующим flush'ем — до него падение процесса
+    даст повтор (at-least-once).
+    """
+
+    def __init__(self, concurrency: int = 16, max_attempts: int = 8, backoff: float = 1.0, max_backoff: float = 300):
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pending: Dict[str, Notice] = {}
+        self.attempts: Dict[str, int] = {}
+        self._ready: Deque[str] = deque()
+        self._queued: Set[str] = set()      # в _ready, в доставке или ждут повтора
+        self._wakeup = asyncio.Event()
+        self._seq = itertools.count()
+        self.delivered = self.retried = self.dropped = 0
+
+    # --- секция Memory ---
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.pending)
+
+    def get(self, nid: str, default=None):
+        return self.pending.get(nid, default)
+
+    def __setitem__(self, nid: str, notice: Notice) -> None:
+        self.pending[nid] = notice
+
+    def add(self, notice: Notice) -> str:
+        # id растут со временем: после рестарта доставляем в порядке создания
+        nid = f"{time.time_ns():016x}{next(self._seq) & 0xffff:04x}"
+        self.pending[nid] = notice
+        return nid
+
+    def release(self, ids: Iterable[str]) -> None:
+        for nid in ids:
+            if nid in self.pending and nid not in self._queued:
+                self._queued.add(nid)
+                self._ready.append(nid)
+        self._wakeup.set()
+
+    def stats(self) -> Dict[str, int]:
+        return {"delivered": self.delivered, "retried": self.retried, "dropped": self.dropped}
+
+    async def drain(self) -> None:
+        while self._queued:
+            await asyncio.sleep(0.01)
+
+    # --- доставка ---
+    async def run(self, deliver: DeliverFn, settle: Callable[[str], None]) -> None:
+        """settle(nid) — запись снята из pending, Memory отмечает её к удалению из store."""
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks: Set[asyncio.Task] = set()
+        try:
+            while True:
+                self._wakeup.clear()
+                while self._ready:
+                    await slots.acquire()
+                    task = asyncio.create_task(self._deliver(self._ready.popleft(), deliver, settle, slots))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                await self._wakeup.wait()
+        finally:
+            # недоставленное остаётся в pending и store — придёт после рестарта
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _deliver(self, nid: str, deliver: DeliverFn, settle: Callable[[str], None],
+                       slots: asyncio.Semaphore) -> None:
+        try:
+            notice = self.pending.get(nid)
+            if notice is None:
+                self._queued.discard(nid)
+                return
+            try:
+                await deliver(notice)
+            except Exception as e:
+                attempt = self.attempts.get(nid, 0) + 1
+                if isinstance(e, PERMANENT) or attempt >= self.max_attempts:
+                    log.warning("notice to %s dropped after %d attempts: %r", notice.chat_id, attempt, e)
+                    self.dropped += 1
+                    self._settle(nid, settle)
+                    return
+                self.attempts[nid] = attempt
+                self.retried += 1
+                delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+                asyncio.get_running_loop().call_later(delay, self._retry, nid)
+                return
+            self.delivered += 1
+            self._settle(nid, settle)
+        finally:
+            slots.release()
+
+    def _retry(self, nid: str) -> None:
+        self._ready.append(nid)
+        self._wakeup.set()
+
+    def _settle(self, nid: str, settle: Callable[[str], None]) -> None:
+        self.pending.pop(nid, None)
+        self.attempts.pop(nid, None)
+        self._queued.discard(nid)
+        settle(nid)
@@ -0,0 +1,84 @@
+# panels.py — склейка частых перерисовок панели одного чата
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# apply(chat_id, text, reply_markup, lane) -> True, если ушёл вызов API,
+# False — если панель уже показывает ровно это (no-op)
+ApplyFn = Callable[[int, str, Any, int], Awaitable[bool]]
+
+
+class _Chat:
+    __slots__ = ("pending", "waiters", "task")
+
+    def __init__(self):
+        self.pending: Optional[Tuple[str, Any, int]] = None
+        self.waiters: List[asyncio.Future] = []
+        self.task: Optional[asyncio.Task] = None
+
+
+class PanelCoalescer:
+    """Первая перерисовка уходит сразу; всё, что пришло за window секунд
+    после неё, схлопывается в одну — с последним текстом и клавиатурой.
+    Каждый вызов render() ждёт, пока его содержимое (или более новое) покажут.
+    """
+
+    def __init__(self, apply: ApplyFn, window: float):
+        self.apply = apply
+        self.window = window
+        self._chats: Dict[int, _Chat] = {}
+        self.renders = 0     # вызовов render()
+        self.coalesced = 0   # перерисовок, поглощённых более новой
+        self.skipped = 0     # no-op: панель уже такая
+        self.applied = 0     # реально ушло в API
+
+    def stats(self) -> dict:
+        return {"renders": self.renders, "applied": self.applied, "coalesced": self.coalesced, "skipped": self.skipped}
+
+    async def render(self, chat_id: int, text: str, reply_markup: Any, lane: int) -> None:
+        self.renders += 1
+        st = self._chats.get(chat_id)
+        if st is None:
+            st = self._chats[chat_id] = _Chat()
+        if st.pending is not None:
+            self.coalesced += 1
+            lane = min(lane, st.pending[2])  # ответ пользователю не уступает уведомлению
+        st.pending = (text, reply_markup, lane)
+        fut = asyncio.get_running_loop().create_future()
+        st.waiters.append(fut)
+        if st.task is None:
+            st.task = asyncio.get_running_loop().create_task(self._drain(chat_id, st))
+        await fut
+
+    async def _drain(self, chat_id: int, st: _Chat) -> None:
+        try:
+            while st.pending is not None:
+                text, reply_markup, lane = st.pending
+                st.pending = None
+                waiters, st.waiters = st.waiters, []
+                try:
+                    sent = await self.apply(chat_id, text, reply_markup, lane)
+                except Exception as e:
+                    for w in waiters:
+                        if not w.done():
+                            w.set_exception(e)
+                else:
+                    if sent:
+                        self.applied += 1
+                    else:
+                        self.skipped += 1
+                    for w in waiters:
+                        if not w.done():
+                            w.set_result(None)
+                if self.window > 0:
+                    # окно склейки: всё, что придёт за это время, уйдёт одним вызовом
+                    await asyncio.sleep(self.window)
+        finally:
+            st.task = None
+            if st.pending is not None:
+                # задачу отменили посреди окна — ждущих не оставляем висеть
+                for w in st.waiters:
+                    w.cancel()
+                st.waiters = []
+                st.pending = None
+            if self._chats.get(chat_id) is st:
+                del self._chats[chat_id]
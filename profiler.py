@@ -0,0 +1,163 @@
+# profiler.py — выборочный семплирующий профайлер хендлеров (collapsed stacks)
+import asyncio
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+
+log = logging.getLogger("profiler")
+
+OTHER = "[other]"   # стеки сверх лимита на хендлер
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Профилирует долю rate апдейтов: пока выбранный апдейт исполняется на
+    event loop'е, фоновый поток раз в interval секунд снимает стек потока
+    loop'а и копит его под именем хендлера. Видно только on-CPU время —
+    ожидание сети в стеки не попадает, а блокировки loop'а попадают.
+
+    Раз в flush_every секунд тот же поток переписывает <out_dir>/<handler>.folded
+    (формат flamegraph.pl / speedscope: "f1;f2;f3 count"). Размер вывода
+    ограничен max_stacks различных стеков на хендлер и max_depth кадров;
+    время, которое поток держит GIL, — долей max_overhead: при превышении
+    интервал семплирования удваивается.
+    """
+
+    def __init__(self, out_dir: str, rate: float = 0.05, interval: float = 0.005, flush_every: float = 60,
+                 max_stacks: int = 2000, max_depth: int = 64, max_overhead: float = 0.01):
+        self.out_dir = out_dir
+        self.rate = rate
+        self.base_interval = interval
+        self.interval = interval
+        self.flush_every = flush_every
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self.max_overhead = max_overhead
+        self.active: Dict[asyncio.Task, str] = {}             # задача выбранного апдейта -> хендлер
+        self.stacks: Dict[str, Dict[str, int]] = {}           # хендлер -> collapsed stack -> семплы
+        self.samples = 0
+        self.profiled = 0                                     # выбранных апдейтов
+        self.spent = 0.0                                      # секунд в семплировании
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        # вызывается с event loop'а, который будем профилировать
+        if self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stop = threading.Event()   # своё на каждый запуск: старый поток мог ещё не выйти
+        self.interval = self.base_interval
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), name="profiler", daemon=True)
+        self._thread.start()
+        log.info("profiler on: rate=%s interval=%.1fms dir=%s", self.rate, self.interval * 1000, self.out_dir)
+
+    def stop(self) -> None:
+        thread, stop, self._thread = self._thread, self._stop, None
+        if thread is None:
+            return
+        stop.set()
+        thread.join()
+        self.active.clear()
+        log.info("profiler off: %d samples over %d updates", self.samples, self.profiled)
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "rate": self.rate, "interval_ms": self.interval * 1000,
+                "profiled": self.profiled, "samples": self.samples, "handlers": len(self.stacks),
+                "out_dir": self.out_dir}
+
+    # --- поток семплера ---
+    def _run(self, stop: threading.Event) -> None:
+        window_start, window_spent = time.perf_counter(), 0.0
+        last_flush = time.monotonic()
+        while not stop.wait(self.interval):
+            if self.active:
+                t0 = time.perf_counter()
+                self._sample()
+                took = time.perf_counter() - t0
+                window_spent += took
+                self.spent += took
+            now = time.perf_counter()
+            if now - window_start >= 1.0:
+                share = window_spent / (now - window_start)
+                if share > self.max_overhead:
+                    self.interval = min(self.interval * 2, 1.0)
+                elif share < self.max_overhead / 4 and self.interval > self.base_interval:
+                    self.interval = max(self.interval / 2, self.base_interval)
+                window_start, window_spent = now, 0.0
+            if time.monotonic() - last_flush >= self.flush_every:
+                self._flush()
+                last_flush = time.monotonic()
+        self._flush()
+
+    def _sample(self) -> None:
+        task = asyncio.current_task(self._loop)
+        handler = self.active.get(task) if task is not None else None
+        frame = sys._current_frames().get(self._loop_thread)
+        if handler is None or frame is None:
+            return
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            names.append(_frame_name(frame.f_code))
+            frame = frame.f_back
+        names.reverse()
+        stack = ";".join(names)
+        table = self.stacks.setdefault(handler, {})
+        if stack not in table and len(table) >= self.max_stacks:
+            stack = OTHER
+        table[stack] = table.get(stack, 0) + 1
+        self.samples += 1
+
+    def _flush(self) -> None:
+        if not self.stacks or not self.out_dir:
+            return
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            for handler, table in list(self.stacks.items()):
+                path = os.path.join(self.out_dir, f"{handler}.folded")
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    for stack, count in list(table.items()):
+                        f.write(f"{stack} {count}\n")
+                os.replace(path + ".tmp", path)
+        except OSError:
+            log.exception("profiler flush failed")
+
+    # --- middleware ---
+    def sampled(self) -> bool:
+        return self._thread is not None and random.random() < self.rate
+
+
+class ProfileMiddleware(BaseMiddleware):
+    """Inner-middleware на observers dp: здесь уже известен хендлер
+    (data["handler"]), имя его функции и становится именем профиля."""
+
+    def __init__(self, profiler: SamplingProfiler):
+        self.profiler = profiler
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+                       event: Any, data: Dict[str, Any]) -> Any:
+        if not self.profiler.sampled():
+            return await handler(event, data)
+        task = asyncio.current_task()
+        self.profiler.active[task] = data["handler"].callback.__name__
+        self.profiler.profiled += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.profiler.active.pop(task, None)
@@ -0,0 +1,283 @@
+# redisstore.py — общий store на Redis (RESP2): несколько инстансов бота с одним токеном
+import logging
+import secrets
+import socket
+import threading
+import time
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from storage import Row, Store, decode_json, encode_json
+
+
+class RedisError(Exception):
+    pass
+
+
+def pack(args: Sequence) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for a in args:
+        if not isinstance(a, bytes):
+            a = str(a).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(a), a))
+    return b"".join(out)
+
+
+def read_reply(f):
+    # ошибка сервера возвращается значением: в пачке остальные ответы ещё надо дочитать
+    line = f.readline()
+    if not line:
+        raise ConnectionError("redis closed the connection")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest
+    if kind == b"-":
+        return RedisError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        n = int(rest)
+        return None if n < 0 else f.read(n + 2)[:-2]
+    if kind == b"*":
+        n = int(rest)
+        return None if n < 0 else [read_reply(f) for _ in range(n)]
+    raise RedisError(f"bad reply {line!r}")
+
+
+def check(replies: list) -> list:
+    for r in replies:
+        if isinstance(r, RedisError):
+            raise r
+        if isinstance(r, list):
+            check(r)
+    return replies
+
+
+class Connection:
+    """Одно блокирующее соединение; команды пачки уходят одним sendall,
+    ответы читаются по порядку. Потокобезопасность — на вызывающем.
+    Разрыв закрывает сокет, следующий вызов подключится заново."""
+
+    def __init__(self, host: str, port: int, db: int = 0, password: Optional[str] = None,
+                 timeout: Optional[float] = 5.0):
+        self.addr = (host, port)
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.sock: Optional[socket.socket] = None
+        self.file = None
+
+    def _connect(self) -> None:
+        sock = socket.create_connection(self.addr, self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.timeout)
+        self.sock, self.file = sock, sock.makefile("rb")
+        hello = ([("AUTH", self.password)] if self.password else []) + ([("SELECT", self.db)] if self.db else [])
+        if hello:
+            check(self.pipeline(hello))
+
+    def pipeline(self, cmds: Sequence[Sequence]) -> list:
+        if self.sock is None:
+            self._connect()
+        try:
+            self.sock.sendall(b"".join(pack(c) for c in cmds))
+            return [read_reply(self.file) for _ in cmds]
+        except (OSError, ConnectionError):
+            self.close()
+            raise
+
+    def call(self, *args):
+        return check(self.pipeline([args]))[0]
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.file.close()
+            self.sock.close()
+            self.sock = self.file = None
+
+
+class RedisStore(Store):
+    """STORE_PATH=redis://[:password@]host[:port][/db][?prefix=botnew].
+
+    Ключ — {prefix}:{section}:{key}, состав секции — SET {prefix}:{section}
+    (его читает load при старте). Каждая пачка write() публикует в канал
+    {prefix}:inv строки «section<TAB>key»: остальные инстансы через listen()
+    перечитывают эти ключи в свою Memory. Это и есть near-cache — чтения
+    хендлеров идут из памяти, в сеть уходит только запись.
+
+    local — секции одного инстанса (очередь outbox, журнал, meta шарда):
+    лежат под {prefix}:{node}:..., инвалидаций не шлют. versioned — значения
+    с .version (сделки): пишутся только поверх более старой версии
+    (WATCH/MULTI/EXEC), удаление оставляет надгробие, чтобы запоздалый flush
+    другого инстанса не воскресил сделку. Проигравшая запись приходит в
+    listen() как чужое изменение — Memory перечитает победителя.
+
+    Значения — JSON (storage.encode_json), не pickle: иначе любой, кто может
+    писать в этот Redis, выполнил бы свой код во всех инстансах.
+    """
+    persistent = True
+    shared = True
+    encode = staticmethod(encode_json)
+    decode = staticmethod(decode_json)
+    local = ("outbox", "chatlog", "meta")
+    versioned = ("deals",)
+    TOMBSTONE_MS = 24 * 3600 * 1000
+    BATCH = 1000   # ключей в одном MGET
+
+    def __init__(self, url: str, node: str = ""):
+        u = urlsplit(url)
+        self.addr = (u.hostname or "127.0.0.1", u.port or 6379, int(u.path.strip("/") or 0), u.password)
+        self.prefix = parse_qs(u.query).get("prefix", ["botnew"])[0]
+        self.node = node or socket.gethostname()
+        self.origin = secrets.token_hex(4).encode()   # свои инвалидации слушатель пропускает
+        self.channel = f"{self.prefix}:inv"
+        # write()/cas() идут из to_thread — под lock; get() с event loop'а — своим
+        # соединением, чтобы не ждать чужой транзакции
+        self.conn = Connection(*self.addr)
+        self.lock = threading.Lock()
+        self.reader = Connection(*self.addr)
+        self.read_lock = threading.Lock()
+        self.on_change: Optional[Callable[[str, str], None]] = None
+        self.listener: Optional[Connection] = None
+        self.subscribed = threading.Event()
+        self.closed = False
+        self.conflicts = 0
+        self.conn.call("PING")   # недоступный store — ошибка на старте, а не на первом flush
+
+    # --- ключи ---
+    def _index(self, section: str) -> str:
+        return f"{self.prefix}:{self.node}:{section}" if section in self.local else f"{self.prefix}:{section}"
+
+    def _k(self, section: str, key: str) -> str:
+        return f"{self._index(section)}:{key}"
+
+    def _put(self, section: str, key: str, blob: Optional[bytes]) -> List[tuple]:
+        k, index = self._k(section, key), self._index(section)
+        if blob is not None:
+            return [("SET", k, blob), ("SADD", index, key)]
+        if section in self.versioned:
+            return [("SET", k, b"", "PX", self.TOMBSTONE_MS), ("SREM", index, key)]
+        return [("DEL", k), ("SREM", index, key)]
+
+    def _publish(self, keys: Iterable[str]) -> tuple:
+        return ("PUBLISH", self.channel, self.origin + b"\n" + "\n".join(keys).encode())
+
+    # --- Store ---
+    def load(self, section: str) -> Iterator[Tuple[str, object]]:
+        with self.lock:
+            keys = [k.decode() for k in self.conn.call("SMEMBERS", self._index(section))]
+        for i in range(0, len(keys), self.BATCH):
+            chunk = keys[i:i + self.BATCH]
+            with self.lock:
+                blobs = self.conn.call("MGET", *(self._k(section, k) for k in chunk))
+            for key, blob in zip(chunk, blobs):
+                if blob:   # b"" — надгробие
+                    yield key, self.decode(blob)
+
+    def get(self, section: str, key: str) -> Optional[object]:
+        with self.read_lock:
+            blob = self.reader.call("GET", self._k(section, key))
+        return self.decode(blob) if blob else None
+
+    def mget(self, keys: Sequence[Tuple[str, str]]) -> List[Optional[object]]:
+        out = []
+        for i in range(0, len(keys), self.BATCH):
+            chunk = keys[i:i + self.BATCH]
+            with self.read_lock:
+                blobs = self.reader.call("MGET", *(self._k(s, k) for s, k in chunk))
+            out += [self.decode(b) if b else None for b in blobs]
+        return out
+
+    def write(self, rows: Iterable[Row]) -> None:
+        cmds, changed, versioned = [], [], []
+        for section, key, blob in rows:
+            if section in self.versioned:
+                versioned.append((section, key, blob))
+                continue
+            cmds += self._put(section, key, blob)
+            if section not in self.local:
+                changed.append(f"{section}\t{key}")
+        if changed:
+            cmds.append(self._publish(changed))
+        with self.lock:
+            if cmds:
+                check(self.conn.pipeline(cmds))
+            for section, key, blob in versioned:
+                self._write_versioned(section, key, blob)
+
+    def _write_versioned(self, section: str, key: str, blob: Optional[bytes]) -> None:
+        version = None if blob is None else self.decode(blob).version
+
+        def older(cur: Optional[bytes]) -> bool:
+            if blob is None or cur is None:
+                return True   # удаление безусловно; ключа ещё не было
+            return cur != b"" and self.decode(cur).version < version
+
+        if self._cas(section, key, older, blob):
+            return
+        with self.read_lock:
+            cur = self.reader.call("GET", self._k(section, key))
+        if cur == blob:
+            return   # этот же переход уже записал cas()
+        self.conflicts += 1
+        logging.warning("store: %s %s v%s lost to a newer write from another instance", section, key, version)
+        if self.on_change is not None:
+            self.on_change(section, key)
+
+    def _cas(self, section: str, key: str, ok: Callable[[Optional[bytes]], bool], blob: Optional[bytes]) -> bool:
+        k = self._k(section, key)
+        self.conn.call("WATCH", k)
+        if not ok(self.conn.call("GET", k)):
+            self.conn.call("UNWATCH")
+            return False
+        cmds = [("MULTI",), *self._put(section, key, blob), self._publish([f"{section}\t{key}"]), ("EXEC",)]
+        return check(self.conn.pipeline(cmds))[-1] is not None   # nil — ключ поменяли после WATCH
+
+    def cas(self, section: str, key: str, ok: Callable[[Optional[object]], bool], blob: bytes) -> bool:
+        """Записать blob, только если ok(текущее значение) и никто не записал ключ между чтением и записью."""
+        with self.lock:
+            return self._cas(section, key, lambda cur: ok(self.decode(cur) if cur else None), blob)
+
+    # --- инвалидации ---
+    def listen(self, on_change: Callable[[str, str], None]) -> None:
+        """on_change(section, key) на каждое чужое изменение — из своего потока.
+        После переподключения — on_change("*", ""): что-то могло пройти мимо."""
+        self.on_change = on_change
+        threading.Thread(target=self._listen, name="store-invalidations", daemon=True).start()
+        self.subscribed.wait(5)   # подписка раньше load(): изменения во время загрузки не пропадут
+
+    def _listen(self) -> None:
+        resubscribe = False
+        while not self.closed:
+            self.listener = conn = Connection(*self.addr, timeout=None)
+            try:
+                check(conn.pipeline([("SUBSCRIBE", self.channel)]))
+                self.subscribed.set()
+                if resubscribe:
+                    self.on_change("*", "")
+                resubscribe = True
+                while True:
+                    msg = read_reply(conn.file)
+                    if msg[0] != b"message":
+                        continue
+                    origin, _, body = msg[2].partition(b"\n")
+                    if origin == self.origin:
+                        continue
+                    for line in body.decode().split("\n"):
+                        section, _, key = line.partition("\t")
+                        self.on_change(section, key)
+            except (OSError, ConnectionError, RedisError) as e:
+                if self.closed:
+                    return
+                logging.warning("store: invalidation channel lost: %r", e)
+                conn.close()
+                time.sleep(1)
+
+    def close(self) -> None:
+        self.closed = True
+        if self.listener is not None and self.listener.sock is not None:
+            self.listener.sock.shutdown(socket.SHUT_RDWR)   # разбудить поток в read_reply
+        with self.read_lock:
+            self.reader.close()
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,100 @@
+# scheduler.py — дедлайны сделок в куче вместо опроса всех сделок по таймеру
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+Key = Tuple[Hashable, str]  # (deal_id, kind), kind: "expires_at" | "seller_deadline"
+
+_WHEN, _SEQ, _KEY, _ALIVE = range(4)
+
+
+class DeadlineScheduler:
+    """Мин-куча (when, seq, key) с ленивым удалением.
+
+    schedule/cancel — O(log n), run() спит ровно до ближайшего дедлайна и
+    просыпается раньше, если новый дедлайн оказался первым в очереди.
+    """
+
+    def __init__(self):
+        self._heap: List[list] = []
+        self._entries: Dict[Key, list] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Key) -> bool:
+        return key in self._entries
+
+    def schedule(self, deal_id: Hashable, kind: str, when) -> None:
+        if isinstance(when, datetime):
+            when = when.timestamp()
+        key = (deal_id, kind)
+        old = self._entries.get(key)
+        if old is not None:
+            if old[_WHEN] == when:
+                return
+            old[_ALIVE] = False
+        entry = [when, next(self._seq), key, True]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._wakeup.set()
+        self._compact()
+
+    def cancel(self, deal_id: Hashable, kind: Optional[str] = None) -> None:
+        kinds = (kind,) if kind else ("expires_at", "seller_deadline")
+        removed = False
+        for k in kinds:
+            entry = self._entries.pop((deal_id, k), None)
+            if entry is not None:
+                entry[_ALIVE] = False
+                removed = True
+        if removed:
+            self._compact()
+
+    def _compact(self) -> None:
+        # мёртвых записей больше половины — перестраиваем кучу, чтобы не росла
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._entries):
+            self._heap = [e for e in self._heap if e[_ALIVE]]
+            heapq.heapify(self._heap)
+
+    def next_deadline(self) -> Optional[float]:
+        heap = self._heap
+        while heap and not heap[0][_ALIVE]:
+            heapq.heappop(heap)
+        return heap[0][_WHEN] if heap else None
+
+    def pop_due(self, at: float) -> List[Key]:
+        due = []
+        heap = self._heap
+        while heap and (not heap[0][_ALIVE] or heap[0][_WHEN] <= at):
+            entry = heapq.heappop(heap)
+            if entry[_ALIVE]:
+                del self._entries[entry[_KEY]]
+                due.append(entry[_KEY])
+        return due
+
+    async def run(self, fire: Callable[[Hashable, str], Awaitable[None]]) -> None:
+        while True:
+            self._wakeup.clear()
+            when = self.next_deadline()
+            if when is None:
+                await self._wakeup.wait()
+                continue
+            delay = when - time.time()
+            if delay > 0:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                continue
+            for deal_id, kind in self.pop_due(time.time()):
+                try:
+                    await fire(deal_id, kind)
+                except Exception:
+                    logging.exception("deadline handler failed: %s %s", deal_id, kind)
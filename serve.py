@@ -1,42 +1,261 @@
 # serve.py
 import os
 import sys
+import json
+import time
 import asyncio
+import logging
 import signal
+import hashlib
+import hmac
 import contextlib
+from collections import deque
+from typing import List
+import aiohttp
 from aiohttp import web
 
 PORT = int(os.environ.get("PORT", "10000"))
 BOT_ENTRY = os.environ.get("BOT_ENTRY", "bot.py")  # можно переопределить, но по умолчанию bot.py
 
+# webhook: один процесс, Dispatcher на этом же aiohttp-приложении;
+# polling: как раньше — bot.py отдельным подпроцессом (запасной режим)
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")                      # публичный https://host, путь добавим сами
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram/webhook")
+BOT_MODE = os.environ.get("BOT_MODE") or ("webhook" if WEBHOOK_URL else "polling")
+UPDATE_QUEUE = int(os.environ.get("UPDATE_QUEUE", "1000"))
+# polling: подпроцесс отдаёт свои метрики в этот unix-сокет, /metrics их пересылает
+METRICS_SOCKET = os.environ.get("METRICS_SOCKET") or f"/tmp/botnew-metrics-{os.getpid()}.sock"
+# BOT_WORKERS > 1: пул bot.py-шардов (shard.py); getUpdates/вебхук принимает serve.py
+# и раскладывает апдейты по шардам через unix-сокет. Число шардов не меняют на живых
+# данных: у каждого свой STORE_PATH.<i>, и шард откажется стартовать с чужим.
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", "1"))
+SHARD_SOCKET = os.environ.get("SHARD_SOCKET") or f"/tmp/botnew-shards-{os.getpid()}.sock"
+SHARD_WINDOW = int(os.environ.get("SHARD_WINDOW", "64"))   # апдейтов в воркере без "done"
+BOT_TOKEN = os.environ.get("BOT_TOKEN", "")
+# без явного WEBHOOK_SECRET — производный от токена: одинаковый во всех процессах
+# и инстансах за одним вебхуком, кто бы из них ни вызвал set_webhook последним
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or hmac.new(
+    BOT_TOKEN.encode(), b"botnew webhook secret", hashlib.sha256).hexdigest()
+API_BASE = (os.environ.get("TELEGRAM_API_URL") or "https://api.telegram.org").rstrip("/")
+POLL_TIMEOUT = 25
+UPDATE_TYPES = ["message", "callback_query", "inline_query"]  # = dp.resolve_used_update_types() бота
+
+RESTART_WINDOW = 300   # сколько рестартов за это окно считаем crash-loop'ом
+RESTART_LIMIT = 3
+
+def worker_slot() -> dict:
+    return {
+        "proc": None,            # текущий подпроцесс бота
+        "restarts": deque(),     # время каждого рестарта
+    }
+
+state = {
+    "mode": BOT_MODE,
+    "started_at": time.time(),
+    "workers": [],           # polling/пул: worker_slot() на каждый подпроцесс
+    "ingest": None,          # webhook: WebhookIngest
+    "pool": None,            # пул: ShardPool
+}
+
+def worker_info(slot: dict) -> tuple:
+    now = time.time()
+    restarts = slot["restarts"]
+    while restarts and now - restarts[0] > RESTART_WINDOW:
+        restarts.popleft()
+    proc = slot["proc"]
+    running = proc is not None and proc.returncode is None
+    info = {"running": running, "pid": proc.pid if proc else None, "restarts_recent": len(restarts)}
+    return running and len(restarts) < RESTART_LIMIT, info
+
+def liveness() -> tuple:
+    pool = state["pool"]
+    if pool is not None:
+        workers = []
+        for slot, link in zip(state["workers"], pool.health()):
+            ok, info = worker_info(slot)
+            workers.append({**link, **info, "ok": ok and link["connected"]})
+        info = {"mode": state["mode"], "workers": workers, "dropped": pool.dropped,
+                "restarts_recent": sum(w["restarts_recent"] for w in workers)}
+        return all(w["ok"] for w in workers), info
+    if state["mode"] == "webhook":
+        import bot as botmod
+        ingest = state["ingest"]
+        info = {"mode": "webhook", **(ingest.health() if ingest else {})}
+        ok = bool(ingest and ingest.alive() and botmod.background_alive())
+        return ok, info
+    ok, info = worker_info(state["workers"][0])
+    return ok, {"mode": "polling", **info}
+
 async def health(_):
-    return web.Response(text="ok")
+    ok, info = liveness()
+    info["status"] = "ok" if ok else "down"
+    return web.json_response(info, status=200 if ok else 503)
 
-async def start_http():
-    app = web.Application()
+async def metrics_view(_):
+    from metrics import CONTENT_TYPE, fetch_unix
+    ok, info = liveness()
+    head = (f"# TYPE botnew_up gauge\nbotnew_up {int(ok)}\n"
+            f"# TYPE botnew_supervisor_restarts_recent gauge\n"
+            f"botnew_supervisor_restarts_recent {info.get('restarts_recent', 0)}\n")
+    if state["pool"] is not None:
+        from metrics import merge_shards
+        bodies = await asyncio.gather(*(fetch_unix(f"{METRICS_SOCKET}.{i}") for i in range(BOT_WORKERS)),
+                                      return_exceptions=True)
+        body = state["pool"].render() + merge_shards([b if isinstance(b, str) else "" for b in bodies])
+    elif state["mode"] == "webhook":
+        import bot as botmod
+        body = botmod.metrics.render()
+    else:
+        try:
+            body = await fetch_unix(METRICS_SOCKET)
+        except (OSError, asyncio.TimeoutError):
+            body = ""  # бот перезапускается — отдаём хотя бы botnew_up 0
+    return web.Response(body=(head + body).encode(), headers={"Content-Type": CONTENT_TYPE})
+
+async def start_http(app: web.Application):
     app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics_view)
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(runner, "0.0.0.0", PORT)
     await site.start()
     # держим HTTP-сервер живым
-    while True:
-        await asyncio.sleep(3600)
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await runner.cleanup()
 
-async def run_bot_forever():
+async def run_bot_forever(slot: dict, env: dict):
+    # у каждого воркера свой backoff: падающий шард не тормозит рестарты остальных
     backoff = 1
     while True:
         try:
-            proc = await asyncio.create_subprocess_exec(sys.executable, BOT_ENTRY)
+            proc = await asyncio.create_subprocess_exec(sys.executable, BOT_ENTRY, env=env)
+            slot["proc"] = proc
+            started = time.time()
             rc = await proc.wait()
+            # проработал долго — это не crash-loop, начинаем backoff заново
+            if time.time() - started > RESTART_WINDOW:
+                backoff = 1
+            slot["restarts"].append(time.time())
             # если бот завершился — подождём чуть-чуть и перезапустим
             await asyncio.sleep(min(backoff, 30))
             backoff = min(backoff * 2, 30)
+        except asyncio.CancelledError:
+            proc = slot["proc"]
+            if proc is not None and proc.returncode is None:
+                proc.terminate()
+                with contextlib.suppress(Exception):
+                    await asyncio.wait_for(proc.wait(), 10)
+            raise
         except Exception:
             # на случай редких ошибок при запуске — тоже подождать и снова попробовать
+            slot["restarts"].append(time.time())
             await asyncio.sleep(min(backoff, 30))
             backoff = min(backoff * 2, 30)
 
+def worker_env(i: int) -> dict:
+    # пути к store/снимку/метрикам bot.py сам дополняет ".<i>"
+    return {**os.environ, "METRICS_SOCKET": METRICS_SOCKET, "SHARD_INDEX": str(i),
+            "SHARD_COUNT": str(BOT_WORKERS), "SHARD_SOCKET": SHARD_SOCKET}
+
+# ---------- пул шардов: приём апдейтов ----------
+async def bot_api(http: aiohttp.ClientSession, method: str, **params):
+    # формой, как AiohttpSession aiogram; сложные значения — JSON-строкой
+    data = {k: v if isinstance(v, str) else json.dumps(v) for k, v in params.items()}
+    async with http.post(f"{API_BASE}/bot{BOT_TOKEN}/{method}", data=data) as resp:
+        body = await resp.json(content_type=None)
+    if not body.get("ok"):
+        raise RuntimeError(f"{method}: {body.get('description')}")
+    return body["result"]
+
+async def poll_updates(pool):
+    # getUpdates один на весь пул: Telegram не раздаёт апдейты двум читателям
+    offset, backoff = 0, 1
+    timeout = aiohttp.ClientTimeout(total=POLL_TIMEOUT + 10)
+    async with aiohttp.ClientSession(timeout=timeout) as http:
+        while True:
+            try:
+                if not offset:
+                    await bot_api(http, "deleteWebhook", drop_pending_updates=False)
+                updates = await bot_api(http, "getUpdates", offset=offset, timeout=POLL_TIMEOUT,
+                                        allowed_updates=UPDATE_TYPES)
+                backoff = 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("getUpdates failed")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+            for update in updates:
+                offset = update["update_id"] + 1
+                # лежащий шард не должен останавливать чтение для остальных
+                await pool.route(update, block=False)
+
+def sharded_webhook(pool):
+    from webhook import SECRET_HEADER
+
+    async def handle(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), WEBHOOK_SECRET):
+            return web.Response(status=401)
+        raw = await request.read()
+        try:
+            update = json.loads(raw)
+        except ValueError:
+            return web.Response(status=400)
+        await pool.route(update, raw)  # полная очередь шарда держит ответ — backpressure для Telegram
+        return web.Response()
+
+    return handle
+
+async def setup_pool(app: web.Application) -> List[asyncio.Task]:
+    from shard import ShardPool
+
+    pool = ShardPool(BOT_WORKERS, SHARD_SOCKET, queue_size=UPDATE_QUEUE, window=SHARD_WINDOW)
+    await pool.start()
+    state["pool"] = pool
+    tasks = []
+    for i in range(BOT_WORKERS):
+        slot = worker_slot()
+        state["workers"].append(slot)
+        tasks.append(asyncio.create_task(run_bot_forever(slot, worker_env(i))))
+    if BOT_MODE == "webhook":
+        app.router.add_post(WEBHOOK_PATH, sharded_webhook(pool))
+        if WEBHOOK_URL:
+            async with aiohttp.ClientSession() as http:
+                await bot_api(http, "setWebhook", url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                              secret_token=WEBHOOK_SECRET, allowed_updates=UPDATE_TYPES)
+    else:
+        # первой отменяется при остановке: новые апдейты перестают приходить раньше, чем гаснут шарды
+        tasks.insert(0, asyncio.create_task(poll_updates(pool)))
+    return tasks
+
+async def setup_webhook(app: web.Application):
+    import bot as botmod
+    from webhook import WebhookIngest
+
+    ingest = WebhookIngest(botmod.dp, botmod.bot, WEBHOOK_SECRET,
+                           concurrency=botmod.UPDATE_CONCURRENCY, queue_size=UPDATE_QUEUE)
+    app.router.add_post(WEBHOOK_PATH, ingest.handle)
+    state["ingest"] = ingest
+    await botmod.on_startup()
+    ingest.start()
+    if WEBHOOK_URL:
+        await botmod.bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=botmod.dp.resolve_used_update_types(),
+        )
+    return ingest
+
+async def teardown_webhook(ingest):
+    import bot as botmod
+    await ingest.stop()
+    await botmod.on_shutdown()
+    await botmod.bot.session.close()
+
 async def main():
     stop = asyncio.Event()
     loop = asyncio.get_running_loop()
@@ -44,16 +263,30 @@ async def main():
         with contextlib.suppress(NotImplementedError):
             loop.add_signal_handler(sig, stop.set)
 
-    t_http = asyncio.create_task(start_http())
-    t_bot = asyncio.create_task(run_bot_forever())
+    app = web.Application()
+    ingest = None
+    tasks = []
+    if BOT_WORKERS > 1:
+        tasks += await setup_pool(app)
+    elif BOT_MODE == "webhook":
+        ingest = await setup_webhook(app)
+    else:
+        slot = worker_slot()
+        state["workers"].append(slot)
+        tasks.append(asyncio.create_task(run_bot_forever(slot, {**os.environ, "METRICS_SOCKET": METRICS_SOCKET})))
+    tasks.append(asyncio.create_task(start_http(app)))
 
     await stop.wait()
 
     # аккуратно останавливаемся
-    for t in (t_http, t_bot):
+    for t in tasks:
         t.cancel()
     with contextlib.suppress(asyncio.CancelledError):
-        await asyncio.gather(t_http, t_bot)
+        await asyncio.gather(*tasks)
+    if ingest is not None:
+        await teardown_webhook(ingest)
+    if state["pool"] is not None:
+        await state["pool"].stop()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,181 @@
+# session.py — сессия Bot API: пул соединений, повторы временных ошибок, предохранитель
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from aiohttp import ClientConnectorError
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import (
+    ClientDecodeError, TelegramEntityTooLarge, TelegramNetworkError, TelegramRetryAfter, TelegramServerError,
+)
+
+from outbound import Histogram
+
+log = logging.getLogger("session")
+
+# уборка чата (старые панели, повторный /start, ввод пользователя): когда API
+# деградирует, её не шлём вовсе — запросы нужнее ответам и уведомлениям
+LOW_PRIORITY = frozenset({"deleteMessage", "deleteMessages"})
+# у long polling свой цикл повторов с паузой
+NO_RETRY = frozenset({"getUpdates"})
+UNSAFE_PREFIXES = ("send", "copy", "forward")
+
+
+def classify(e: Exception) -> str:
+    """Временная ошибка: "retry_after", "server", "network"; "" — постоянная
+    (400/403/404, слишком большой файл), повтор не поможет."""
+    if isinstance(e, TelegramRetryAfter):
+        return "retry_after"
+    if isinstance(e, TelegramServerError):
+        return "server"
+    if isinstance(e, TelegramEntityTooLarge):
+        return ""
+    # 502 от прокси — HTML вместо JSON: как обрыв, до Telegram запрос мог и дойти
+    if isinstance(e, TelegramNetworkError) or (isinstance(e, ClientDecodeError) and isinstance(e.data, str)):
+        return "network"
+    return ""
+
+
+def repeatable(method: str, reason: str, e: Exception) -> bool:
+    # таймаут или обрыв на send*: сообщение могло уйти, повтор его задвоит;
+    # не открылось соединение — запрос точно не ушёл
+    if reason != "network" or not method.startswith(UNSAFE_PREFIXES):
+        return True
+    return isinstance(e.__cause__, ClientConnectorError)
+
+
+class CircuitOpen(TelegramNetworkError):
+    """Вызов низкого приоритета отброшен: API сейчас отвечает ошибками."""
+
+
+class CircuitBreaker:
+    """closed -> open: за последние window секунд не меньше min_calls попыток,
+    и доля временных ошибок (5xx, сеть) не ниже ratio. RetryAfter не считается:
+    это лимит на чат, а не отказ API. open держится cooldown секунд, затем
+    half-open — первый же исход решает: успех закрывает, ошибка открывает снова.
+    Вне closed allow() отказывает методам из LOW_PRIORITY, остальные идут как шли
+    и служат пробой."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+    STATES = (CLOSED, OPEN, HALF_OPEN)
+
+    def __init__(self, window: float = 10.0, min_calls: int = 20, ratio: float = 0.5, cooldown: float = 15.0):
+        self.window = window
+        self.min_calls = min_calls
+        self.ratio = ratio
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.opened = 0                                   # сколько раз размыкался
+        self._events: Deque[Tuple[float, bool]] = deque()  # (monotonic, удачно)
+        self._failures = 0
+
+    def allow(self, method: str, at: float) -> bool:
+        if self.state == self.OPEN and at - self.opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+        return self.state == self.CLOSED or method not in LOW_PRIORITY
+
+    def record(self, ok: bool, at: float) -> None:
+        if self.state == self.HALF_OPEN:
+            self._close() if ok else self._open(at, "probe failed")
+            return
+        if self.state == self.OPEN:
+            return
+        self._events.append((at, ok))
+        self._failures += not ok
+        while at - self._events[0][0] > self.window:
+            self._failures -= not self._events.popleft()[1]
+        if len(self._events) >= self.min_calls and self._failures >= self.ratio * len(self._events):
+            self._open(at, f"{self._failures} of {len(self._events)} calls failed")
+
+    def _open(self, at: float, why: str) -> None:
+        log.warning("Bot API degraded (%s): shedding %s for %.0fs", why, ", ".join(sorted(LOW_PRIORITY)), self.cooldown)
+        self.state, self.opened_at = self.OPEN, at
+        self.opened += 1
+        self._events.clear()
+        self._failures = 0
+
+    def _close(self) -> None:
+        log.info("Bot API recovered: circuit closed")
+        self.state = self.CLOSED
+
+
+class ResilientSession(AiohttpSession):
+    """AiohttpSession, которая сама переживает временные ошибки.
+
+    5xx и сетевые ошибки повторяются до max_attempts попыток с паузой full jitter:
+    random(0, min(max_backoff, backoff * 2^n)) — всплеск ошибок не превращается
+    в синхронный залп повторов. RetryAfter ждёт ровно retry_after, если он не
+    длиннее max_retry_after; длинный уходит вызывающему — Outbound ставит на паузу
+    чат, Outbox откладывает уведомление, а слот сессии не висит минутами.
+
+    Для request-middleware (ApiMetrics) это один вызов со всеми повторами;
+    каждая попытка — в attempt_ms, исходы и повторы — в calls и retries.
+    """
+
+    def __init__(self, max_attempts: int = 4, backoff: float = 0.5, max_backoff: float = 5.0,
+                 max_retry_after: float = 5.0, keepalive: float = 60.0, dns_ttl: int = 300,
+                 breaker: Optional[CircuitBreaker] = None, **kwargs):
+        super().__init__(**kwargs)
+        # Telegram держит keep-alive долго: переиспользуем TLS-соединения, а не открываем новые
+        self._connector_init.update(keepalive_timeout=keepalive, ttl_dns_cache=dns_ttl, use_dns_cache=True)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.breaker = breaker or CircuitBreaker()
+        self.calls: Dict[Tuple[str, str], int] = {}      # (method, ok|error|shed)
+        self.retries: Dict[Tuple[str, str], int] = {}    # (method, причина)
+        self.attempt_ms: Dict[str, Histogram] = {}
+
+    def _count(self, table: dict, key: tuple) -> None:
+        table[key] = table.get(key, 0) + 1
+
+    def _observe(self, name: str, ms: float) -> None:
+        h = self.attempt_ms.get(name)
+        if h is None:
+            h = self.attempt_ms[name] = Histogram()
+        h.observe(ms)
+
+    def delay(self, attempt: int, e: Exception) -> Optional[float]:
+        """Пауза перед попыткой attempt + 1; None — не повторять."""
+        if isinstance(e, TelegramRetryAfter):
+            return e.retry_after + random.uniform(0, self.backoff) if e.retry_after <= self.max_retry_after else None
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    async def make_request(self, bot, method, timeout: Optional[int] = None):
+        name = method.__api_method__
+        if not self.breaker.allow(name, time.monotonic()):
+            self._count(self.calls, (name, "shed"))
+            raise CircuitOpen(method=method, message="Bot API degraded, low-priority call shed")
+        attempt = 0
+        while True:
+            attempt += 1
+            t0 = time.monotonic()
+            try:
+                result = await super().make_request(bot, method, timeout)
+            except Exception as e:
+                at = time.monotonic()
+                self._observe(name, (at - t0) * 1000)
+                reason = classify(e)
+                if reason != "retry_after":
+                    self.breaker.record(not reason, at)   # 400/403 — API жив и отвечает
+                retry = reason and name not in NO_RETRY and repeatable(name, reason, e)
+                pause = self.delay(attempt, e) if retry else None
+                if pause is None or attempt >= self.max_attempts:
+                    self._count(self.calls, (name, "error"))
+                    raise
+                self._count(self.retries, (name, reason))
+                await asyncio.sleep(pause)
+                continue
+            at = time.monotonic()
+            self._observe(name, (at - t0) * 1000)
+            self.breaker.record(True, at)
+            self._count(self.calls, (name, "ok"))
+            return result
+
+    def circuit(self) -> Dict[str, int]:
+        return {s: int(s == self.breaker.state) for s in self.breaker.STATES}
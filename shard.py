@@ -0,0 +1,416 @@
+# shard.py — пул процессов bot.py за serve.py: апдейт -> шард, связь шардов между собой
+import asyncio
+import contextlib
+import inspect
+import itertools
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+log = logging.getLogger("shard")
+
+# кадр: длина payload, тип; U — сырой JSON апдейта, C — JSON служебного сообщения
+HEADER = struct.Struct(">Ic")
+UPDATE, CONTROL = b"U", b"C"
+SEQ = struct.Struct(">Q")   # payload U начинается с номера апдейта: по нему "done" и повтор
+SUPERVISOR = -1   # адрес serve.py в вызовах
+# callback_data, в которых второй элемент — id сделки (keyboards.py)
+DEAL_CALLBACKS = ("deal:", "paid:", "finish:", "memo:")
+
+FeedFn = Callable[[bytes], Awaitable[None]]
+
+
+def shard_of(key, n: int) -> int:
+    # crc32, а не hash(): hash строк солится заново в каждом процессе
+    return zlib.crc32(str(key).encode()) % n if n > 1 else 0
+
+
+def deal_of(update: dict) -> Optional[str]:
+    """id сделки, если апдейт про неё: кнопка сделки, /start deal_<id>, inline deal_<id>."""
+    cq = update.get("callback_query")
+    if cq is not None:
+        data = cq.get("data") or ""
+        return data.split(":", 2)[1] if data.startswith(DEAL_CALLBACKS) else None
+    msg = update.get("message")
+    if msg is not None:
+        args = (msg.get("text") or "").split(maxsplit=1)
+        if len(args) == 2 and args[0].split("@", 1)[0] == "/start" and args[1].startswith("deal_"):
+            return args[1].split("_", 1)[1]
+        return None
+    iq = update.get("inline_query")
+    if iq is not None:
+        q = (iq.get("query") or "").strip()
+        return q.split("_", 1)[1] if q.startswith("deal_") else None
+    return None
+
+
+def sender_of(update: dict) -> Optional[int]:
+    for event in update.values():
+        if isinstance(event, dict):
+            who = event.get("from") or event.get("user") or event.get("chat") or (event.get("message") or {}).get("chat")
+            if who:
+                return who.get("id")
+    return None
+
+
+def write_frame(writer: asyncio.StreamWriter, kind: bytes, payload: bytes) -> None:
+    writer.write(HEADER.pack(len(payload), kind))
+    writer.write(payload)
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[bytes, bytes]:
+    size, kind = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return kind, await reader.readexactly(size)
+
+
+def send_control(writer: Optional[asyncio.StreamWriter], **msg) -> bool:
+    if writer is None or writer.is_closing():
+        return False
+    write_frame(writer, CONTROL, json.dumps(msg).encode())
+    return True
+
+
+class Calls:
+    """Вызовы между процессами: id -> Future, ответ приходит отдельным кадром."""
+
+    def __init__(self, origin: int):
+        self.origin = origin
+        self.ids = itertools.count(1)
+        self.pending: Dict[int, asyncio.Future] = {}
+
+    async def call(self, writer, to: int, fn: str, args: tuple, timeout: float) -> Any:
+        cid = next(self.ids)
+        fut = self.pending[cid] = asyncio.get_running_loop().create_future()
+        try:
+            if not send_control(writer, op="call", id=cid, to=to, fn=fn, args=list(args), **{"from": self.origin}):
+                raise ConnectionError("shard link is down")
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            self.pending.pop(cid, None)
+
+    def resolve(self, msg: dict) -> None:
+        fut = self.pending.get(msg["id"])
+        if fut is None or fut.done():
+            return   # ответ после таймаута
+        if "error" in msg:
+            fut.set_exception(RuntimeError(msg["error"]))
+        else:
+            fut.set_result(msg.get("result"))
+
+    @staticmethod
+    def serve(writer, msg: dict, handlers: Dict[str, Callable]) -> Optional[asyncio.Task]:
+        """Обычный обработчик отвечает сразу; async — задачей, её и возвращаем."""
+        try:
+            result = handlers[msg["fn"]](*msg["args"])
+        except Exception as e:
+            Calls._reply(writer, msg, error=repr(e))
+            return None
+        if inspect.isawaitable(result):
+            return asyncio.ensure_future(Calls._finish(writer, msg, result))
+        Calls._reply(writer, msg, result=result)
+        return None
+
+    @staticmethod
+    async def _finish(writer, msg: dict, result: Awaitable) -> None:
+        try:
+            Calls._reply(writer, msg, result=await result)
+        except Exception as e:
+            Calls._reply(writer, msg, error=repr(e))
+
+    @staticmethod
+    def _reply(writer, msg: dict, **outcome) -> None:
+        send_control(writer, op="reply", id=msg["id"], to=msg["from"], **outcome)
+
+
+class ShardPool:
+    """Сторона serve.py: апдейт -> шард -> очередь -> соединение воркера.
+
+    Ключ шарда — id отправителя, а у апдейтов про сделку — id сделки: сделка
+    живёт там, где её создали (bot.new_deal_id подбирает id под свой шард), и
+    кнопки продавца из другого шарда идут туда же. Текст без команды уходит
+    туда, где у пользователя открыт сценарий FSM: воркер держит pin на время
+    сценария.
+
+    Поток ограничен окном: воркеру уходит не больше window апдейтов без "done".
+    Пока воркер перезапускается, его апдейты ждут в очереди queue_size; polling
+    при полной очереди их теряет (route(block=False)), вебхук — ждёт.
+
+    Отправленные, но не подтверждённые апдейты соединение держит у себя; если
+    оно оборвалось (воркер упал), они уходят следующему воркеру шарда первыми.
+    Доставка — не меньше одного раза: апдейт, обработанный до падения, но не
+    успевший попасть в "done", придёт повторно.
+    """
+
+    def __init__(self, n: int, path: str, queue_size: int = 1000, window: int = 64):
+        self.n = n
+        self.path = path
+        self.window = window
+        self.queues = [asyncio.Queue(queue_size) for _ in range(n)]
+        self.links: List[Optional[asyncio.StreamWriter]] = [None] * n
+        self.pumps: List[Optional[asyncio.Task]] = [None] * n
+        self.seq = itertools.count(1)
+        # номер -> апдейт: отправлены текущему соединению шарда и ждут "done"
+        self.unacked: List["OrderedDict[int, bytes]"] = [OrderedDict() for _ in range(n)]
+        self.replay: List[Dict[int, bytes]] = [{} for _ in range(n)]   # от оборванных соединений
+        self.replayed = 0
+        self.credit = [asyncio.Event() for _ in range(n)]
+        self.pins: Dict[int, Tuple[int, float]] = {}   # user_id -> (шард, до какого времени)
+        self.routed = [0] * n
+        self.routes = {"user": 0, "deal": 0, "pin": 0}
+        self.dropped = 0
+        self.calls = Calls(SUPERVISOR)
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self._accept, self.path)
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+        for writer in self.links:
+            if writer is not None:
+                writer.close()
+
+    # --- маршрут ---
+    def shard_for(self, update: dict) -> int:
+        deal = deal_of(update)
+        if deal is not None:
+            self.routes["deal"] += 1
+            return shard_of(deal, self.n)
+        uid = sender_of(update)
+        msg = update.get("message")
+        if uid in self.pins and msg is not None and not (msg.get("text") or "").startswith("/"):
+            shard, until = self.pins[uid]
+            if until > time.time():
+                self.routes["pin"] += 1
+                return shard
+            del self.pins[uid]
+        self.routes["user"] += 1
+        return shard_of(uid if uid is not None else update.get("update_id"), self.n)
+
+    async def route(self, update: dict, raw: Optional[bytes] = None, block: bool = True) -> bool:
+        i = self.shard_for(update)
+        raw = raw or json.dumps(update).encode()
+        if block:
+            await self.queues[i].put(raw)
+        else:
+            try:
+                self.queues[i].put_nowait(raw)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                log.warning("shard %d backlog is full, update %s dropped", i, update.get("update_id"))
+                return False
+        self.routed[i] += 1
+        return True
+
+    async def call(self, shard: int, fn: str, *args, timeout: float = 2.0) -> Any:
+        return await self.calls.call(self.links[shard], shard, fn, args, timeout)
+
+    # --- соединения воркеров ---
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        i = None
+        unacked: "OrderedDict[int, bytes]" = OrderedDict()
+        try:
+            kind, payload = await read_frame(reader)
+            i = json.loads(payload)["shard"]
+            self._detach(i)   # прежнее соединение этого шарда, если воркер перезапустился
+            self.links[i], self.unacked[i] = writer, unacked
+            self._start_pump(i)
+            while True:
+                kind, payload = await read_frame(reader)
+                self._control(i, json.loads(payload), unacked)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if i is not None:
+                if self.links[i] is writer:
+                    self._detach(i)
+                if unacked:
+                    self._requeue(i, unacked)
+            writer.close()
+
+    def _requeue(self, i: int, unacked: Dict[int, bytes]) -> None:
+        # соединение закрыто: "done" на эти апдейты уже не придёт
+        log.warning("shard %d: link lost with %d unacknowledged updates, replaying them", i, len(unacked))
+        self.replayed += len(unacked)
+        self.replay[i].update(unacked)
+        unacked.clear()
+        if self.links[i] is not None:
+            self._start_pump(i)   # новый воркер уже на связи: pump может ждать пустую очередь
+
+    def _start_pump(self, i: int) -> None:
+        if self.pumps[i] is not None:
+            self.pumps[i].cancel()
+        self.pumps[i] = asyncio.create_task(self._pump(i, self.links[i], self.unacked[i]))
+
+    def _detach(self, i: int) -> None:
+        if self.pumps[i] is not None:
+            self.pumps[i].cancel()
+        self.links[i] = self.pumps[i] = None
+
+    def _take(self, i: int) -> Optional[Tuple[int, bytes]]:
+        replay = self.replay[i]
+        if replay:
+            seq = min(replay)
+            return seq, replay.pop(seq)
+        if self.queues[i].empty():
+            return None
+        return next(self.seq), self.queues[i].get_nowait()
+
+    async def _pump(self, i: int, writer: asyncio.StreamWriter, unacked: "OrderedDict[int, bytes]") -> None:
+        while True:
+            while len(unacked) >= self.window:
+                self.credit[i].clear()
+                await self.credit[i].wait()
+            item = self._take(i)
+            if item is None:
+                item = next(self.seq), await self.queues[i].get()
+            # между get и write нет await: отмена pump'а не теряет апдейт
+            while item is not None:
+                seq, raw = item
+                write_frame(writer, UPDATE, SEQ.pack(seq) + raw)
+                unacked[seq] = raw
+                item = self._take(i) if len(unacked) < self.window else None
+            await writer.drain()
+
+    def _control(self, i: int, msg: dict, unacked: Dict[int, bytes]) -> None:
+        op = msg["op"]
+        if op == "done":
+            for seq in msg["ids"]:
+                unacked.pop(seq, None)
+            self.credit[i].set()
+        elif op == "pin":
+            self.pins[msg["uid"]] = (i, time.time() + msg["ttl"])
+        elif op == "unpin":
+            if self.pins.get(msg["uid"], (None,))[0] == i:
+                del self.pins[msg["uid"]]
+        elif op == "drain":
+            # воркер останавливается: остаток очереди дождётся следующего запуска
+            self._detach(i)
+        elif op == "call":
+            msg["from"] = i
+            if not send_control(self.links[msg["to"]] if 0 <= msg["to"] < self.n else None, **msg):
+                send_control(self.links[i], op="reply", id=msg["id"], to=i, error=f"shard {msg['to']} is down")
+        elif op == "reply":
+            if msg["to"] == SUPERVISOR:
+                self.calls.resolve(msg)
+            elif 0 <= msg["to"] < self.n:
+                send_control(self.links[msg["to"]], **msg)
+
+    # --- наблюдаемость ---
+    def health(self) -> List[dict]:
+        return [{"shard": i, "connected": self.links[i] is not None, "queue": self.queues[i].qsize(),
+                 "inflight": len(self.unacked[i]), "replay": len(self.replay[i]), "routed": self.routed[i]}
+                for i in range(self.n)]
+
+    def render(self) -> str:
+        lines = ["# TYPE botnew_shard_updates_total counter"]
+        lines += [f'botnew_shard_updates_total{{shard="{i}"}} {n}' for i, n in enumerate(self.routed)]
+        lines.append("# TYPE botnew_shard_queue gauge")
+        lines += [f'botnew_shard_queue{{shard="{i}"}} {q.qsize()}' for i, q in enumerate(self.queues)]
+        lines.append("# TYPE botnew_shard_routes_total counter")
+        lines += [f'botnew_shard_routes_total{{by="{k}"}} {v}' for k, v in self.routes.items()]
+        lines.append("# TYPE botnew_shard_dropped_total counter")
+        lines.append(f"botnew_shard_dropped_total {self.dropped}")
+        lines.append("# TYPE botnew_shard_replayed_total counter")
+        lines.append(f"botnew_shard_replayed_total {self.replayed}")
+        return "\n".join(lines) + "\n"
+
+
+class ShardLink:
+    """Сторона воркера: апдейты из serve.py -> feed в concurrency задач;
+    pin/unpin, вызовы других шардов и ответы на них — тем же соединением."""
+
+    def __init__(self, path: str, index: int, feed: FeedFn, handlers: Dict[str, Callable],
+                 concurrency: int = 32):
+        self.path = path
+        self.index = index
+        self.feed = feed
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.queue: asyncio.Queue = asyncio.Queue()   # размер держит окно serve.py
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.workers: List[asyncio.Task] = []
+        self.calls = Calls(index)
+        self.serving: set = set()   # async-обработчики вызовов, ещё без ответа
+        self._done: List[int] = []
+        self.received = self.processed = self.failed = 0
+
+    async def run(self) -> None:
+        """До закрытия соединения serve.py (он сам завершился) или отмены."""
+        reader, self.writer = await asyncio.open_unix_connection(self.path)
+        send_control(self.writer, op="hello", shard=self.index)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        try:
+            while True:
+                kind, payload = await read_frame(reader)
+                if kind == UPDATE:
+                    self.received += 1
+                    self.queue.put_nowait((SEQ.unpack_from(payload)[0], payload[SEQ.size:]))
+                    continue
+                msg = json.loads(payload)
+                if msg["op"] == "call":
+                    task = Calls.serve(self.writer, msg, self.handlers)
+                    if task is not None:
+                        self.serving.add(task)
+                        task.add_done_callback(self.serving.discard)
+                elif msg["op"] == "reply":
+                    self.calls.resolve(msg)
+        except asyncio.IncompleteReadError:
+            log.warning("shard %d: supervisor closed the link", self.index)
+
+    async def stop(self, timeout: float = 10) -> None:
+        # serve.py перестаёт слать, дорабатываем принятое
+        send_control(self.writer, op="drain")
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("shard %d stop: %s updates left unprocessed", self.index, self.queue.qsize())
+        for w in self.workers:
+            w.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        if self.serving:
+            await asyncio.wait(self.serving, timeout=timeout)   # панели для других шардов
+        if self.writer is not None:
+            self.writer.close()
+
+    async def _worker(self) -> None:
+        while True:
+            seq, raw = await self.queue.get()
+            try:
+                await self.feed(raw)
+            except Exception:
+                self.failed += 1
+                log.exception("shard %d: update failed", self.index)
+            finally:
+                self.processed += 1
+                self.queue.task_done()
+                if not self._done:
+                    asyncio.get_running_loop().call_soon(self._ack)
+                self._done.append(seq)
+
+    def _ack(self) -> None:
+        # "done" одним кадром за оборот loop'а, а не на каждый апдейт
+        ids, self._done = self._done, []
+        send_control(self.writer, op="done", ids=ids)
+
+    def pin(self, uid: int, ttl: float) -> None:
+        send_control(self.writer, op="pin", uid=uid, ttl=ttl)
+
+    def unpin(self, uid: int) -> None:
+        send_control(self.writer, op="unpin", uid=uid)
+
+    async def call(self, shard: int, fn: str, *args, timeout: float = 1.0) -> Any:
+        return await self.calls.call(self.writer, shard, fn, args, timeout)
+
+    def stats(self) -> Dict[str, int]:
+        return {"received": self.received, "processed": self.processed, "failed": self.failed,
+                "queue": self.queue.qsize()}
@@ -0,0 +1,72 @@
+# snapshot.py — бинарный снимок Memory для тёплого рестарта
+import gc
+import os
+import pickle
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+MAGIC = b"BOTNEW-SNAPSHOT 1\n"
+BATCH = 4096   # записей в кадре: столько максимум декодируется за раз
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def write_snapshot(path: str, sections: Iterable[Tuple[str, Iterable[Tuple[Any, Any]]]], batch: int = BATCH) -> int:
+    """Пишет секции кадрами по batch записей: каждый кадр — отдельный pickle,
+    так что ни запись, ни чтение не держат весь снимок целиком. Файл
+    появляется атомарно (tmp + fsync + rename). -> число записей."""
+    tmp = path + ".tmp"
+    enabled = gc.isenabled()
+    gc.disable()   # кортежи состояний и кадры — сплошь новые контейнеры, сборщику тут делать нечего
+    try:
+        total = _write(tmp, sections, batch)
+    finally:
+        if enabled:
+            gc.enable()
+    os.replace(tmp, path)
+    return total
+
+
+def _write(tmp: str, sections: Iterable[Tuple[str, Iterable[Tuple[Any, Any]]]], batch: int) -> int:
+    total = 0
+    with open(tmp, "wb", buffering=1 << 20) as f:
+        f.write(MAGIC)
+
+        def dump(section: Optional[str], payload) -> None:
+            pickle.dump((section, payload), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        for section, items in sections:
+            chunk: List[Tuple[Any, Any]] = []
+            for item in items:
+                chunk.append(item)
+                if len(chunk) >= batch:
+                    dump(section, chunk)
+                    total += len(chunk)
+                    chunk = []
+            if chunk:
+                dump(section, chunk)
+                total += len(chunk)
+        dump(None, total)   # без завершающего кадра снимок считается обрезанным
+        f.flush()
+        os.fsync(f.fileno())
+    return total
+
+
+def read_snapshot(path: str) -> Iterator[Tuple[str, List[Tuple[Any, Any]]]]:
+    """Кадры по одному; в памяти одновременно только текущий."""
+    with open(path, "rb", buffering=1 << 20) as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise SnapshotError(f"{path}: not a snapshot")
+        seen = 0
+        while True:
+            try:
+                section, payload = pickle.load(f)
+            except EOFError:
+                raise SnapshotError(f"{path}: truncated after {seen} entries") from None
+            if section is None:
+                if payload != seen:
+                    raise SnapshotError(f"{path}: {seen} entries, trailer says {payload}")
+                return
+            seen += len(payload)
+            yield section, payload
@@ -0,0 +1,163 @@
+# storage.py — хранилища для Memory (секция -> ключ -> значение)
+import json
+import pickle
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# (section, key, blob); blob=None — запись удалена
+Row = Tuple[str, str, Optional[bytes]]
+
+
+def encode(value) -> bytes:
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def decode(blob: bytes):
+    return pickle.loads(blob)
+
+
+# JSON — для общего store (redis://): его читают все инстансы, и pickle из него
+# выполнил бы чужой код. Записи (Deal, Notice, ...) регистрируют свои модули:
+# в JSON они {"$t": метка, "v": простые типы}. Запись — само значение или
+# элементы списка (история); прочие кортежи, как и в JSON, — списки.
+TAG = "$t"
+_DUMP: Dict[type, Tuple[str, Callable[[Any], Any]]] = {}
+_LOAD: Dict[str, Callable[[Any], Any]] = {}
+
+
+def register(cls: type, dump: Optional[Callable[[Any], Any]] = None,
+             load: Optional[Callable[[Any], Any]] = None) -> None:
+    """По умолчанию — для NamedTuple: в dict полей и обратно."""
+    _DUMP[cls] = (cls.__name__, dump or cls._asdict)
+    _LOAD[cls.__name__] = load or (lambda v: cls(**v))
+
+
+def _record(value):
+    rec = _DUMP.get(type(value))
+    return value if rec is None else {TAG: rec[0], "v": rec[1](value)}
+
+
+def _unknown(value):
+    if type(value) in _DUMP:
+        return _record(value)   # Deal внутри dict; NamedTuple глубже JSON пишет просто списком
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+# один энкодер на всё: json.dumps с параметрами собирает его заново на каждый вызов
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=_unknown)
+
+
+def _typed(obj: dict):
+    if TAG not in obj:
+        return obj
+    return _LOAD[obj[TAG]](obj["v"])   # незнакомая метка — KeyError, а не молча dict
+
+
+_decoder = json.JSONDecoder(object_hook=_typed)
+
+
+def encode_json(value) -> bytes:
+    if type(value) is list and value and type(value[0]) in _DUMP:
+        value = [_record(v) for v in value]
+    return _encoder.encode(_record(value)).encode()
+
+
+def decode_json(blob: bytes):
+    return _decoder.decode(blob.decode())
+
+
+class Store:
+    """Базовый интерфейс. persistent=False — flush можно не вызывать вовсе.
+    shared=True — store общий у нескольких инстансов (redisstore.py): кроме
+    секций из local, их изменения видят другие. encode/decode — формат
+    значений: свои файлы — pickle (быстрее), общий store — JSON."""
+    persistent = False
+    shared = False
+    local: Tuple[str, ...] = ()
+    encode = staticmethod(encode)
+    decode = staticmethod(decode)
+
+    def load(self, section: str) -> Iterator[Tuple[str, object]]:
+        return iter(())
+
+    def get(self, section: str, key: str) -> Optional[object]:
+        return None
+
+    def write(self, rows: Iterable[Row]) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStore(Store):
+    """Всё живёт только в dict'ах Memory — поведение как раньше."""
+
+
+class SQLiteStore(Store):
+    persistent = True
+
+    def __init__(self, path: str):
+        # write() зовётся из to_thread, поэтому check_same_thread=False,
+        # а транзакции сериализуем своим локом
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " section TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+            " PRIMARY KEY (section, key)) WITHOUT ROWID"
+        )
+        # точечные чтения с event loop'а — своим соединением: в WAL читатель
+        # не ждёт транзакцию write() из потока
+        self.reader = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+
+    def load(self, section: str) -> Iterator[Tuple[str, object]]:
+        cur = self.conn.execute("SELECT key, value FROM kv WHERE section = ?", (section,))
+        for key, blob in cur:
+            yield key, decode(blob)
+
+    def get(self, section: str, key: str) -> Optional[object]:
+        row = self.reader.execute("SELECT value FROM kv WHERE section = ? AND key = ?", (section, key)).fetchone()
+        return None if row is None else decode(row[0])
+
+    def write(self, rows: Iterable[Row]) -> None:
+        upserts: List[Tuple[str, str, bytes]] = []
+        deletes: List[Tuple[str, str]] = []
+        for section, key, blob in rows:
+            if blob is None:
+                deletes.append((section, key))
+            else:
+                upserts.append((section, key, blob))
+        if not upserts and not deletes:
+            return
+        # один батч — одна транзакция
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                if upserts:
+                    self.conn.executemany(
+                        "INSERT INTO kv (section, key, value) VALUES (?, ?, ?) "
+                        "ON CONFLICT (section, key) DO UPDATE SET value = excluded.value",
+                        upserts,
+                    )
+                if deletes:
+                    self.conn.executemany("DELETE FROM kv WHERE section = ? AND key = ?", deletes)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def close(self) -> None:
+        self.reader.close()
+        with self.lock:
+            self.conn.close()
+
+
+def open_store(path: str, node: str = "") -> Store:
+    if path.startswith("redis://"):
+        from redisstore import RedisStore
+        return RedisStore(path, node)
+    return SQLiteStore(path) if path else MemoryStore()
@@ -0,0 +1,50 @@
+# Дедлайн expires_at снимает сделку в любом активном статусе (бот без сети и store)
+import asyncio
+import os
+import time
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ["STORE_PATH"] = ""
+os.environ["SNAPSHOT_PATH"] = ""
+
+import bot as B  # noqa: E402
+from deals import Deal, Status  # noqa: E402
+
+
+def deal(deal_id: str, status: Status) -> Deal:
+    now = int(time.time())
+    return Deal(deal_id, 70_001, "Gift", "desc", "STARS", "@buyer", created_at=now - 1800, expires_at=now,
+                price_value=5.0, status=status, seller_id=80_001, seller_username="@seller", seller_payto="@payto")
+
+
+class ExpireTest(unittest.TestCase):
+    def expire(self, d: Deal) -> None:
+        B.memory.put_deal(d)
+        asyncio.run(B.on_deadline(d.id, "expires_at"))
+
+    def assert_removed(self, d: Deal) -> None:
+        self.assertNotIn(d.id, B.memory.deals)
+        self.assertFalse(B.memory.deals.has_active_for_creator(d.creator_id, 0))
+        self.assertNotIn((d.id, "expires_at"), B.memory.deadlines)
+
+    def test_await_seller_final_is_removed(self):
+        d = deal("exp_final", Status.AWAIT_SELLER_FINAL)
+        self.expire(d)
+        self.assert_removed(d)
+        self.assertEqual(B.memory.history[d.creator_id][0].id, d.id)
+        self.assertEqual(B.memory.history[d.creator_id][0].status, Status.STOPPED)
+        notified = {n.chat_id for n in B.memory.outbox.pending.values()}
+        self.assertLessEqual({d.creator_id, d.seller_id}, notified)
+
+    def test_await_payment_is_removed(self):
+        d = deal("exp_pay", Status.AWAIT_PAYMENT)
+        self.expire(d)
+        self.assert_removed(d)
+
+    def test_done_is_final(self):
+        self.assertFalse(B.can_transition(Status.DONE, "expire"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+# Апдейты, отправленные упавшему воркеру без "done", достаются следующему
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+from shard import SEQ, UPDATE, ShardPool, read_frame, send_control
+
+
+async def connect(path: str):
+    reader, writer = await asyncio.open_unix_connection(path)
+    send_control(writer, op="hello", shard=0)
+    return reader, writer
+
+
+async def take(reader, n: int):
+    got = []
+    while len(got) < n:
+        kind, payload = await asyncio.wait_for(read_frame(reader), 2)
+        if kind == UPDATE:
+            got.append((SEQ.unpack_from(payload)[0], json.loads(payload[SEQ.size:])["update_id"]))
+    return got
+
+
+class ReplayTest(unittest.TestCase):
+    def test_unacked_updates_replayed_after_crash(self):
+        async def run():
+            with tempfile.TemporaryDirectory() as tmp:
+                pool = ShardPool(1, os.path.join(tmp, "s.sock"), window=8)
+                await pool.start()
+                try:
+                    reader, writer = await connect(pool.path)
+                    for u in range(5):
+                        await pool.route({"update_id": u})
+                    first = await take(reader, 5)
+                    # 0 и 1 обработаны, остальное пропало вместе с воркером
+                    send_control(writer, op="done", ids=[first[0][0], first[1][0]])
+                    await writer.drain()
+                    await asyncio.sleep(0.05)
+                    writer.close()
+                    await asyncio.sleep(0.05)
+                    self.assertEqual(pool.replayed, 3)
+
+                    reader, writer = await connect(pool.path)
+                    await pool.route({"update_id": 5})
+                    second = await take(reader, 4)
+                    self.assertEqual([u for _, u in second], [2, 3, 4, 5])
+                    self.assertEqual(second[:3], first[2:])
+                    send_control(writer, op="done", ids=[seq for seq, _ in second])
+                    await writer.drain()
+                    await asyncio.sleep(0.05)
+                    self.assertEqual(pool.health()[0]["inflight"], 0)
+                    writer.close()
+                    await asyncio.sleep(0.05)
+                    self.assertEqual(pool.replayed, 3)
+                finally:
+                    await pool.stop()
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+# Значения общего store (redis://) — JSON: записи возвращаются своими типами, pickle не читается
+import pickle
+import unittest
+
+from deals import Deal, DealSummary, Status
+from fsmstore import Record
+from outbox import Notice
+from redisstore import RedisStore
+from storage import SQLiteStore
+
+
+class JsonCodecTest(unittest.TestCase):
+    def roundtrip(self, value):
+        return RedisStore.decode(RedisStore.encode(value))
+
+    def test_records(self):
+        d = Deal("d1", 1, "Gift", "desc", "TON", "@seller", created_at=10, expires_at=20, price_value=1.5,
+                 status=Status.AWAIT_PAYMENT, seller_id=2, version=3)
+        back = self.roundtrip(d)
+        self.assertIsInstance(back, Deal)
+        self.assertEqual(back.__getstate__(), d.__getstate__())
+        self.assertIs(back.status, Status.AWAIT_PAYMENT)
+        history = self.roundtrip([d.summary()])
+        self.assertEqual(history, [d.summary()])
+        self.assertIsInstance(history[0], DealSummary)
+        self.assertIs(history[0].status, Status.AWAIT_PAYMENT)
+        notice = Notice(1, "текст", {"inline_keyboard": [[{"text": "ok", "callback_data": "menu"}]]}, True, 5.0)
+        self.assertEqual(self.roundtrip(notice), notice)
+        self.assertEqual(self.roundtrip(Record("S:s", {"deal_id": "d1"}, 30.0)), Record("S:s", {"deal_id": "d1"}, 30.0))
+        self.assertEqual(self.roundtrip({"lang": "en"}), {"lang": "en"})
+
+    def test_pickle_rejected(self):
+        class Boom:
+            def __reduce__(self):
+                return (exec, ("raise SystemExit('executed')",))
+
+        with self.assertRaises(ValueError):
+            RedisStore.decode(pickle.dumps(Boom()))
+
+    def test_local_store_keeps_pickle(self):
+        self.assertEqual(SQLiteStore.decode(SQLiteStore.encode((1, "x"))), (1, "x"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,406 @@
+# texts.py — каталог сообщений: таблицы собираются и компилируются один раз при импорте
+from string import Formatter
+from typing import Dict, Tuple
+
+RU = {
+    "hello": (
+        "👋 <b>MoonGarant</b> — ваш надёжный выбор для сделок с цифровыми подарками и NFT в Telegram.\n\n"
+        "• Создавайте ордера за пару шагов\n"
+        "• Делитесь безопасной ссылкой для продавца\n"
+        "• Авто-таймеры: ссылка — 30 мин, подтверждение — 15 мин\n"
+        "• Красивые карточки и удобные кнопки\n\n"
+        "Выберите действие ниже:"
+    ),
+    "menu": "🏠 <b>Меню</b>",
+
+    # SETTINGS
+    "settings_title": "⚙️ Настройки",
+    "settings_prompt": (
+        "⚙️ <b>Настройки</b>\n\n"
+        "Текущий язык: <b>{lang_name}</b>\n"
+        "Текущий метод оплаты: <b>{pay_method}</b>\n\n"
+        "Выберите метод ниже:"
+    ),
+    "lang_menu_footer": "↩️ В меню / Menu",
+    "lang_ru": "🇷🇺 Русский",
+    "lang_en": "🇬🇧 English",
+
+    "wallet_enter": "👛 <b>Кошелёк</b>\nОтправьте адрес вашего TON-кошелька.",
+    "wallet_saved": "✅ Кошелёк сохранён: <code>{addr}</code>",
+    "wallet_invalid": "⚠️ Похоже, это не TON-адрес. Попробуйте снова.",
+    "deal_expired": "⏳ Срок действия ордера истёк.",
+    "deal_changed": "⚠️ Ордер уже изменился — действие не применено.",
+    "payment_timeout": "⌛ Время на оплату по ордеру <b>{title}</b> истекло. Сделка отменена.",
+
+    # Deep-link / creator self-open
+    "creator_open_link": "ℹ️ Вы уже являетесь создателем этого ордера.\nОтправьте ссылку второму участнику сделки.",
+
+    # Seller invite flow
+    "seller_invite": (
+        "👋 Вы приглашены в сделку в <b>MoonGarant</b>.\n\n"
+        "🧾 <b>Ордер</b>\n"
+        "<b>Название:</b> {title}\n"
+        "<b>Описание:</b> {desc}\n"
+        "<b>Оплата:</b> {price_label}\n\n"
+        "Если согласны — нажмите «Принять»."
+    ),
+    "accept_short": "✅ Принять",
+    "decline_short": "❌ Отклонить",
+    "seller_declined": "❌ Продавец отклонил приглашение. Сделка отменена.",
+    "buyer_seller_declined": "❌ Продавец отклонил ордер <b>{title}</b>.",
+
+    "accept_btn": "✅ Принять ордер",
+    "seller_details": (
+        "🧾 <b>Ордер</b>\n"
+        "<b>Название:</b> {title}\n"
+        "<b>Описание:</b> {desc}\n"
+        "<b>Цена/условия:</b> {price_label}\n"
+        "<b>Отправить NFT (покупателю):</b> {target}\n\n"
+        "После передачи нажмите «Я перевёл(а) подарки»."
+    ),
+    "seller_stopped": "⛔️ Продавец остановил ордер. Сделка отменена.",
+    "buyer_seller_stopped": "⛔️ Продавец остановил ордер <b>{title}</b>.",
+    "seller_payto_first": "Сначала укажите реквизиты.",
+    "confirm_processing": "⏳ Обработка подтверждения...",
+    "seller_confirmed_wait": "✅ Отправка подарков подтверждена.\n⌛ <b>Ожидайте оплату, не более 15 минут...</b>",
+    "seller_final_needed": "💳 Покупатель отметил оплату.\nЕсли получили средства — нажмите «Подтвердить получение оплаты».",
+    "seller_final_done": "🎉 Оплата подтверждена. Сделка завершена!",
+
+    # requisites prompts
+    "ask_requisite_ton": "Укажите <b>TON-адрес</b> вашего кошелька.",
+    "ask_requisite_stars": "Укажите <b>@username</b>, на который принимать ⭐ STARS.",
+    "ask_requisite_fiat": "Укажите <b>номер карты {method}</b> для оплаты.",
+    "ask_requisite_exchange": "Укажите ваши <b>реквизиты для обмена</b> (например: @user в STARS или TON-адрес).",
+    "bad_card": "⚠️ Нужен номер карты (минимум 8 цифр).",
+
+    # Buyer side
+    "buyer_notif_confirmed": "✅ Продавец подтвердил отправку по ордеру <b>{title}</b>.",
+    "buyer_pay_prompt_std": (
+        "🧾 <b>Детали ордера</b>\n"
+        "<b>Название:</b> {title}\n"
+        "<b>Описание:</b> {desc}\n"
+        "<b>Цена:</b> {price_value} {method}\n"
+        "<b>Куда отправить NFT:</b> {target}\n\n"
+        "💳 <b>Оплата</b>\n"
+        "<b>Кошелёк/реквизиты продавца:</b> <code>{seller_wallet}</code>\n"
+        "<b>Комментарий/MEMO:</b> <code>{memo}</code>\n\n"
+        "⚠️ <b>Внимание!</b> Укажите <b>комментарий/MEMO</b> при переводе: <code>{memo}</code> — иначе оплата не будет засчитана!"
+    ),
+    "buyer_pay_prompt_ex": (
+        "🧾 <b>Детали ордера</b>\n"
+        "<b>Название:</b> {title}\n"
+        "<b>Описание:</b> {desc}\n"
+        "<b>Обмен:</b> {exchange_desc}\n"
+        "<b>Куда отправить NFT:</b> {target}\n\n"
+        "💳 <b>Оплата</b>\n"
+        "<b>Реквизиты продавца:</b> <code>{seller_wallet}</code>\n"
+        "<b>Комментарий/MEMO:</b> <code>{memo}</code>\n\n"
+        "⚠️ <b>Внимание!</b> Укажите <b>комментарий/MEMO</b> при переводе: <code>{memo}</code> — иначе оплата не будет засчитана!"
+    ),
+    "buyer_wait_confirm": "⌛ Ожидайте подтверждения получения оплаты продавцом.",
+    "buyer_final_done": "✅ Продавец подтвердил отправку по ордеру <b>{title}</b>.",
+    "buyer_paid_ack": "Отмечено. Ожидаем подтверждения продавца.",
+    "deal_unavailable": "Ордер недоступен.",
+    "memo_unavailable": "MEMO недоступен.",
+    "not_allowed": "Недоступно.",
+    "done": "Готово.",
+    "pay_method_updated": "Метод оплаты обновлён",
+    "share_title": "MoonGarant • Ссылка на сделку",
+    "share_text": "{link}\n\nMoonGarant - ваш выбор в проведении сделок!",
+
+    # Create flow prompts (depend on pay method)
+    "ask_title": "Введите <b>название</b> ордера.",
+    "ask_desc": "Введите <b>описание</b> ордера (содержание подарков).",
+    "ask_price_std": "Введите <b>цену</b> в {method} (например: <code>12.5</code>).",
+    "ask_price_ex": "Укажите <b>условия обмена</b> в формате: <code>100 STARS -> 12 TON</code>.",
+    "ask_user": "Укажите <b>@username</b> покупателя.",
+    "bad_price": "⚠️ Нужно число (можно с точкой).",
+    "bad_user": "⚠️ Укажите username в формате <code>@username</code>.",
+
+    # Final card (buyer side)
+    "final_std": (
+        "🧾 <b>Детали ордера</b>\n\n"
+        "<b>Название:</b> {title}\n"
+        "<b>Описание:</b> {desc}\n"
+        "<b>Цена:</b> {price_value} {method}\n"
+        "<b>Куда отправить NFT:</b> {target}\n\n"
+        "После перехода продавца по ссылке у него будет <b>15 минут</b> на подтверждение отправки.\n\n"
+        "<b>Ссылка:</b> {link}"
+    ),
+    "final_ex": (
+        "🧾 <b>Детали ордера</b>\n\n"
+        "<b>Название:</b> {title}\n"
+        "<b>Описание:</b> {desc}\n"
+        "<b>Обмен:</b> {exchange_desc}\n"
+        "<b>Куда отправить NFT:</b> {target}\n\n"
+        "После перехода продавца по ссылке у него будет <b>15 минут</b> на подтверждение отправки.\n\n"
+        "<b>Ссылка:</b> {link}"
+    ),
+
+    "current_title": "🟡 <b>Текущая сделка</b>",
+    "history_title": "🗂 <b>История сделок</b> (последние 10)",
+    "no_history": "Пока нет завершённых сделок.",
+
+    # Buttons
+    "copy_memo": "📋 Скопировать MEMO",
+    "confirm_paid": "✅ Подтвердить оплату",
+    "confirm_receive": "✅ Подтвердить получение оплаты",
+
+    # Admin
+    "admin_title": "🛡️ <b>Admin Panel</b>\nВыберите действие:",
+    "admin_btn_recent": "📊 Последние сделки",
+    "admin_btn_chatlog": "🕓 История чата пользователя",
+    "admin_btn_purge": "🧹 Удалить сообщения пользователя",
+    "admin_back": "↩️ Назад в панель",
+    "admin_newer": "⬅️ Новее",
+    "admin_older": "Старее ➡️",
+    "admin_enter_user": "Отправьте @username или числовой ID пользователя.",
+    "admin_no_log": "Нет записей чата для этого пользователя.",
+    "admin_purged": "🧹 Удаление завершено. Что смог — удалил.",
+    "admin_purged_count": "🧹 Удалено сообщений: <b>{removed}</b>",
+    "admin_recent_title": "📊 <b>Последние сделки</b>",
+    "admin_recent_empty": "Нет данных.",
+    "admin_chatlog_title": "🕓 <b>История чата</b>",
+    "admin_purge_title": "🧹 <b>Удаление сообщений</b>",
+    "admin_user_not_found": "Не нашёл пользователя. Введите @username или ID ещё раз.",
+    "admin_user_similar": "Похожие: {hits}",
+    "admin_btn_profile": "🔬 Профайлер",
+    "admin_profile_on": "▶️ Включить",
+    "admin_profile_off": "⏹ Выключить",
+    "admin_profile": "🔬 <b>Профайлер</b>: {state}\nДоля апдейтов: {rate}, интервал {interval_ms} мс\n"
+                     "Профилировано апдейтов: {profiled}, семплов: {samples}\nФайлы: <code>{out_dir}</code>",
+    "not_admin": "Доступ ограничен.",
+}
+
+EN = {
+    "hello": (
+        "👋 <b>MoonGarant</b> — your reliable choice for digital gift and NFT deals in Telegram.\n\n"
+        "• Create orders in a couple of steps\n"
+        "• Share a secure link with the seller\n"
+        "• Auto timers: link — 30 min, confirmation — 15 min\n"
+        "• Neat cards and handy buttons\n\n"
+        "Choose an action below:"
+    ),
+    "menu": "🏠 <b>Menu</b>",
+
+    # SETTINGS
+    "settings_title": "⚙️ Settings",
+    "settings_prompt": (
+        "⚙️ <b>Settings</b>\n\n"
+        "Current language: <b>{lang_name}</b>\n"
+        "Current payment method: <b>{pay_method}</b>\n\n"
+        "Choose a method below:"
+    ),
+    "lang_menu_footer": "↩️ В меню / Menu",
+    "lang_ru": "🇷🇺 Русский",
+    "lang_en": "🇬🇧 English",
+
+    "wallet_enter": "👛 <b>Wallet</b>\nSend your TON wallet address.",
+    "wallet_saved": "✅ Wallet saved: <code>{addr}</code>",
+    "wallet_invalid": "⚠️ This does not look like a TON address. Please try again.",
+    "deal_expired": "⏳ The order has expired.",
+    "deal_changed": "⚠️ The order has already changed — action not applied.",
+    "payment_timeout": "⌛ Payment time for order <b>{title}</b> is over. The deal is cancelled.",
+
+    # Deep-link / creator self-open
+    "creator_open_link": "ℹ️ You are already the creator of this order.\nSend the link to the other party.",
+
+    # Seller invite flow
+    "seller_invite": (
+        "👋 You are invited to a deal in <b>MoonGarant</b>.\n\n"
+        "🧾 <b>Order</b>\n"
+        "<b>Title:</b> {title}\n"
+        "<b>Description:</b> {desc}\n"
+        "<b>Payment:</b> {price_label}\n\n"
+        "If you agree, press «Accept»."
+    ),
+    "accept_short": "✅ Accept",
+    "decline_short": "❌ Decline",
+    "seller_declined": "❌ The seller declined the invitation. The deal is cancelled.",
+    "buyer_seller_declined": "❌ The seller declined order <b>{title}</b>.",
+
+    "accept_btn": "✅ Accept order",
+    "seller_details": (
+        "🧾 <b>Order</b>\n"
+        "<b>Title:</b> {title}\n"
+        "<b>Description:</b> {desc}\n"
+        "<b>Price/terms:</b> {price_label}\n"
+        "<b>Send the NFT to (buyer):</b> {target}\n\n"
+        "After the transfer press «I sent the gifts»."
+    ),
+    "seller_stopped": "⛔️ The seller stopped the order. The deal is cancelled.",
+    "buyer_seller_stopped": "⛔️ The seller stopped order <b>{title}</b>.",
+    "seller_payto_first": "Enter your payment details first.",
+    "confirm_processing": "⏳ Processing the confirmation...",
+    "seller_confirmed_wait": "✅ Gift transfer confirmed.\n⌛ <b>Wait for the payment, no more than 15 minutes...</b>",
+    "seller_final_needed": "💳 The buyer marked the payment as sent.\nIf you received the funds, press «Confirm payment received».",
+    "seller_final_done": "🎉 Payment confirmed. The deal is complete!",
+
+    # requisites prompts
+    "ask_requisite_ton": "Enter your <b>TON wallet address</b>.",
+    "ask_requisite_stars": "Enter the <b>@username</b> that receives ⭐ STARS.",
+    "ask_requisite_fiat": "Enter the <b>{method} card number</b> for the payment.",
+    "ask_requisite_exchange": "Enter your <b>exchange details</b> (e.g. @user for STARS or a TON address).",
+    "bad_card": "⚠️ A card number is required (at least 8 digits).",
+
+    # Buyer side
+    "buyer_notif_confirmed": "✅ The seller confirmed the transfer for order <b>{title}</b>.",
+    "buyer_pay_prompt_std": (
+        "🧾 <b>Order details</b>\n"
+        "<b>Title:</b> {title}\n"
+        "<b>Description:</b> {desc}\n"
+        "<b>Price:</b> {price_value} {method}\n"
+        "<b>Send the NFT to:</b> {target}\n\n"
+        "💳 <b>Payment</b>\n"
+        "<b>Seller wallet/details:</b> <code>{seller_wallet}</code>\n"
+        "<b>Comment/MEMO:</b> <code>{memo}</code>\n\n"
+        "⚠️ <b>Attention!</b> Put the <b>comment/MEMO</b> into the transfer: <code>{memo}</code> — otherwise the payment will not be counted!"
+    ),
+    "buyer_pay_prompt_ex": (
+        "🧾 <b>Order details</b>\n"
+        "<b>Title:</b> {title}\n"
+        "<b>Description:</b> {desc}\n"
+        "<b>Exchange:</b> {exchange_desc}\n"
+        "<b>Send the NFT to:</b> {target}\n\n"
+        "💳 <b>Payment</b>\n"
+        "<b>Seller details:</b> <code>{seller_wallet}</code>\n"
+        "<b>Comment/MEMO:</b> <code>{memo}</code>\n\n"
+        "⚠️ <b>Attention!</b> Put the <b>comment/MEMO</b> into the transfer: <code>{memo}</code> — otherwise the payment will not be counted!"
+    ),
+    "buyer_wait_confirm": "⌛ Wait for the seller to confirm the payment.",
+    "buyer_final_done": "✅ The seller confirmed the transfer for order <b>{title}</b>.",
+    "buyer_paid_ack": "Noted. Waiting for the seller to confirm.",
+    "deal_unavailable": "The order is unavailable.",
+    "memo_unavailable": "MEMO is unavailable.",
+    "not_allowed": "Not available.",
+    "done": "Done.",
+    "pay_method_updated": "Payment method updated",
+    "share_title": "MoonGarant • Deal link",
+    "share_text": "{link}\n\nMoonGarant - your choice for safe deals!",
+
+    # Create flow prompts (depend on pay method)
+    "ask_title": "Enter the order <b>title</b>.",
+    "ask_desc": "Enter the order <b>description</b> (what gifts are included).",
+    "ask_price_std": "Enter the <b>price</b> in {method} (e.g. <code>12.5</code>).",
+    "ask_price_ex": "Enter the <b>exchange terms</b> as: <code>100 STARS -> 12 TON</code>.",
+    "ask_user": "Enter the buyer's <b>@username</b>.",
+    "bad_price": "⚠️ A number is required (a dot is allowed).",
+    "bad_user": "⚠️ Enter the username as <code>@username</code>.",
+
+    # Final card (buyer side)
+    "final_std": (
+        "🧾 <b>Order details</b>\n\n"
+        "<b>Title:</b> {title}\n"
+        "<b>Description:</b> {desc}\n"
+        "<b>Price:</b> {price_value} {method}\n"
+        "<b>Send the NFT to:</b> {target}\n\n"
+        "Once the seller opens the link they will have <b>15 minutes</b> to confirm the transfer.\n\n"
+        "<b>Link:</b> {link}"
+    ),
+    "final_ex": (
+        "🧾 <b>Order details</b>\n\n"
+        "<b>Title:</b> {title}\n"
+        "<b>Description:</b> {desc}\n"
+        "<b>Exchange:</b> {exchange_desc}\n"
+        "<b>Send the NFT to:</b> {target}\n\n"
+        "Once the seller opens the link they will have <b>15 minutes</b> to confirm the transfer.\n\n"
+        "<b>Link:</b> {link}"
+    ),
+
+    "current_title": "🟡 <b>Current deal</b>",
+    "history_title": "🗂 <b>Deal history</b> (last 10)",
+    "no_history": "No completed deals yet.",
+
+    # Buttons
+    "copy_memo": "📋 Copy MEMO",
+    "confirm_paid": "✅ Confirm payment",
+    "confirm_receive": "✅ Confirm payment received",
+
+    # Admin
+    "admin_title": "🛡️ <b>Admin Panel</b>\nChoose an action:",
+    "admin_btn_recent": "📊 Recent deals",
+    "admin_btn_chatlog": "🕓 User chat history",
+    "admin_btn_purge": "🧹 Delete user messages",
+    "admin_back": "↩️ Back to panel",
+    "admin_newer": "⬅️ Newer",
+    "admin_older": "Older ➡️",
+    "admin_enter_user": "Send the user's @username or numeric ID.",
+    "admin_no_log": "No chat records for this user.",
+    "admin_purged": "🧹 Deletion finished. Removed what I could.",
+    "admin_purged_count": "🧹 Messages deleted: <b>{removed}</b>",
+    "admin_recent_title": "📊 <b>Recent deals</b>",
+    "admin_recent_empty": "No data.",
+    "admin_chatlog_title": "🕓 <b>Chat history</b>",
+    "admin_purge_title": "🧹 <b>Message cleanup</b>",
+    "admin_user_not_found": "User not found. Send @username or ID again.",
+    "admin_user_similar": "Similar: {hits}",
+    "admin_btn_profile": "🔬 Profiler",
+    "admin_profile_on": "▶️ Turn on",
+    "admin_profile_off": "⏹ Turn off",
+    "admin_profile": "🔬 <b>Profiler</b>: {state}\nUpdate share: {rate}, interval {interval_ms} ms\n"
+                     "Profiled updates: {profiled}, samples: {samples}\nFiles: <code>{out_dir}</code>",
+    "not_admin": "Access denied.",
+}
+
+LANG_NAME = {"ru": "русский", "en": "english"}
+
+
+class Template:
+    """Шаблон, разобранный string.Formatter при загрузке.
+
+    fields — именованные плейсхолдеры (их сверяет _check_catalog). render(**kw)
+    — str.format_map по готовому тексту: лишние аргументы игнорируются,
+    отсутствующий — KeyError. Позиционные и составные поля ({0}, {a.b},
+    {a[0]}) отвергаются при загрузке.
+    """
+    __slots__ = ("key", "text", "fields")
+
+    def __init__(self, key: str, text: str):
+        self.key = key
+        self.text = text
+        fields = []
+        for _literal, field, spec, _conv in Formatter().parse(text):
+            if field is None:
+                continue
+            if not field.isidentifier():
+                raise ValueError(f"template {key!r}: only named fields are supported, got {{{field}}}")
+            if "{" in (spec or ""):
+                raise ValueError(f"template {key!r}: unsupported format spec {spec!r}")
+            if field not in fields:
+                fields.append(field)
+        self.fields: Tuple[str, ...] = tuple(fields)
+
+    def render(self, **kw) -> str:
+        return self.text.format_map(kw)
+
+    def __str__(self) -> str:
+        return self.text
+
+
+def _compile(table: Dict[str, str]) -> Dict[str, Template]:
+    return {key: Template(key, text) for key, text in table.items()}
+
+
+CATALOG: Dict[str, Dict[str, Template]] = {"ru": _compile(RU), "en": _compile(EN)}
+DEFAULT_LANG = "ru"
+
+
+def _check_catalog() -> None:
+    base = CATALOG[DEFAULT_LANG]
+    for lang, table in CATALOG.items():
+        if table.keys() != base.keys():
+            raise ValueError(f"catalog {lang!r}: keys differ from {DEFAULT_LANG!r}: {sorted(table.keys() ^ base.keys())}")
+        for key, tpl in table.items():
+            if set(tpl.fields) != set(base[key].fields):
+                raise ValueError(f"catalog {lang!r}: placeholders of {key!r} differ: {tpl.fields} vs {base[key].fields}")
+
+
+_check_catalog()
+
+
+def t(lang: str, key: str) -> str:
+    return CATALOG.get(lang, CATALOG[DEFAULT_LANG])[key].text
+
+
+def tf(lang: str, key: str, **kw) -> str:
+    return CATALOG.get(lang, CATALOG[DEFAULT_LANG])[key].render(**kw)
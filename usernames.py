@@ -0,0 +1,98 @@
+# usernames.py — двусторонний индекс user_id <-> @username
+import bisect
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+def fold(handle: str) -> str:
+    # "@Foo_Bar" и "foo_bar" — один и тот же ключ
+    return handle.lstrip("@").casefold()
+
+
+class UsernameIndex:
+    """user_id -> отображаемое имя ("@handle" или "id123") и обратно
+    handle (без @, casefold) -> user_id. Переименование снимает старый handle.
+
+    Для автодополнения в админке — отсортированный список handle'ов. Он
+    строится один раз при первом поиске (загрузка из store идёт без сортировок),
+    дальше новый или снятый handle вставляется/удаляется на месте через bisect.
+    """
+
+    def __init__(self):
+        self._by_id: Dict[int, str] = {}
+        self._by_handle: Dict[str, int] = {}
+        self._sorted: Optional[List[str]] = None
+
+    # --- dict-подобный доступ для Memory.load / collect_dirty ---
+    def get(self, uid: int, default=None):
+        return self._by_id.get(uid, default)
+
+    def __getitem__(self, uid: int) -> str:
+        return self._by_id[uid]
+
+    def __setitem__(self, uid: int, name: str) -> None:
+        self.set(uid, name)
+
+    def __contains__(self, uid: int) -> bool:
+        return uid in self._by_id
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._by_id)
+
+    def items(self):
+        return self._by_id.items()
+
+    # --- изменения ---
+    def set(self, uid: int, name: str) -> bool:
+        """True, если имя пользователя изменилось."""
+        old = self._by_id.get(uid)
+        if old == name:
+            return False
+        if old is not None and old.startswith("@"):
+            key = fold(old)
+            if self._by_handle.get(key) == uid:
+                del self._by_handle[key]
+                self._unsort(key)
+        self._by_id[uid] = name
+        if name.startswith("@"):
+            key = fold(name)
+            if key not in self._by_handle and self._sorted is not None:
+                bisect.insort(self._sorted, key)
+            # handle мог перейти к другому пользователю — побеждает последний
+            self._by_handle[key] = uid
+        return True
+
+    def pop(self, uid: int, default=None):
+        name = self._by_id.pop(uid, None)
+        if name is None:
+            return default
+        if name.startswith("@") and self._by_handle.get(fold(name)) == uid:
+            del self._by_handle[fold(name)]
+            self._unsort(fold(name))
+        return name
+
+    def _unsort(self, key: str) -> None:
+        if self._sorted is None:
+            return
+        i = bisect.bisect_left(self._sorted, key)
+        if i < len(self._sorted) and self._sorted[i] == key:
+            del self._sorted[i]
+
+    # --- поиск ---
+    def find(self, handle: str) -> Optional[int]:
+        return self._by_handle.get(fold(handle))
+
+    def search(self, prefix: str, limit: int = 10) -> List[Tuple[str, int]]:
+        """(handle, user_id) с handle'ом, начинающимся на prefix, по алфавиту."""
+        if self._sorted is None:
+            self._sorted = sorted(self._by_handle)
+        key = fold(prefix)
+        out = []
+        i = bisect.bisect_left(self._sorted, key)
+        while i < len(self._sorted) and len(out) < limit and self._sorted[i].startswith(key):
+            handle = self._sorted[i]
+            out.append((handle, self._by_handle[handle]))
+            i += 1
+        return out
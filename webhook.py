@@ -0,0 +1,88 @@
+# webhook.py — приём апдейтов вебхуком на aiohttp-приложении serve.py
+import asyncio
+import hmac
+import logging
+import time
+from typing import List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookIngest:
+    """POST от Telegram -> проверка секрета -> очередь -> N воркеров feed_update.
+
+    Telegram получает 200 сразу после постановки в очередь; если очередь
+    полна, ответ задерживается — это и есть backpressure для Telegram.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str, concurrency: int = 32, queue_size: int = 1000):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.concurrency = concurrency
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.workers: List[asyncio.Task] = []
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.last_processed: Optional[float] = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.rejected += 1
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception:
+            self.rejected += 1
+            return web.Response(status=400)
+        self.received += 1
+        await self.queue.put(update)
+        return web.Response()
+
+    async def _worker(self) -> None:
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception:
+                self.failed += 1
+                logging.exception("update %s failed", update.update_id)
+            finally:
+                self.processed += 1
+                self.last_processed = time.time()
+                self.queue.task_done()
+
+    def start(self) -> None:
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self, timeout: float = 10) -> None:
+        # дорабатываем то, что уже приняли, потом гасим воркеров
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning("webhook stop: %s updates left unprocessed", self.queue.qsize())
+        for w in self.workers:
+            w.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def alive(self) -> bool:
+        return bool(self.workers) and not any(w.done() for w in self.workers)
+
+    def health(self) -> dict:
+        return {
+            "workers": sum(1 for w in self.workers if not w.done()),
+            "concurrency": self.concurrency,
+            "queue": self.queue.qsize(),
+            "received": self.received,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "last_processed": self.last_processed,
+        }